@@ -23,23 +23,45 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import atexit
+import bz2
+import collections
+import concurrent.futures
+import copy
 import filecmp
 import glob
+import gzip
+import hashlib
+import importlib
+import json
 import logging
+import lzma
 import multiprocessing
+import multiprocessing.connection
 import os
 import platform
+import re
+import select
 import shlex
 import shutil
 import stat
 import subprocess
+import sys
 import tarfile
+import tempfile
+import threading
+import time
+import urllib.error
 import urllib.parse
+import urllib.request
+import uuid
 import zipfile
-from typing import Dict, List, NamedTuple, Optional
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 if platform.system() == "Windows":
     import winreg
+else:
+    import fcntl
 
 
 class ChangeDirectory(object):
@@ -61,10 +83,502 @@ def cd(cwd):
     return ChangeDirectory(cwd)
 
 
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+# cgroup v2 なら自身の cgroup のディレクトリ、v1 なら None を返す
+def _get_cgroup2_dir() -> Optional[str]:
+    text = _read_text("/proc/self/cgroup")
+    if text is None:
+        return None
+    for line in text.split("\n"):
+        if line.startswith("0::"):
+            dir = os.path.join("/sys/fs/cgroup", line[len("0::") :].lstrip("/"))
+            # v1 と v2 が混在している場合、v2 にはコントローラが無いことがある
+            if os.path.exists(os.path.join(dir, "cgroup.controllers")):
+                return dir
+    return None
+
+
+# cgroup で制限されている CPU の数。制限されていない場合は None
+def _get_cgroup_cpu_limit() -> Optional[int]:
+    cgroup_dir = _get_cgroup2_dir()
+    if cgroup_dir is not None:
+        # "max 100000" や "200000 100000"
+        fields = (_read_text(os.path.join(cgroup_dir, "cpu.max")) or "max").split()
+        quota, period = fields[0], fields[1] if len(fields) > 1 else "100000"
+    else:
+        quota = _read_text("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") or "-1"
+        period = _read_text("/sys/fs/cgroup/cpu/cpu.cfs_period_us") or "100000"
+    if quota in ("max", "-1"):
+        return None
+    return max(1, -(-int(quota) // int(period)))
+
+
+# memory.stat の key の値。読めない場合は 0
+def _read_memory_stat(path: str, key: str) -> int:
+    for line in (_read_text(path) or "").split("\n"):
+        fields = line.split()
+        if len(fields) == 2 and fields[0] == key and fields[1].isdigit():
+            return int(fields[1])
+    return 0
+
+
+# cgroup で制限されているメモリの残り（バイト）。制限されていない場合は None
+#
+# 使用量には回収できるページキャッシュも含まれていて、WebRTC や Boost を展開した直後は
+# 制限近くまで増えているので、docker や kubelet の working set と同じように
+# inactive_file（v1 は total_inactive_file）を引いた値を使用量とする。
+def _get_cgroup_memory_available() -> Optional[int]:
+    cgroup_dir = _get_cgroup2_dir()
+    if cgroup_dir is not None:
+        limit = _read_text(os.path.join(cgroup_dir, "memory.max"))
+        usage = _read_text(os.path.join(cgroup_dir, "memory.current"))
+        inactive_file = _read_memory_stat(os.path.join(cgroup_dir, "memory.stat"), "inactive_file")
+    else:
+        limit = _read_text("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+        usage = _read_text("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+        inactive_file = _read_memory_stat(
+            "/sys/fs/cgroup/memory/memory.stat", "total_inactive_file"
+        )
+    if limit is None or not limit.isdigit():
+        return None
+    # 制限が無い場合の v1 は非常に大きな値になっている
+    if int(limit) >= 1 << 60:
+        return None
+    working_set = max(0, int(usage or "0") - inactive_file)
+    return max(0, int(limit) - working_set)
+
+
+# 利用可能なメモリ（バイト）。/proc/meminfo の MemAvailable が読めない場合は None
+def _get_memory_available() -> Optional[int]:
+    text = _read_text("/proc/meminfo")
+    if text is None:
+        return None
+    for line in text.split("\n"):
+        # MemAvailable:    5652628 kB
+        if line.startswith("MemAvailable:"):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+# コンパイルとリンクの 1 ジョブあたりに必要なメモリの見積もり。
+# WebRTC のヘッダーを大量にインクルードするコンパイルや、libwebrtc をリンクする場合の値。
+COMPILE_JOB_MEMORY = 1536 * 1024 * 1024
+LINK_JOB_MEMORY = 4096 * 1024 * 1024
+
+
+class BuildResources(NamedTuple):
+    cpus: int
+    memory: Optional[int]
+    compile_jobs: int
+    link_jobs: int
+
+
+_build_resources: Optional[BuildResources] = None
+
+
+# CPU の数と、利用可能なメモリから、コンパイルとリンクの並列数を決める。
+#
+# CPU の数は、affinity と cgroup の cpu.max の制限を考慮する。
+# メモリは、MemAvailable と cgroup の memory.max の残りの少ない方で、
+# COMPILE_JOB_MEMORY, LINK_JOB_MEMORY で割った数を並列数の上限にする。
+# SORA_BUILD_MEMORY 環境変数（バイト数）が設定されている場合は、それもメモリの上限にする。
+# 最初に呼んだ時に決めた値をログに出して、以降はその値を返す。
+def get_build_resources() -> BuildResources:
+    global _build_resources
+    if _build_resources is not None:
+        return _build_resources
+
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = multiprocessing.cpu_count()
+    cpu_limit = _get_cgroup_cpu_limit()
+    if cpu_limit is not None:
+        cpus = min(cpus, cpu_limit)
+
+    memories = [
+        m for m in [_get_memory_available(), _get_cgroup_memory_available()] if m is not None
+    ]
+    memory_limit = os.environ.get("SORA_BUILD_MEMORY")
+    if memory_limit is not None:
+        memories.append(max(0, int(memory_limit)))
+    memory = min(memories) if len(memories) != 0 else None
+
+    compile_jobs = cpus
+    link_jobs = cpus
+    if memory is not None:
+        compile_jobs = max(1, min(compile_jobs, memory // COMPILE_JOB_MEMORY))
+        link_jobs = max(1, min(link_jobs, memory // LINK_JOB_MEMORY))
+    link_jobs = min(link_jobs, compile_jobs)
+
+    _build_resources = BuildResources(cpus, memory, compile_jobs, link_jobs)
+    memory_str = "unknown" if memory is None else f"{memory / (1 << 30):.1f} GiB"
+    logging.info(
+        f"Build resources: {cpus} CPUs, {memory_str} memory available "
+        f"-> {compile_jobs} compile jobs, {link_jobs} link jobs"
+    )
+    return _build_resources
+
+
+# ビルド時の並列数。
+#
+# run_build_steps() から実行されたステップでは、そのステップに割り当てられた並列数になる。
+# それ以外の場合は get_build_resources() で決めたコンパイルの並列数になる。
+def get_build_jobs() -> int:
+    jobs = os.environ.get("SORA_BUILD_JOBS")
+    if jobs is not None:
+        return max(1, int(jobs))
+    return get_build_resources().compile_jobs
+
+
+CMAKE_JOB_POOLS_ARG = "-DCMAKE_JOB_POOLS="
+
+
+# Ninja でリンクの並列数を制限する CMake の引数。
+#
+# jobserver や -j で指定する並列数はコンパイルとリンクで共通なので、
+# リンクだけ job pool で並列数を減らして、
+# libwebrtc のリンクが同時に走ってメモリが足りなくなるのを防ぐ。
+#
+# 並列数は実行時の空きメモリで変わるので、細かく変わって cmake の configure が
+# やり直しにならないように 2 の冪に切り下げる。
+# cmake_configure() は、この並列数を configure を省略するかどうかの判定に含めず、
+# 前回の並列数の方が大きい場合だけ configure をやり直す。
+def get_cmake_job_pool_args() -> List[str]:
+    link_jobs = max(1, min(get_build_resources().link_jobs, get_build_jobs()))
+    link_jobs = 1 << (link_jobs.bit_length() - 1)
+    return [f"{CMAKE_JOB_POOLS_ARG}link={link_jobs}", "-DCMAKE_JOB_POOL_LINK=link"]
+
+
+# CMAKE_JOB_POOLS の値 "link=2" からリンクの並列数を取り出す
+def _parse_link_job_pool(value: str) -> Optional[int]:
+    for pool in value.split(";"):
+        name, _, size = pool.partition("=")
+        if name == "link" and size.isdigit():
+            return int(size)
+    return None
+
+
+# GNU make の jobserver。
+#
+# start_jobserver() を呼ぶと、並列数の分のトークンを持つパイプ
+# （GNU make 4.4 以降なら名前付きパイプ）を作って MAKEFLAGS 経由で子プロセスに渡すので、
+# 同時に実行している make や ninja が
+# 同じトークンを取り合うことになり、全体の並列数が jobs を超えることが無くなる。
+#
+# jobserver を使っている場合、make や ninja に -j を指定すると jobserver を使わなくなるので、
+# cmake --build の並列数は get_build_jobs_args() で指定すること。
+class Jobserver(object):
+    def __init__(self, auth: str):
+        self.auth = auth
+        self.fds: List[int] = []
+        if auth.startswith("fifo:"):
+            path = auth[len("fifo:") :]
+            self._wfd = os.open(path, os.O_RDWR)
+            # 読み込み用には、自分だけが使うノンブロッキングのファイルディスクリプタを開く
+            self._rfd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        else:
+            rfd, self._wfd = [int(fd) for fd in auth.split(",")]
+            self.fds = [rfd, self._wfd]
+            # パイプのファイルディスクリプタの blocking 設定は子プロセスの make と共有していて、
+            # make はノンブロッキングのままであることを前提にしているので変更してはいけない。
+            # Linux なら /proc/self/fd から同じパイプを別に開いて、
+            # そちらをノンブロッキングで使う。
+            try:
+                self._rfd = os.open(f"/proc/self/fd/{rfd}", os.O_RDONLY | os.O_NONBLOCK)
+            except OSError:
+                self._rfd = rfd
+
+    # トークンを1つ取得する。取得したトークンは release() で返すこと
+    # block=False の場合、トークンが無ければ None を返す
+    def acquire(self, block: bool = True) -> Optional[bytes]:
+        while True:
+            # 他のプロセスと同時に読む可能性があるので、読めるようになるまで select で待ってから
+            # 読み、先に取られていた場合（EAGAIN）はもう一度待つ
+            readable, _, _ = select.select([self._rfd], [], [], None if block else 0)
+            if len(readable) == 0:
+                return None
+            try:
+                token = os.read(self._rfd, 1)
+            except (BlockingIOError, InterruptedError):
+                # 他のプロセスに先に取られた
+                continue
+            if len(token) != 0:
+                return token
+
+    def release(self, token: bytes):
+        os.write(self._wfd, token)
+
+
+_jobserver: Optional[Jobserver] = None
+
+
+def _get_make_version() -> Tuple[int, ...]:
+    make = shutil.which("make")
+    if make is None:
+        return ()
+    try:
+        r = subprocess.run([make, "--version"], stdout=subprocess.PIPE, encoding="utf-8")
+    except OSError:
+        return ()
+    # GNU Make 4.3
+    words = r.stdout.split("\n")[0].split()
+    if len(words) < 3 or words[:2] != ["GNU", "Make"]:
+        return ()
+    return tuple(int(v) for v in words[2].split(".") if v.isdigit())
+
+
+def _parse_jobserver_auth(makeflags: str) -> Optional[str]:
+    auth = None
+    for flag in shlex.split(makeflags):
+        for prefix in ("--jobserver-auth=", "--jobserver-fds="):
+            if flag.startswith(prefix):
+                auth = flag[len(prefix) :]
+    return auth
+
+
+def get_jobserver() -> Optional[Jobserver]:
+    return _jobserver
+
+
+# jobserver を開始する。
+#
+# 親プロセスが既に jobserver を開始していた場合は、それを引き継いで利用する。
+# Windows では利用できないので何もしない。
+def start_jobserver(jobs: Optional[int] = None) -> Optional[Jobserver]:
+    global _jobserver
+    if _jobserver is not None or platform.system() == "Windows":
+        return _jobserver
+
+    auth = _parse_jobserver_auth(os.environ.get("MAKEFLAGS", ""))
+    if auth is not None:
+        try:
+            _jobserver = Jobserver(auth)
+            return _jobserver
+        except (OSError, ValueError):
+            logging.warning(f"Failed to join jobserver {auth}, starting a new one")
+
+    if jobs is None:
+        jobs = get_build_jobs()
+    if _get_make_version() >= (4, 4):
+        # 名前付きパイプなら、ファイルディスクリプタを子プロセスに引き継ぐ必要が無く、
+        # ninja からも使える
+        dir = tempfile.mkdtemp(prefix="sora-jobserver-")
+        path = os.path.join(dir, "fifo")
+        os.mkfifo(path)
+        auth = f"fifo:{path}"
+        pid = os.getpid()
+
+        def cleanup():
+            if os.getpid() == pid:
+                shutil.rmtree(dir, ignore_errors=True)
+
+        atexit.register(cleanup)
+        makeflags = f"-j{jobs} --jobserver-auth={auth}"
+    else:
+        rfd, wfd = os.pipe()
+        os.set_inheritable(rfd, True)
+        os.set_inheritable(wfd, True)
+        auth = f"{rfd},{wfd}"
+        makeflags = f"-j{jobs} --jobserver-fds={auth} --jobserver-auth={auth}"
+
+    _jobserver = Jobserver(auth)
+    # 自身が暗黙のトークンを1つ持っているので、残りの分をパイプに入れておく
+    for _ in range(jobs - 1):
+        _jobserver.release(b"+")
+    os.environ["MAKEFLAGS"] = makeflags
+    logging.info(f"Started jobserver with {jobs} jobs: {auth}")
+    return _jobserver
+
+
+def _get_ninja_version() -> Tuple[int, ...]:
+    ninja = shutil.which("ninja")
+    if ninja is None:
+        return ()
+    try:
+        r = subprocess.run([ninja, "--version"], stdout=subprocess.PIPE, encoding="utf-8")
+    except OSError:
+        return ()
+    # 1.13.1
+    return tuple(int(v) for v in r.stdout.strip().split(".") if v.isdigit())
+
+
+# cmake --build に渡す並列数の引数。
+#
+# jobserver を使っている場合は、make や ninja が jobserver から並列数を決めるので何も指定しない。
+# ただし ninja が jobserver を使えるのは 1.13 以降で、名前付きパイプの場合だけなので、
+# それ以外の場合は -j を指定する。
+def get_build_jobs_args(generator: Optional[str] = None) -> List[str]:
+    if _jobserver is not None:
+        if generator != "Ninja":
+            return []
+        if _jobserver.auth.startswith("fifo:") and _get_ninja_version() >= (1, 13):
+            return []
+    return [f"-j{get_build_jobs()}"]
+
+
+class BuildJobs(object):
+    def __init__(self, jobs: Optional[int]):
+        self._jobs = jobs
+        self._tokens: List[bytes] = []
+
+    def __enter__(self) -> int:
+        jobs = self._jobs if self._jobs is not None else get_build_jobs()
+        if _jobserver is None:
+            return jobs
+        # 暗黙のトークンを1つ持っているので、残りは取得できた分だけ使う
+        while len(self._tokens) < jobs - 1:
+            token = _jobserver.acquire(block=False)
+            if token is None:
+                break
+            self._tokens.append(token)
+        return len(self._tokens) + 1
+
+    def __exit__(self, exctype, excvalue, trace):
+        for token in self._tokens:
+            _jobserver.release(token)
+        self._tokens = []
+        return False
+
+
+# jobserver を理解しないビルドツール（b2 など）に指定する並列数を決める。
+#
+# with build_jobs() as jobs: で、jobserver を使っている場合は jobserver から取得できた
+# トークンの数を、そうでない場合は jobs（デフォルトは get_build_jobs()）を返す。
+# 取得したトークンは with を抜ける時に返す。
+def build_jobs(jobs: Optional[int] = None):
+    return BuildJobs(jobs)
+
+
+# ビルドの各処理にかかった時間の記録。
+#
+# SORA_BUILD_TRACE 環境変数にイベントファイルのパスが設定されている場合、
+# trace_span() の範囲の実行時間を Chrome のトレース形式のイベントとして 1 行ずつ追記する。
+# 環境変数で指定するので、fork したビルドステップや、子プロセスで実行した run.py の処理も
+# 同じファイルに記録される。
+class TraceSpan(object):
+    def __init__(self, name: str, category: str, args: Optional[Dict[str, str]] = None):
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exctype, excvalue, trace):
+        path = os.environ.get("SORA_BUILD_TRACE")
+        if path is None:
+            return False
+        event = {
+            "name": self._name,
+            "cat": self._category,
+            "ph": "X",
+            "ts": int(self._start * 1000000),
+            "dur": int((time.time() - self._start) * 1000000),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {**(self._args or {}), "failed": exctype is not None},
+        }
+        # O_APPEND で 1 回の write で書くので、複数のプロセスやスレッドから書いても混ざらない
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(event) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+        return False
+
+
+def trace_span(name: str, category: str, args: Optional[Dict[str, str]] = None):
+    return TraceSpan(name, category, args)
+
+
+# 関数の実行時間を記録するデコレータ。最初の引数（URL やパス）をスパンの名前に含める
+def traced(category: str):
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            if "SORA_BUILD_TRACE" not in os.environ:
+                return func(*args, **kwargs)
+            target = str(args[0]) if len(args) != 0 else ""
+            name = f"{func.__name__} {os.path.basename(target.rstrip('/'))}".strip()
+            with trace_span(name, category, {"target": target}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# トレースを開始する。
+#
+# 終了時に、記録したイベントを Chrome のトレース形式（chrome://tracing や Perfetto で開ける）で
+# output に書き出し、時間のかかった処理の上位 top 件を output と同じディレクトリの
+# trace-summary.txt に書き出す。
+def start_trace(output: str, top: int = 20):
+    if "SORA_BUILD_TRACE" in os.environ:
+        # 親プロセスで既にトレースしている場合はそちらに記録する
+        return
+    events_path = f"{output}.events.jsonl"
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    if os.path.exists(events_path):
+        os.remove(events_path)
+    os.environ["SORA_BUILD_TRACE"] = events_path
+    pid = os.getpid()
+    start = time.time()
+
+    def finish():
+        if os.getpid() != pid:
+            return
+        events = []
+        if os.path.exists(events_path):
+            with open(events_path) as f:
+                events = [json.loads(line) for line in f if len(line.strip()) != 0]
+        events.append(
+            {
+                "name": "total",
+                "cat": "total",
+                "ph": "X",
+                "ts": int(start * 1000000),
+                "dur": int((time.time() - start) * 1000000),
+                "pid": pid,
+                "tid": threading.get_ident(),
+                "args": {},
+            }
+        )
+        with open(output, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        if os.path.exists(events_path):
+            os.remove(events_path)
+        summary = format_trace_summary(events, top)
+        with open(os.path.join(os.path.dirname(output), "trace-summary.txt"), "w") as f:
+            f.write(summary)
+        logging.info(f"Trace written to {output}\n{summary}")
+
+    atexit.register(finish)
+
+
+def format_trace_summary(events: List[dict], top: int) -> str:
+    events = sorted(events, key=lambda e: e["dur"], reverse=True)[:top]
+    lines = [f"Top {len(events)} slowest steps:"]
+    for e in events:
+        lines.append(f"{e['dur'] / 1000000:10.2f}s  {e['cat']:<10} {e['name']}")
+    return "\n".join(lines) + "\n"
+
+
 def cmd(args, **kwargs):
     logging.debug(f"+{args} {kwargs}")
     if "check" not in kwargs:
         kwargs["check"] = True
+    if _jobserver is not None and len(_jobserver.fds) != 0 and "pass_fds" not in kwargs:
+        # パイプの jobserver は、ファイルディスクリプタを子プロセスに引き継ぐ必要がある
+        kwargs["pass_fds"] = _jobserver.fds
     if "resolve" in kwargs:
         resolve = kwargs["resolve"]
         del kwargs["resolve"]
@@ -72,7 +586,9 @@ def cmd(args, **kwargs):
         resolve = True
     if resolve:
         args = [shutil.which(args[0]), *args[1:]]
-    return subprocess.run(args, **kwargs)
+    name = " ".join([os.path.basename(str(args[0])), *[str(a) for a in args[1:3]]])
+    with trace_span(name, "cmd", {"args": " ".join([str(a) for a in args])}):
+        return subprocess.run(args, **kwargs)
 
 
 # 標準出力をキャプチャするコマンド実行。シェルの `cmd ...` や $(cmd ...) と同じ
@@ -105,7 +621,53 @@ def onerror(func, path, exc_info):
         raise
 
 
-def rm_rf(path: str):
+# rm_rf(path, background=True) で削除中のディレクトリ
+_background_deletions: List[Tuple[str, concurrent.futures.Future]] = []
+_background_deletion_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_background_deletion_lock = threading.Lock()
+
+
+# fork した子プロセスには削除中のスレッドが無いので、子プロセスでは新しく始める
+def _reset_background_deletions():
+    global _background_deletion_executor, _background_deletion_lock
+    _background_deletions.clear()
+    _background_deletion_executor = None
+    _background_deletion_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_background_deletions)
+
+
+def _delete_trash(trash: str):
+    # 別のプロセスが同じディレクトリを削除している場合があるので、消えたファイルは無視する
+    def on_error(func, path, exc_info):
+        if not isinstance(exc_info[1], FileNotFoundError):
+            onerror(func, path, exc_info)
+
+    shutil.rmtree(trash, onerror=on_error)
+    logging.debug(f"rm -rf {trash} => directory removed in background")
+
+
+def _submit_background_deletion(trash: str):
+    global _background_deletion_executor
+    with _background_deletion_lock:
+        if _background_deletion_executor is None:
+            _background_deletion_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="rm_rf"
+            )
+        future = _background_deletion_executor.submit(_delete_trash, trash)
+        _background_deletions.append((trash, future))
+
+
+# background=True の場合、ディレクトリを同じ場所の .trash-<uuid> に名前を変えてから
+# バックグラウンドのスレッドで削除するので、巨大なディレクトリでも待たずにすぐに戻る。
+# 名前の変更はアトミックなので、path には戻った直後から新しいものを作れる。
+# 削除が終わるのを待つには wait_background_deletions() を呼ぶこと。
+# ビルドステップの子プロセスで始めた削除は、終了時に detach_background_deletions() で
+# 別のプロセスに引き継がれる。
+@traced("rm_rf")
+def rm_rf(path: str, background: bool = False):
     if not os.path.exists(path):
         logging.debug(f"rm -rf {path} => path not found")
         return
@@ -113,10 +675,672 @@ def rm_rf(path: str):
         os.remove(path)
         logging.debug(f"rm -rf {path} => file removed")
     if os.path.isdir(path):
+        if background:
+            trash = os.path.join(
+                os.path.dirname(os.path.abspath(path)), f".trash-{uuid.uuid4().hex}"
+            )
+            try:
+                os.rename(path, trash)
+            except OSError:
+                # 名前を変えられない場合は、その場で削除する
+                logging.debug(f"Failed to rename {path}, removing it in the foreground")
+            else:
+                _submit_background_deletion(trash)
+                logging.debug(f"rm -rf {path} => renamed to {trash}, removing in background")
+                return
         shutil.rmtree(path, onerror=onerror)
         logging.debug(f"rm -rf {path} => directory removed")
 
 
+# rm_rf(path, background=True) で始めた削除が全て終わるのを待つ。
+#
+# 削除に失敗した場合は警告を出すだけで、例外は投げない。
+def wait_background_deletions():
+    with _background_deletion_lock:
+        deletions = list(_background_deletions)
+        _background_deletions.clear()
+    if len(deletions) == 0:
+        return
+    logging.info(f"Waiting for {len(deletions)} background deletions")
+    for trash, future in deletions:
+        try:
+            future.result()
+        except Exception as e:
+            logging.warning(f"Failed to remove {trash}: {e}")
+
+
+# rm_rf(path, background=True) で始めた削除のうち、終わっていないものを別のプロセスに任せる。
+#
+# ビルドステップの子プロセスは os._exit() で終わるので、削除中のスレッドも止まってしまう。
+# かといって削除を待つと、その間 jobserver のトークンを持ったまま後続のステップを待たせるので、
+# 終了を待たない別のプロセスで削除を続けて、すぐに終了できるようにする。
+def detach_background_deletions():
+    with _background_deletion_lock:
+        deletions = list(_background_deletions)
+        _background_deletions.clear()
+    trashes = [trash for trash, future in deletions if not future.done()]
+    if len(trashes) == 0:
+        return
+    for _, future in deletions:
+        future.cancel()
+    logging.info(f"Detaching {len(trashes)} background deletions")
+    try:
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "import shutil, sys\n"
+                "for p in sys.argv[1:]:\n"
+                "    shutil.rmtree(p, ignore_errors=True)\n",
+                *trashes,
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError as e:
+        # 残った .trash-* は、次のビルドの remove_stale_trash() で削除される
+        logging.warning(f"Failed to detach background deletions: {e}")
+
+
+# 以前のビルドが中断されて残った dirs 直下の .trash-* を、バックグラウンドで削除する
+def remove_stale_trash(dirs: Sequence[str]):
+    for dir in dirs:
+        if not os.path.isdir(dir):
+            continue
+        for name in os.listdir(dir):
+            if name.startswith(".trash-"):
+                logging.info(f"Removing stale {os.path.join(dir, name)} in background")
+                _submit_background_deletion(os.path.join(dir, name))
+
+
+# path 以下の全てのファイルの相対パス、サイズ、更新日時を h に追加する。
+#
+# ファイルの内容は読まないので、大きなディレクトリでもすぐに終わる。
+# mtime=False の場合は更新日時を含めないので、別のマシンやチェックアウトでも同じ値になる。
+def hash_file_stats(h, path: str, mtime: bool = True):
+    if os.path.isfile(path):
+        st = os.stat(path)
+        h.update(f"{st.st_size} {st.st_mtime_ns if mtime else ''}\n".encode("utf-8"))
+        return
+    if not os.path.isdir(path):
+        h.update(b"<missing>\n")
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            filepath = os.path.join(root, file)
+            st = os.lstat(filepath)
+            relpath = os.path.relpath(filepath, path).replace(os.sep, "/")
+            h.update(
+                f"{relpath} {st.st_size} {st.st_mtime_ns if mtime else ''}\n".encode("utf-8")
+            )
+
+
+# dir の git リポジトリの HEAD のコミットを返す。
+#
+# git コマンドを実行しないように、可能なら .git 以下のファイルを直接読む。
+def get_git_head(dir: str) -> str:
+    git_dir = os.path.join(dir, ".git")
+    try:
+        with open(os.path.join(git_dir, "HEAD")) as f:
+            head = f.read().strip()
+        if not head.startswith("ref: "):
+            return head
+        ref = head[len("ref: ") :]
+        ref_path = os.path.join(git_dir, ref)
+        if os.path.exists(ref_path):
+            with open(ref_path) as f:
+                return f.read().strip()
+        with open(os.path.join(git_dir, "packed-refs")) as f:
+            for line in f:
+                words = line.split()
+                if len(words) == 2 and words[1] == ref:
+                    return words[0]
+    except OSError:
+        # .git がファイルの場合（worktree など）
+        pass
+    with cd(dir):
+        return cmdcap(["git", "rev-parse", "HEAD"])
+
+
+# 再現可能なアーカイブを作る時に、ファイルの最終更新時刻として使う時刻。
+#
+# SOURCE_DATE_EPOCH 環境変数があればそれを使い、無ければ dir の HEAD のコミット時刻を使う。
+def get_source_date_epoch(dir: str) -> int:
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch is not None:
+        return int(epoch)
+    try:
+        return int(cmdcap(["git", "log", "-1", "--format=%ct"], cwd=dir))
+    except Exception:
+        logging.warning(f"Failed to get the commit time of {dir}, use 0 as SOURCE_DATE_EPOCH")
+        return 0
+
+
+# コンパイラキャッシュ（ccache か sccache）。
+#
+# start_compiler_cache() で設定すると SORA_BUILD_COMPILER_CACHE 環境変数に保存されるので、
+# 子プロセスで実行したビルドでも同じコンパイラキャッシュを使う。
+COMPILER_CACHES = ["ccache", "sccache", "none"]
+COMPILER_LAUNCHER_LANGUAGES = ["C", "CXX", "OBJC", "OBJCXX", "CUDA"]
+
+
+def get_compiler_cache() -> Optional[str]:
+    cache = os.environ.get("SORA_BUILD_COMPILER_CACHE")
+    if cache is None or cache == "none" or len(cache) == 0:
+        return None
+    return cache
+
+
+# cmake の configure に渡す、コンパイラキャッシュを使うための引数
+def get_compiler_launcher_args(languages: Sequence[str] = ("C", "CXX")) -> List[str]:
+    cache = get_compiler_cache()
+    if cache is None:
+        return []
+    return [f"-DCMAKE_{lang}_COMPILER_LAUNCHER={cache}" for lang in languages]
+
+
+# b2 の using に指定するコンパイラのコマンドに、コンパイラキャッシュを付ける
+def with_compiler_launcher(compiler: str) -> str:
+    cache = get_compiler_cache()
+    if cache is None:
+        return compiler
+    return f"{cache} {compiler}"
+
+
+# コンパイラキャッシュを使い始める。
+#
+# キャッシュディレクトリはターゲットごとに分け、終了時にキャッシュのヒット率などを表示する。
+def start_compiler_cache(cache: str, target: str):
+    if get_compiler_cache() is not None:
+        # 親プロセスで既に設定されている
+        return
+    if cache == "none":
+        return
+    if shutil.which(cache) is None:
+        logging.warning(f"{cache} is not found, building without compiler cache")
+        return
+
+    cache_dir = get_cache_dir()
+    env_name = "CCACHE_DIR" if cache == "ccache" else "SCCACHE_DIR"
+    if cache_dir is not None and env_name not in os.environ:
+        os.environ[env_name] = os.path.join(cache_dir, cache, target)
+    if cache == "ccache" and "CCACHE_SLOPPINESS" not in os.environ:
+        # プリコンパイル済みヘッダーを使っている場合にもキャッシュできるようにする
+        os.environ["CCACHE_SLOPPINESS"] = "pch_defines,time_macros,include_file_mtime"
+    os.environ["SORA_BUILD_COMPILER_CACHE"] = cache
+    cmd([cache, "--zero-stats"], stdout=subprocess.DEVNULL)
+    logging.info(f"Use {cache} as compiler cache: {os.environ.get(env_name, '(default)')}")
+
+    pid = os.getpid()
+
+    def show_stats():
+        if os.getpid() != pid:
+            return
+        try:
+            logging.info(f"{cache} stats:\n{cmdcap([cache, '--show-stats'])}")
+        except Exception:
+            logging.warning(f"Failed to get {cache} stats", exc_info=True)
+
+    atexit.register(show_stats)
+
+
+# カレントディレクトリをビルドディレクトリとして cmake の configure を行う。
+#
+# configure の引数、cmake の実行ファイル、source_dir の CMakeLists.txt と
+# module_dirs 以下の *.cmake の内容から計算したダイジェストを保存しておき、
+# 前回から変わっていなければ configure を省略する。
+# （CMakeLists.txt から include しているファイルなどが変わった場合は、
+#   cmake --build の時に CMake 自身が configure し直す）
+def cmake_configure(source_dir: str, cmake_args: List[str], module_dirs: Sequence[str] = ()):
+    # ビルドディレクトリを使い回すので、コンパイラキャッシュを使わなくなった場合は設定を消す
+    launcher_args = get_compiler_launcher_args(COMPILER_LAUNCHER_LANGUAGES)
+    if len(launcher_args) == 0:
+        launcher_args = [
+            f"-UCMAKE_{lang}_COMPILER_LAUNCHER" for lang in COMPILER_LAUNCHER_LANGUAGES
+        ]
+    cmake_args = [*cmake_args, *launcher_args]
+
+    # ninja が入ったり無くなったりしてジェネレータが変わった場合、
+    # CMake は同じビルドディレクトリを使えないので中身を消す。
+    # ジェネレータを指定しない場合は、前回 Ninja だった場合だけ消す。
+    generator = None
+    for i, arg in enumerate(cmake_args[:-1]):
+        if arg == "-G":
+            generator = cmake_args[i + 1]
+    cached_generator = get_cmake_cache_generator(".")
+    if generator is None:
+        generator_changed = cached_generator == "Ninja"
+    else:
+        generator_changed = cached_generator is not None and cached_generator != generator
+    if generator_changed:
+        logging.info(
+            f"CMake generator changed from {cached_generator} to {generator}, "
+            f"removing {os.getcwd()}"
+        )
+        for name in os.listdir("."):
+            rm_rf(name)
+
+    # リンクの並列数は実行時の空きメモリで変わるので、判定に含めない
+    job_pools = [
+        a[len(CMAKE_JOB_POOLS_ARG) :] for a in cmake_args if a.startswith(CMAKE_JOB_POOLS_ARG)
+    ]
+    digest_args = [a for a in cmake_args if not a.startswith(CMAKE_JOB_POOLS_ARG)]
+
+    h = hashlib.sha256()
+    h.update(json.dumps([source_dir, *digest_args]).encode("utf-8"))
+    cmake = shutil.which("cmake")
+    h.update(str(cmake).encode("utf-8"))
+    if cmake is not None:
+        h.update(str(os.stat(cmake).st_mtime_ns).encode("utf-8"))
+    files = [os.path.join(source_dir, "CMakeLists.txt")]
+    for dir in module_dirs:
+        files += sorted(glob.glob(os.path.join(dir, "**", "*.cmake"), recursive=True))
+    for file in files:
+        h.update(f"[{file}]\n".encode("utf-8"))
+        if os.path.exists(file):
+            with open(file, "rb") as f:
+                h.update(f.read())
+    digest = h.hexdigest()
+
+    digest_path = "sora-configure.digest"
+    if os.path.exists("CMakeCache.txt") and os.path.exists(digest_path):
+        with open(digest_path) as f:
+            up_to_date = f.read().strip() == digest
+        # 前回より少ないリンクの並列数が必要になった場合は configure し直す。
+        # 多くできる場合は、configure し直すほどではないのでそのままにする。
+        if up_to_date and len(job_pools) != 0:
+            link_jobs = _parse_link_job_pool(job_pools[-1])
+            cached = _parse_link_job_pool(get_cmake_cache_value(".", "CMAKE_JOB_POOLS") or "")
+            if link_jobs is not None and (cached is None or cached > link_jobs):
+                logging.info(f"Link job pool changed from {cached} to {link_jobs}")
+                up_to_date = False
+        if up_to_date:
+            logging.info(f"cmake configure is up to date: {os.getcwd()}")
+            return
+
+    rm_rf(digest_path)
+    cmd(["cmake", source_dir, *cmake_args])
+    with open(digest_path, "w") as f:
+        f.write(digest)
+
+
+# build_dir の CMakeCache.txt にある変数 name の値。無い場合は None
+def get_cmake_cache_value(build_dir: str, name: str) -> Optional[str]:
+    path = os.path.join(build_dir, "CMakeCache.txt")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            # NAME:TYPE=VALUE
+            key, sep, value = line.rstrip("\n").partition("=")
+            if sep != "" and key.split(":", 1)[0] == name:
+                return value
+    return None
+
+
+def get_cmake_cache_generator(build_dir: str) -> Optional[str]:
+    return get_cmake_cache_value(build_dir, "CMAKE_GENERATOR")
+
+
+# Linux 向けのターゲットでは、ninja があれば Ninja ジェネレータを使う。
+# ninja が無い場合は CMake のデフォルトのジェネレータ（Unix Makefiles）を使う。
+NINJA_TARGET_OSES = ["ubuntu", "jetson", "android"]
+
+
+def get_cmake_generator(target_os: str) -> Optional[str]:
+    if target_os in NINJA_TARGET_OSES and shutil.which("ninja") is not None:
+        return "Ninja"
+    return None
+
+
+# .ninja_log を読んで、前回読んだ後に実行されたコマンドの出力ごとの実行時間（秒）を返す。
+#
+# .ninja_log はビルドの度に追記されていき、終了時間の順に並んでいて、
+# 時間はビルドの開始から数えるので、終了時間が前の行より戻っているところでビルドが切り替わる。
+# 前回読んだ位置から読み、その中で最後のビルドの分だけを返す。
+# ninja がログを作り直した（inode が変わった）場合や、ファイルが縮んだ場合は最初から読む。
+def read_ninja_log(path: str, state: Dict[str, int]) -> Dict[str, float]:
+    st = os.stat(path)
+    offset = state.get("offset", 0)
+    if state.get("inode") != st.st_ino or offset > st.st_size:
+        offset = 0
+    entries: Dict[str, float] = {}
+    last_end = -1
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                # 書き込み中の行は次回読む
+                break
+            offset += len(line)
+            if line.startswith(b"#"):
+                continue
+            # start end mtime output hash
+            fields = line.decode("utf-8", errors="replace").rstrip("\n").split("\t")
+            if len(fields) != 5:
+                continue
+            start, end = int(fields[0]), int(fields[1])
+            if end < last_end:
+                entries = {}
+            last_end = end
+            entries[fields[3]] = (end - start) / 1000
+    state["inode"] = st.st_ino
+    state["offset"] = offset
+    return entries
+
+
+# CMake が生成する ninja のオブジェクトファイルのパス
+# (CMakeFiles/sora.dir/src/sora_signaling.cpp.o) からソースファイルのパスを取り出す。
+# プリコンパイル済みヘッダー (CMakeFiles/sora.dir/cmake_pch.hxx.pch) もコンパイルとして扱う
+def _ninja_output_to_source(output: str) -> Optional[str]:
+    m = re.match(r"^(?:.*/)?CMakeFiles/[^/]+\.dir/(.+)\.(?:o|obj|pch|gch)$", output)
+    if m is None:
+        return None
+    return m.group(1)
+
+
+# Ninja でビルドした build_dir の .ninja_log から、翻訳単位ごと、リンクごとの
+# ビルド時間のレポートを作る。
+#
+# レポートは output_dir/build-time-<name>.txt に書き出し、
+# 各ファイルのビルド時間の履歴を output_dir/build-time-<name>.json に history 回分保存して、
+# 同じ options でビルドした時の中央値より regression_ratio 倍以上（かつ 1 秒以上）
+# 遅くなったファイルを報告する。
+# 直前のビルドと options（プリコンパイル済みヘッダーを使うかどうかなど）が違う場合は、
+# 直前のビルドとのビルド時間の比較も報告する。
+def report_ninja_build(
+    build_dir: str,
+    output_dir: str,
+    name: str,
+    top: int = 20,
+    history: int = 20,
+    regression_ratio: float = 1.2,
+    options: Optional[Dict[str, object]] = None,
+) -> Optional[str]:
+    options = options or {}
+    log_path = os.path.join(build_dir, ".ninja_log")
+    if not os.path.exists(log_path):
+        return None
+
+    history_path = os.path.join(output_dir, f"build-time-{name}.json")
+    data = {"ninja_log": {}, "runs": []}
+    if os.path.exists(history_path):
+        try:
+            with open(history_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logging.warning(f"Failed to read {history_path}, starting a new history")
+    entries = read_ninja_log(log_path, data["ninja_log"])
+
+    compiles: Dict[str, float] = {}
+    links: Dict[str, float] = {}
+    for output, duration in entries.items():
+        source = _ninja_output_to_source(output)
+        if source is not None:
+            compiles[source] = duration
+        else:
+            links[output] = duration
+
+    previous: Dict[str, List[float]] = {}
+    for run in data["runs"]:
+        if run.get("options", {}) != options:
+            continue
+        for source, duration in run["compiles"].items():
+            previous.setdefault(source, []).append(duration)
+    regressions = []
+    for source, duration in compiles.items():
+        if source not in previous:
+            continue
+        durations = sorted(previous[source])
+        median = durations[len(durations) // 2]
+        if duration >= median * regression_ratio and duration - median >= 1.0:
+            regressions.append((source, median, duration))
+    regressions.sort(key=lambda r: r[2] - r[1], reverse=True)
+
+    def format_top(title: str, items: Dict[str, float]) -> List[str]:
+        items_sorted = sorted(items.items(), key=lambda item: item[1], reverse=True)[:top]
+        lines = [f"Top {len(items_sorted)} slowest {title}:"]
+        for path, duration in items_sorted:
+            lines.append(f"{duration:10.2f}s  {path}")
+        return lines
+
+    lines = [f"{name}: {len(compiles)} compiles ({sum(compiles.values()):.2f}s total)"]
+    lines += format_top("compiles", compiles)
+    lines += format_top("links", links)
+    if len(regressions) != 0:
+        lines.append(f"Regressions ({len(regressions)}):")
+        for source, median, duration in regressions:
+            lines.append(f"{median:10.2f}s -> {duration:.2f}s  {source}")
+    # options を変えると全体がビルドし直されるので、直前のビルドと options が違う場合は比較する
+    baseline = data["runs"][-1] if len(data["runs"]) != 0 else None
+    if baseline is not None and baseline.get("options", {}) != options:
+        before = baseline["compiles"]
+        lines.append(
+            f"Compared with {baseline.get('options', {})} -> {options}: "
+            f"{sum(before.values()):.2f}s -> {sum(compiles.values()):.2f}s total"
+        )
+        changes = sorted(
+            [(source, before[source], compiles[source]) for source in compiles if source in before],
+            key=lambda c: abs(c[2] - c[1]),
+            reverse=True,
+        )[:top]
+        for source, before_duration, duration in changes:
+            lines.append(f"{before_duration:10.2f}s -> {duration:.2f}s  {source}")
+    report = "\n".join(lines) + "\n"
+
+    os.makedirs(output_dir, exist_ok=True)
+    if len(entries) != 0:
+        data["runs"] = [
+            *data["runs"],
+            {"time": time.time(), "options": options, "compiles": compiles, "links": links},
+        ][-history:]
+        with open(os.path.join(output_dir, f"build-time-{name}.txt"), "w") as f:
+            f.write(report)
+    with open(history_path, "w") as f:
+        json.dump(data, f)
+    if len(entries) == 0:
+        logging.info(f"{name}: nothing was built by ninja")
+        return None
+    logging.info(f"Build time report written to {output_dir}\n{report}")
+    return report
+
+
+# clang の -ftime-trace で出力された翻訳単位ごとの JSON を集計して、
+# 時間のかかったヘッダー、テンプレートのインスタンス化、コンパイルのフェーズの
+# 上位 top 件を Markdown で output に書き出す。
+#
+# JSON はオブジェクトファイルと同じ場所に出力されるので、build_dir 以下から
+# 同じ名前のオブジェクトファイル（x.cpp.json に対して x.cpp.o）がある JSON を集める。
+# ヘッダーとテンプレートの時間は、そこからインクルードやインスタンス化したものを含む。
+def report_time_trace(build_dir: str, output: str, top: int = 30) -> Optional[str]:
+    units: Dict[str, float] = {}
+    phases: Dict[str, List[float]] = {}
+    headers: Dict[str, List[float]] = {}
+    instantiations: Dict[str, List[float]] = {}
+    templates: Dict[str, List[float]] = {}
+    for path in sorted(glob.glob(os.path.join(build_dir, "**", "*.json"), recursive=True)):
+        base = path[: -len(".json")]
+        if not os.path.exists(f"{base}.o") and not os.path.exists(f"{base}.obj"):
+            continue
+        try:
+            with open(path, encoding="utf-8") as f:
+                events = json.load(f)["traceEvents"]
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+        # CMakeFiles/sora.dir/src/sora_signaling.cpp -> src/sora_signaling.cpp
+        unit = re.sub(r"^(?:.*/)?CMakeFiles/[^/]+\.dir/", "", os.path.relpath(base, build_dir))
+        for e in events:
+            if e.get("ph") != "X":
+                continue
+            name = e.get("name", "")
+            dur = e.get("dur", 0) / 1000000
+            detail = e.get("args", {}).get("detail", "")
+            if name == "ExecuteCompiler":
+                units[unit] = dur
+            elif name.startswith("Total "):
+                phases.setdefault(name[len("Total ") :], []).append(dur)
+            elif name == "Source":
+                headers.setdefault(detail, []).append(dur)
+            elif name in ("InstantiateClass", "InstantiateFunction"):
+                instantiations.setdefault(detail, []).append(dur)
+                templates.setdefault(detail.split("<")[0], []).append(dur)
+    if len(units) == 0:
+        logging.warning(f"No -ftime-trace output found in {build_dir}")
+        return None
+
+    def escape(text: str) -> str:
+        text = text.replace("|", "\\|")
+        return text if len(text) <= 200 else text[:197] + "..."
+
+    def table(title: str, column: str, items: Dict[str, List[float]]) -> List[str]:
+        rows = sorted(items.items(), key=lambda item: sum(item[1]), reverse=True)[:top]
+        lines = [
+            f"## {title}",
+            "",
+            f"| 合計 (s) | 回数 | 平均 (ms) | {column} |",
+            "|---:|---:|---:|---|",
+        ]
+        for key, durations in rows:
+            total = sum(durations)
+            average = total / len(durations) * 1000
+            lines.append(f"| {total:.2f} | {len(durations)} | {average:.1f} | `{escape(key)}` |")
+        return lines + [""]
+
+    lines = [
+        "# -ftime-trace レポート",
+        "",
+        f"{len(units)} ファイル、合計 {sum(units.values()):.2f} 秒",
+        "",
+    ]
+    lines += table("翻訳単位", "ファイル", {k: [v] for k, v in units.items()})
+    lines += table("フェーズ", "フェーズ", phases)
+    lines += table("ヘッダー", "ヘッダー", headers)
+    lines += table("テンプレート", "テンプレート", templates)
+    lines += table("テンプレートのインスタンス化", "インスタンス", instantiations)
+    report = "\n".join(lines)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(report)
+    logging.info(f"Time trace report written to {output}")
+    return report
+
+
+# unity build でまとめられないソースファイルを探す。
+#
+# unity build では複数のソースファイルを 1 つの翻訳単位としてコンパイルするので、
+# 以下のようなソースファイルを他のファイルとまとめると、
+# 名前の衝突やマクロの漏れでコンパイルできなくなる。
+# - 無名名前空間や static で定義した名前が、他のファイルと同じもの
+# - #define したマクロを #undef していないもの
+# - ファイルのスコープで using namespace しているもの
+#
+# 厳密な構文解析はしないので、怪しいものは全て返す。
+# 名前が衝突している場合は、最初のファイル以外を返す。
+def find_unity_build_conflicts(sources: List[str]) -> List[str]:
+    keywords = {
+        "const",
+        "constexpr",
+        "inline",
+        "static",
+        "struct",
+        "class",
+        "enum",
+        "union",
+        "typedef",
+        "using",
+        "unsigned",
+        "signed",
+        "volatile",
+        "operator",
+        "template",
+        "typename",
+        "static_assert",
+    }
+
+    def internal_names(code: str) -> List[str]:
+        # スコープの種類（namespace, anonymous, other）のスタック
+        scopes: List[str] = []
+        names = []
+        head = ""
+        for c in code:
+            if c == "{":
+                kind = "other"
+                if all(s != "other" for s in scopes):
+                    text = head.strip()
+                    if re.fullmatch(r"namespace", text):
+                        kind = "anonymous"
+                    elif re.fullmatch(r"(inline\s+)?namespace\s+[\w:]+", text) or re.fullmatch(
+                        r'extern\s*""', text
+                    ):
+                        kind = "namespace"
+                    else:
+                        add_name(scopes, head, names)
+                scopes.append(kind)
+                head = ""
+            elif c == "}":
+                if len(scopes) != 0:
+                    scopes.pop()
+                head = ""
+            elif c == ";":
+                if all(s != "other" for s in scopes):
+                    add_name(scopes, head, names)
+                head = ""
+            else:
+                head += c
+        return names
+
+    def add_name(scopes: List[str], head: str, names: List[str]):
+        text = head.strip()
+        if "anonymous" not in scopes and not text.startswith("static "):
+            return
+        # テンプレート引数と、名前より後ろ（引数、初期化子、配列の要素数、基底クラスなど）を取り除く
+        while re.search(r"<[^<>]*>", text) is not None:
+            text = re.sub(r"<[^<>]*>", "", text)
+        text = re.split(r"[(=\[]|(?<!:):(?!:)", text, maxsplit=1)[0]
+        words = [w for w in re.findall(r"[A-Za-z_]\w*", text) if w not in keywords]
+        if len(words) != 0:
+            names.append(words[-1])
+
+    names = set()
+    conflicts = []
+    for source in sources:
+        with open(source, encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        # コメントと文字列リテラルを取り除いて、行の継続をつなげる
+        text = re.sub(r"//[^\n]*|/\*.*?\*/", " ", text, flags=re.DOTALL)
+        text = re.sub(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', '""', text)
+        text = text.replace("\\\n", " ")
+
+        defined = set()
+        code_lines = []
+        for line in text.split("\n"):
+            m = re.match(r"\s*#\s*(define|undef)\s+(\w+)", line)
+            if m is not None:
+                if m.group(1) == "define":
+                    defined.add(m.group(2))
+                else:
+                    defined.discard(m.group(2))
+            if not line.lstrip().startswith("#"):
+                code_lines.append(line)
+        code = "\n".join(code_lines)
+
+        internal = internal_names(code)
+        if (
+            len(defined) != 0
+            or re.search(r"^\s*using\s+namespace\b", code, re.M) is not None
+            or any(name in names for name in internal)
+        ):
+            conflicts.append(source)
+            continue
+        # unity build に含めるファイルの名前だけを覚えておく
+        names.update(internal)
+    return conflicts
+
+
 def mkdir_p(path: str):
     if os.path.exists(path):
         logging.debug(f"mkdir -p {path} => already exists")
@@ -184,6 +1408,205 @@ def gh_run_download(
     return output_path
 
 
+# Linux の FICLONE ioctl を使って reflink（Copy on Write なコピー）を作る。
+# 対応していないファイルシステムやプラットフォームの場合は False を返す。
+FICLONE = 0x40049409
+
+
+def _try_reflink(src: str, dst: str) -> bool:
+    if platform.system() != "Linux":
+        return False
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+# src を dst にハードリンクする。
+# 別のファイルシステムなどでハードリンクできない場合は reflink を、それも駄目ならコピーをする。
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    if _try_reflink(src, dst):
+        return
+    shutil.copyfile(src, dst)
+
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if len(data) == 0:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+# ダウンロードしたファイルを、内容の SHA-256 をキーにして保存しておくストア。
+#
+# {store_dir}/blobs/<sha256> にファイルの実体を置き、{store_dir}/index.json に
+# URL → SHA-256 の対応と、各ファイルのサイズと最終利用時刻を記録する。
+# ターゲットや Debug/Release、examples/ の各プロジェクトで同じ URL をダウンロードする場合、
+# このストアにあるファイルをハードリンク（できなければ reflink かコピー）して利用する。
+#
+# 複数のプロセスやスレッドから同時に使われるため、index.json の読み書きはロックして行う。
+class DownloadStore(object):
+    _thread_lock = threading.Lock()
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.blobs_dir = os.path.join(store_dir, "blobs")
+        self.index_file = os.path.join(store_dir, "index.json")
+        self.lock_file = os.path.join(store_dir, "index.lock")
+
+    def _lock(self):
+        store = self
+
+        class Lock(object):
+            def __enter__(self):
+                DownloadStore._thread_lock.acquire()
+                mkdir_p(store.store_dir)
+                self._f = open(store.lock_file, "a")
+                if platform.system() != "Windows":
+                    fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+
+            def __exit__(self, exctype, excvalue, trace):
+                if platform.system() != "Windows":
+                    fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+                self._f.close()
+                DownloadStore._thread_lock.release()
+                return False
+
+        return Lock()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_file):
+            return {"urls": {}, "blobs": {}}
+        try:
+            with open(self.index_file) as f:
+                return json.load(f)
+        except ValueError:
+            logging.warning(f"Broken download store index {self.index_file}, ignored")
+            return {"urls": {}, "blobs": {}}
+
+    def _save_index(self, index):
+        tmp = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.index_file)
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs_dir, digest)
+
+    # url に対応するファイルがストアにあればそのパスを返す
+    def lookup(self, url: str) -> Optional[str]:
+        with self._lock():
+            index = self._load_index()
+            digest = index["urls"].get(url)
+            if digest is None:
+                return None
+            blob = self.blob_path(digest)
+            info = index["blobs"].get(digest)
+            if info is None or not os.path.exists(blob) or os.path.getsize(blob) != info["size"]:
+                del index["urls"][url]
+                self._save_index(index)
+                return None
+            info["last_used"] = time.time()
+            self._save_index(index)
+            return blob
+
+    # url からダウンロードした path をストアに登録する
+    # digest が分かっている場合は指定すると、ファイルを読み直さずに済む
+    def add(self, url: str, path: str, digest: Optional[str] = None) -> str:
+        if digest is None:
+            digest = _sha256_file(path)
+        blob = self.blob_path(digest)
+        with self._lock():
+            if not os.path.exists(blob):
+                mkdir_p(self.blobs_dir)
+                tmp = f"{blob}.{os.getpid()}.tmp"
+                rm_rf(tmp)
+                _link_or_copy(path, tmp)
+                os.replace(tmp, blob)
+            index = self._load_index()
+            index["urls"][url] = digest
+            index["blobs"][digest] = {"size": os.path.getsize(blob), "last_used": time.time()}
+            self._save_index(index)
+        logging.debug(f"Stored {url} as {digest}")
+        return digest
+
+    # ストアの合計サイズが max_size バイト以下になるまで、最後に使われたのが古いものから削除する
+    def evict(self, max_size: int):
+        with self._lock():
+            index = self._load_index()
+            # index に無いファイルはゴミなので消す
+            if os.path.exists(self.blobs_dir):
+                for entry in os.scandir(self.blobs_dir):
+                    if entry.name not in index["blobs"]:
+                        logging.info(f"Remove unknown blob {entry.path}")
+                        rm_rf(entry.path)
+            for digest in list(index["blobs"].keys()):
+                if not os.path.exists(self.blob_path(digest)):
+                    del index["blobs"][digest]
+
+            total = sum(info["size"] for info in index["blobs"].values())
+            blobs = sorted(index["blobs"].items(), key=lambda x: x[1]["last_used"])
+            for digest, info in blobs:
+                if total <= max_size:
+                    break
+                logging.info(f"Evict {digest} ({info['size']} bytes)")
+                rm_rf(self.blob_path(digest))
+                del index["blobs"][digest]
+                total -= info["size"]
+
+            index["urls"] = {
+                url: digest for url, digest in index["urls"].items() if digest in index["blobs"]
+            }
+            self._save_index(index)
+            logging.info(f"Download store size: {total} bytes")
+
+
+# ビルド間で共有するキャッシュのルートディレクトリ。
+#
+# SORA_BUILD_CACHE_DIR 環境変数で変更でき、空文字を指定するとキャッシュを利用しない。
+def get_cache_dir() -> Optional[str]:
+    dir = os.environ.get("SORA_BUILD_CACHE_DIR")
+    if dir is None:
+        return os.path.join(os.path.expanduser("~"), ".cache", "sora-build")
+    if len(dir) == 0:
+        return None
+    return os.path.abspath(dir)
+
+
+def get_download_store() -> Optional[DownloadStore]:
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return None
+    return DownloadStore(cache_dir)
+
+
+# urllib.request.urlopen() のタイムアウト（秒）。
+# 接続や読み込みが止まったまま、ビルドのステップが終わらなくなるのを防ぐ。
+URLOPEN_TIMEOUT = 60
+
+
+# prefetch() で事前に取得したファイルやリポジトリ
+#
+# download() や git_clone_shallow() は、ここに登録されているものがあれば
+# ネットワークにアクセスせずにそれを利用する
+_prefetched_downloads: Dict[str, str] = {}
+_prefetched_repositories: Dict[Tuple[str, str], str] = {}
+
+
+@traced("download")
 def download(url: str, output_dir: Optional[str] = None, filename: Optional[str] = None) -> str:
     if filename is None:
         output_path = urllib.parse.urlparse(url).path.split("/")[-1]
@@ -196,6 +1619,20 @@ def download(url: str, output_dir: Optional[str] = None, filename: Optional[str]
     if os.path.exists(output_path):
         return output_path
 
+    prefetched = _prefetched_downloads.pop(url, None)
+    if prefetched is not None and os.path.exists(prefetched):
+        logging.debug(f"mv {prefetched} {output_path} (prefetched)")
+        os.replace(prefetched, output_path)
+        return output_path
+
+    store = get_download_store()
+    if store is not None:
+        blob = store.lookup(url)
+        if blob is not None:
+            logging.debug(f"ln {blob} {output_path} (download store)")
+            _link_or_copy(blob, output_path)
+            return output_path
+
     try:
         if shutil.which("curl") is not None:
             cmd(["curl", "-fLo", output_path, url])
@@ -207,6 +1644,9 @@ def download(url: str, output_dir: Optional[str] = None, filename: Optional[str]
             os.remove(output_path)
         raise
 
+    if store is not None:
+        store.add(url, output_path)
+
     return output_path
 
 
@@ -238,6 +1678,14 @@ def enum_all_files(dir, dir2):
             yield os.path.relpath(os.path.join(root, file), dir2)
 
 
+# version_file に書かれているバージョンが version と一致するかどうか
+def is_version_installed(version: str, version_file: str) -> bool:
+    if not os.path.exists(version_file):
+        return False
+    ver = open(version_file).read()
+    return ver.strip() == version.strip()
+
+
 def versioned(func):
     def wrapper(version, version_file, *args, **kwargs):
         if "ignore_version" in kwargs:
@@ -245,12 +1693,11 @@ def versioned(func):
                 rm_rf(version_file)
             del kwargs["ignore_version"]
 
-        if os.path.exists(version_file):
-            ver = open(version_file).read()
-            if ver.strip() == version.strip():
-                return
+        if is_version_installed(version, version_file):
+            return
 
-        r = func(version=version, *args, **kwargs)
+        with trace_span(func.__name__, "versioned", {"version": version}):
+            r = func(version=version, *args, **kwargs)
 
         with open(version_file, "w") as f:
             f.write(version)
@@ -260,6 +1707,545 @@ def versioned(func):
     return wrapper
 
 
+# ビルド済みの依存ライブラリを保存しておくキャッシュ。
+#
+# SORA_BUILD_ARTIFACT_CACHE 環境変数に、ローカルのディレクトリか http(s) の URL を指定する。
+# ローカルのディレクトリの場合は、キャッシュに無かったものをビルドした後に保存する。
+# http(s) の場合は読み込みのみ行う。
+def get_artifact_cache() -> Optional[str]:
+    cache = os.environ.get("SORA_BUILD_ARTIFACT_CACHE")
+    if cache is None or len(cache) == 0:
+        return None
+    if cache.startswith(("http://", "https://")):
+        return cache.rstrip("/")
+    return os.path.abspath(cache)
+
+
+_compiler_identities: Dict[str, str] = {}
+
+
+# コンパイラのバージョン情報。
+#
+# clang++ --version の InstalledDir: などにはコンパイラの絶対パスが含まれていて、
+# チェックアウトごとにキャッシュのキーが変わってしまうので取り除く。
+def _get_compiler_identity(compiler: str) -> str:
+    if compiler not in _compiler_identities:
+        try:
+            identity = "\n".join(
+                line
+                for line in cmdcap([compiler, "--version"]).splitlines()
+                if not line.startswith(("InstalledDir:", "Configuration file:"))
+            )
+        except Exception:
+            identity = str(shutil.which(compiler) or compiler)
+        _compiler_identities[compiler] = identity
+    return _compiler_identities[compiler]
+
+
+# ビルドに使うコンパイラを引数から探す
+def _find_compilers(kwargs) -> List[str]:
+    compilers = []
+    if len(kwargs.get("cxx") or "") != 0:
+        compilers.append(kwargs["cxx"])
+    if len(kwargs.get("android_ndk") or "") != 0:
+        compilers.append(
+            os.path.join(
+                kwargs["android_ndk"],
+                "toolchains",
+                "llvm",
+                "prebuilt",
+                "linux-x86_64",
+                "bin",
+                "clang++",
+            )
+        )
+    for arg in kwargs.get("cmake_args") or []:
+        for prefix in ("-DCMAKE_C_COMPILER=", "-DCMAKE_CXX_COMPILER="):
+            if arg.startswith(prefix):
+                compilers.append(arg[len(prefix) :])
+    if len(compilers) == 0:
+        compilers.append("cl" if platform.system() == "Windows" else "c++")
+    return compilers
+
+
+# 引数にパスが含まれていて、そのディレクトリの中身がビルド結果に影響するオプション
+ARTIFACT_PATH_OPTIONS = (
+    "-isystem",
+    "-I",
+    "--sysroot=",
+    "-DCMAKE_CXX_STANDARD_INCLUDE_DIRECTORIES=",
+    "-DCMAKE_SYSROOT=",
+    "-DLIBCXX_INCLUDE_DIR=",
+)
+
+
+# 引数から参照しているディレクトリの中身を表す値を集める。
+#
+# libc++ のヘッダー（-isystem <install_dir>/llvm/libcxx/include など）や rootfs は、
+# WebRTC を更新すると中身が変わるが、パスも clang++ --version も変わらない。
+# そのため、プレースホルダーに置き換えたパスだけをキーにすると、
+# 古いヘッダーでビルドしたものをキャッシュから使ってしまう。
+#
+# install_dir 以下のディレクトリは、インストールした時の {install_dir}/<名前>.version の内容を使い、
+# バージョンファイルが無いものや install_dir の外のディレクトリ（ローカルの webrtc-build など）は
+# 中のファイルの相対パスとサイズのハッシュを使う。
+# 更新日時はマシンごとに異なり、別のチェックアウトでキャッシュを使えなくなるので含めない。
+def _get_artifact_dependencies(kwargs, normalized_args) -> Dict[str, str]:
+    install_dir = kwargs.get("install_dir") or ""
+    strings: List[str] = []
+
+    def collect(value):
+        if isinstance(value, str):
+            strings.append(value)
+        elif isinstance(value, (list, tuple)):
+            for v in value:
+                collect(v)
+
+    collect(list(normalized_args.values()))
+
+    def stats_hash(path: str) -> str:
+        h = hashlib.sha256()
+        hash_file_stats(h, path, mtime=False)
+        return h.hexdigest()
+
+    deps: Dict[str, str] = {}
+    for value in strings:
+        for top in re.findall(r"<install_dir>[/\\]([^/\\\s;:\"']+)", value):
+            version_file = os.path.join(install_dir, f"{top}.version")
+            if os.path.exists(version_file):
+                with open(version_file) as f:
+                    deps[f"<install_dir>/{top}"] = f.read().strip()
+            else:
+                deps[f"<install_dir>/{top}"] = stats_hash(os.path.join(install_dir, top))
+        for arg in value.split():
+            for option in ARTIFACT_PATH_OPTIONS:
+                path = arg[len(option) :]
+                if arg.startswith(option) and os.path.isabs(path) and os.path.isdir(path):
+                    deps[path] = stats_hash(path)
+    return deps
+
+
+# ビルドの入力からキャッシュのキーを計算する。
+#
+# *_dir の引数はマシンやチェックアウトごとに異なるので、
+# 他の引数に含まれているものも含めてプレースホルダーに置き換えてからハッシュを計算する。
+# パスを置き換えると中身の違いが分からなくなるので、
+# 参照しているディレクトリの中身は _get_artifact_dependencies() でキーに含める。
+# ビルドの並列数は結果に影響しないので含めない。
+def get_artifact_key(name: str, version: str, kwargs) -> str:
+    placeholders = []
+    for key, value in kwargs.items():
+        if key.endswith("_dir") and isinstance(value, str) and len(value) != 0:
+            placeholders.append((value, f"<{key}>"))
+            placeholders.append((cmake_path(value), f"<{key}>"))
+    placeholders.sort(key=lambda a: len(a[0]), reverse=True)
+
+    def normalize(value):
+        if isinstance(value, str):
+            for path, placeholder in placeholders:
+                value = value.replace(path, placeholder)
+            return value
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        return value
+
+    args = {
+        key: normalize(value)
+        for key, value in sorted(kwargs.items())
+        if key != "jobs" and not key.endswith("_dir")
+    }
+    inputs = {
+        "name": name,
+        "version": version,
+        "args": args,
+        "dependencies": _get_artifact_dependencies(kwargs, args),
+        "compilers": [normalize(_get_compiler_identity(c)) for c in _find_compilers(kwargs)],
+        "platform": [platform.system(), platform.machine()],
+    }
+    data = json.dumps(inputs, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _restore_artifact(cache: str, filename: str, path: str) -> bool:
+    if cache.startswith(("http://", "https://")):
+        try:
+            f = urllib.request.urlopen(f"{cache}/{filename}", timeout=URLOPEN_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                logging.warning(f"Failed to fetch {cache}/{filename}: {e}")
+            return False
+    else:
+        archive = os.path.join(cache, filename)
+        if not os.path.exists(archive):
+            return False
+        f = open(archive, "rb")
+    with f, open_tar(f, "gzip") as t:
+        rm_rf(path)
+        _extracttar(t, path)
+    return True
+
+
+def _store_artifact(cache: str, filename: str, path: str) -> bool:
+    if cache.startswith(("http://", "https://")):
+        return False
+    os.makedirs(cache, exist_ok=True)
+    archive = os.path.join(cache, filename)
+    tmp = f"{archive}.{os.getpid()}.tmp"
+    with create_tar(tmp, "gzip", level=6) as t:
+        t.add(path, arcname=os.path.basename(path))
+    os.replace(tmp, archive)
+    return True
+
+
+# ビルドした結果の {install_dir}/{name} をキャッシュに保存し、
+# 同じ入力でビルドする場合はキャッシュから展開するデコレータ。
+#
+# @versioned の内側に付けて使う。
+def artifact_cached(name: str):
+    def decorator(func):
+        def wrapper(version, **kwargs):
+            cache = get_artifact_cache()
+            if cache is None:
+                return func(version=version, **kwargs)
+
+            key = get_artifact_key(func.__name__, version, kwargs)
+            filename = f"{name}-{key}.tar.gz"
+            path = os.path.join(kwargs["install_dir"], name)
+            try:
+                if _restore_artifact(cache, filename, path):
+                    logging.info(f"Restored {name} from artifact cache: {filename}")
+                    return
+            except Exception:
+                logging.warning(f"Failed to restore {name} from artifact cache", exc_info=True)
+
+            r = func(version=version, **kwargs)
+
+            try:
+                if _store_artifact(cache, filename, path):
+                    logging.info(f"Stored {name} to artifact cache: {filename}")
+            except Exception:
+                logging.warning(f"Failed to store {name} to artifact cache", exc_info=True)
+            return r
+
+        return wrapper
+
+    return decorator
+
+
+# アーカイブの圧縮形式と、ファイルの先頭にあるマジックナンバー
+ARCHIVE_MAGICS: List[Tuple[str, bytes]] = [
+    ("gzip", b"\x1f\x8b"),
+    ("zstd", b"\x28\xb5\x2f\xfd"),
+    ("xz", b"\xfd7zXZ\x00"),
+    ("bz2", b"BZh"),
+    ("zip", b"PK\x03\x04"),
+    ("zip", b"PK\x05\x06"),
+]
+
+# tar アーカイブの拡張子と圧縮形式
+TAR_EXTENSIONS: Dict[str, str] = {
+    ".tar.gz": "gzip",
+    ".tgz": "gzip",
+    ".tar.zst": "zstd",
+    ".tar.xz": "xz",
+    ".tar.bz2": "bz2",
+    ".tar": "none",
+}
+
+# 各圧縮形式のデフォルトの圧縮レベル
+COMPRESSION_LEVELS: Dict[str, int] = {"gzip": 9, "zstd": 19, "xz": 6, "bz2": 9}
+
+
+# ファイルの先頭を読んで圧縮形式を判定する。
+# 圧縮されていない tar の場合は "none" を、判定できなかった場合は None を返す。
+def detect_archive_format(file: str) -> Optional[str]:
+    with open(file, "rb") as f:
+        header = f.read(512)
+    for name, magic in ARCHIVE_MAGICS:
+        if header.startswith(magic):
+            return name
+    if header[257:262] == b"ustar":
+        return "none"
+    return None
+
+
+# ファイル名の拡張子から tar アーカイブの圧縮形式を調べる。tar でなければ None を返す。
+def get_tar_compression(filename: str) -> Optional[str]:
+    for ext, compression in TAR_EXTENSIONS.items():
+        if filename.endswith(ext):
+            return compression
+    return None
+
+
+# f がまだ読み書きしていない通常のファイルで、外部コマンドに直接渡せるかどうか。
+# HTTP のレスポンスなどもファイルディスクリプタを持っているので、fileno() があるだけでは駄目。
+def _is_fresh_regular_file(f) -> bool:
+    try:
+        fd = f.fileno()
+        return (
+            stat.S_ISREG(os.fstat(fd).st_mode)
+            and f.tell() == 0
+            and os.lseek(fd, 0, os.SEEK_CUR) == 0
+        )
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+# 外部コマンドで展開したデータを読むストリーム。
+#
+# src が実際のファイルならそのままコマンドの標準入力にして、
+# そうでなければ（HTTP のレスポンスなど）別スレッドで src を読んで標準入力に流し込む。
+# close() ではコマンドの出力を最後まで読んで、コマンドが失敗していたら例外を投げる。
+class _CommandReader(object):
+    def __init__(self, args: List[str], src):
+        self._args = args
+        self._feeder = None
+        self._feeder_error: Optional[BaseException] = None
+        if _is_fresh_regular_file(src):
+            self._proc = subprocess.Popen(args, stdin=src, stdout=subprocess.PIPE)
+        else:
+            self._proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            self._feeder = threading.Thread(target=self._feed, args=(src,), daemon=True)
+            self._feeder.start()
+
+    def _feed(self, src):
+        try:
+            while True:
+                data = src.read(1024 * 1024)
+                if len(data) == 0:
+                    break
+                self._proc.stdin.write(data)
+        except BrokenPipeError:
+            pass
+        except BaseException as e:
+            self._feeder_error = e
+        finally:
+            try:
+                self._proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def read(self, size=-1):
+        return self._proc.stdout.read(size)
+
+    def close(self):
+        if self._proc.stdout.closed:
+            return
+        while len(self._proc.stdout.read(1024 * 1024)) != 0:
+            pass
+        self._proc.stdout.close()
+        if self._feeder is not None:
+            self._feeder.join()
+        if self._proc.wait() != 0:
+            raise Exception(f"{self._args[0]} failed with exit code {self._proc.returncode}")
+        if self._feeder_error is not None:
+            raise self._feeder_error
+
+    # 途中で失敗した場合は、コマンドの出力を読まずに終了させる
+    def kill(self):
+        self._proc.kill()
+        self._proc.stdout.close()
+        if self._feeder is not None:
+            self._feeder.join()
+        self._proc.wait()
+
+
+# 書き込んだデータを外部コマンドで圧縮して dst に書き出すストリーム。
+# dst はまだ何も書き込んでいない通常のファイルである必要がある。
+class _CommandWriter(object):
+    def __init__(self, args: List[str], dst):
+        self._args = args
+        self._proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=dst)
+
+    def write(self, data):
+        self._proc.stdin.write(data)
+        return len(data)
+
+    def flush(self):
+        self._proc.stdin.flush()
+
+    def close(self):
+        if self._proc.stdin.closed:
+            return
+        self._proc.stdin.close()
+        if self._proc.wait() != 0:
+            raise Exception(f"{self._args[0]} failed with exit code {self._proc.returncode}")
+
+    def kill(self):
+        self._proc.kill()
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._proc.wait()
+
+
+def _import_optional(name: str):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+# compression で圧縮された src を展開しながら読むストリームを返す。
+#
+# 以下の順に、利用できる最初のものを使う。
+# - 速いネイティブモジュール（gzip なら isal、zstd なら zstandard）
+# - マルチスレッドで動く外部コマンド（pigz, zstd, xz, lbzip2, pbzip2）
+# - 標準ライブラリ（zstd は Python 3.14 以降のみ）
+def open_decompressor(src, compression: str):
+    if compression == "gzip":
+        isal_igzip = _import_optional("isal.igzip")
+        if isal_igzip is not None:
+            logging.debug("Decompress gzip with isal")
+            return isal_igzip.IGzipFile(fileobj=src, mode="rb")
+    if compression == "zstd":
+        zstandard = _import_optional("zstandard")
+        if zstandard is not None:
+            logging.debug("Decompress zstd with zstandard")
+            return zstandard.ZstdDecompressor().stream_reader(src, read_across_frames=True)
+
+    commands = {
+        "gzip": [["pigz", "-dc"]],
+        "zstd": [["zstd", "-dcq"]],
+        "xz": [["xz", "-dc", f"-T{get_build_jobs()}"]],
+        "bz2": [["lbzip2", "-dc", f"-n{get_build_jobs()}"], ["pbzip2", "-dc"]],
+    }
+    for args in commands.get(compression, []):
+        if shutil.which(args[0]) is not None:
+            logging.debug(f"Decompress {compression} with {args[0]}")
+            return _CommandReader(args, src)
+
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=src, mode="rb")
+    if compression == "xz":
+        return lzma.LZMAFile(src, mode="rb")
+    if compression == "bz2":
+        return bz2.BZ2File(src, mode="rb")
+    if compression == "zstd":
+        zstd = _import_optional("compression.zstd")
+        if zstd is not None:
+            return zstd.ZstdFile(src, mode="rb")
+        raise Exception("zstd command or zstandard module is required to decompress zstd")
+    raise Exception(f"Unknown compression: {compression}")
+
+
+# dst に compression で圧縮して書き込むストリームを返す。
+#
+# マルチスレッドで圧縮できる外部コマンド（pigz, zstd, xz）を優先して使い、
+# 無ければネイティブモジュール、標準ライブラリの順に使う。
+# isal は圧縮レベルが 3 までしか無いので、gzip の level が 3 以下の場合だけ使う。
+# どの方法で圧縮するかはログに出力する。
+# gzip のヘッダーには、ファイル名と時刻を書き込まない。
+def open_compressor(dst, compression: str, level: Optional[int] = None):
+    if level is None:
+        level = COMPRESSION_LEVELS.get(compression, 6)
+    jobs = get_build_jobs()
+    commands = {
+        "gzip": [["pigz", "-cn", f"-{level}", "-p", str(jobs)]],
+        "zstd": [["zstd", "-cq", f"-{level}", f"-T{jobs}"]],
+        "xz": [["xz", "-c", f"-{level}", f"-T{jobs}"]],
+        "bz2": [["lbzip2", "-c", f"-{level}", f"-n{jobs}"], ["pbzip2", "-c", f"-{level}"]],
+    }
+    if _is_fresh_regular_file(dst):
+        for args in commands.get(compression, []):
+            if shutil.which(args[0]) is not None:
+                logging.info(f"Compress {compression} (level {level}) with {args[0]}")
+                return _CommandWriter(args, dst)
+
+    if compression == "gzip":
+        isal_igzip = _import_optional("isal.igzip") if level <= 3 else None
+        if isal_igzip is not None:
+            logging.info(f"Compress {compression} (level {level}) with isal")
+            return isal_igzip.IGzipFile(
+                filename="", fileobj=dst, mode="wb", compresslevel=level, mtime=0
+            )
+        logging.info(f"Compress {compression} (level {level}) with gzip module")
+        return gzip.GzipFile(filename="", fileobj=dst, mode="wb", compresslevel=level, mtime=0)
+    if compression == "zstd":
+        zstandard = _import_optional("zstandard")
+        if zstandard is not None:
+            logging.info(f"Compress {compression} (level {level}) with zstandard module")
+            return zstandard.ZstdCompressor(level=level, threads=-1).stream_writer(dst)
+        zstd = _import_optional("compression.zstd")
+        if zstd is not None:
+            logging.info(f"Compress {compression} (level {level}) with compression.zstd module")
+            return zstd.ZstdFile(dst, mode="wb", level=level)
+        raise Exception("zstd command or zstandard module is required to compress zstd")
+    if compression == "xz":
+        logging.info(f"Compress {compression} (level {level}) with lzma module")
+        return lzma.LZMAFile(dst, mode="wb", preset=level)
+    if compression == "bz2":
+        logging.info(f"Compress {compression} (level {level}) with bz2 module")
+        return bz2.BZ2File(dst, mode="wb", compresslevel=level)
+    raise Exception(f"Unknown compression: {compression}")
+
+
+# tar アーカイブをストリームとして読み書きする。
+#
+# with で使うと tarfile.TarFile を返す。
+# 圧縮されている場合は open_decompressor() / open_compressor() を使って、
+# 標準ライブラリよりも速い方法で展開・圧縮する。
+class TarStream(object):
+    def __init__(self, file, mode: str, compression: Optional[str], level: Optional[int]):
+        self._file = file
+        self._mode = mode
+        self._compression = compression
+        self._level = level
+        self._f = None
+        self._stream = None
+        self._tar = None
+
+    def __enter__(self) -> tarfile.TarFile:
+        try:
+            if isinstance(self._file, str):
+                self._f = open(self._file, "rb" if self._mode == "r" else "wb")
+            fileobj = self._f if self._f is not None else self._file
+            if self._compression is None or self._compression == "none":
+                self._tar = tarfile.open(fileobj=fileobj, mode="r|*" if self._mode == "r" else "w|")
+            elif self._mode == "r":
+                self._stream = open_decompressor(fileobj, self._compression)
+                self._tar = tarfile.open(fileobj=self._stream, mode="r|")
+            else:
+                self._stream = open_compressor(fileobj, self._compression, self._level)
+                self._tar = tarfile.open(fileobj=self._stream, mode="w|")
+            return self._tar
+        except BaseException:
+            self._cleanup(True)
+            raise
+
+    def __exit__(self, exctype, excvalue, trace):
+        self._cleanup(exctype is not None)
+
+    def _cleanup(self, failed: bool):
+        try:
+            if self._tar is not None and not failed:
+                self._tar.close()
+            if self._stream is not None:
+                if failed and hasattr(self._stream, "kill"):
+                    self._stream.kill()
+                elif not failed:
+                    self._stream.close()
+        finally:
+            if self._f is not None:
+                self._f.close()
+
+
+# file（ファイル名かファイルオブジェクト）の tar アーカイブをストリームとして読む。
+#
+# compression を省略した場合、ファイル名ならマジックナンバーから判定し、
+# ファイルオブジェクトなら tarfile に判定させる。
+def open_tar(file, compression: Optional[str] = None) -> TarStream:
+    if compression is None and isinstance(file, str):
+        compression = detect_archive_format(file)
+    return TarStream(file, "r", compression, None)
+
+
+# file（ファイル名かファイルオブジェクト）に compression で圧縮した tar アーカイブを書き出す。
+def create_tar(file, compression: str, level: Optional[int] = None) -> TarStream:
+    return TarStream(file, "w", compression, level)
+
+
 # アーカイブが単一のディレクトリに全て格納されているかどうかを調べる。
 #
 # 単一のディレクトリに格納されている場合はそのディレクトリ名を返す。
@@ -295,30 +2281,336 @@ def is_single_dir_zip(zip: zipfile.ZipFile) -> Optional[str]:
     return _is_single_dir(zip.infolist(), lambda z: z.filename, lambda z: z.is_dir())
 
 
-# 解凍した上でファイル属性を付与する
-def _extractzip(z: zipfile.ZipFile, path: str):
-    z.extractall(path)
-    if platform.system() == "Windows":
-        return
+# zip のメンバー名から展開先のパスを作る。
+# ZipFile.extract と同じように、絶対パスやドライブ名、".." を取り除く。
+def _zip_member_path(path: str, name: str) -> str:
+    name = name.replace("/", os.sep)
+    if os.altsep is not None:
+        name = name.replace(os.altsep, os.sep)
+    name = os.path.splitdrive(name)[1]
+    parts = [x for x in name.split(os.sep) if x not in ("", os.curdir, os.pardir)]
+    return os.path.join(path, *parts)
+
+
+# zip のメンバーを path に展開する。
+#
+# ディレクトリを先に全て作ってから、ファイルをサイズで均等になるように分けて並列に展開する。
+# 各ワーカーはそれぞれ ZipFile を開き直して、アーカイブ内の順番通りに読み込む。
+# ファイルの属性は書き込む時に設定し、シンボリックリンクはファイルを全て展開した後に
+# メンバーの内容（リンク先）から直接作る。
+# リンク先が存在しないシンボリックリンクは作らない。
+#
+# Windows では、ファイル属性の設定とシンボリックリンクの作成は行わず、
+# シンボリックリンクはリンク先が書かれた普通のファイルとして展開する。
+def _extractzip(
+    z: zipfile.ZipFile,
+    path: str,
+    filter: Optional[Callable[[str], bool]] = None,
+    max_workers: Optional[int] = None,
+):
+    unix = platform.system() != "Windows"
+    files = []
+    symlinks = []
     for info in z.infolist():
+        if filter is not None and not filter(info.filename):
+            continue
+        dst = _zip_member_path(path, info.filename)
         if info.is_dir():
+            os.makedirs(dst, exist_ok=True)
             continue
-        filepath = os.path.join(path, info.filename)
-        mod = info.external_attr >> 16
-        if (mod & 0o120000) == 0o120000:
-            # シンボリックリンク
-            with open(filepath, "r") as f:
-                src = f.read()
-            os.remove(filepath)
-            with cd(os.path.dirname(filepath)):
-                if os.path.exists(src):
-                    os.symlink(src, filepath)
-        if os.path.exists(filepath):
-            # 普通のファイル
-            os.chmod(filepath, mod & 0o777)
-
-
-# zip または tar.gz ファイルを展開する。
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        mode = info.external_attr >> 16
+        if unix and stat.S_ISLNK(mode):
+            symlinks.append((info, dst))
+        else:
+            files.append((info, dst, mode & 0o777 if unix else 0))
+
+    def extract_files(zip_path: Optional[str], chunk):
+        # ファイル名が分からない ZipFile の場合は開き直せないので、そのまま使う
+        zf = z if zip_path is None else zipfile.ZipFile(zip_path)
+        try:
+            for info, dst, mode in chunk:
+                with zf.open(info) as src, open(dst, "wb") as f:
+                    # 属性が記録されていないアーカイブ（Windows で作ったものなど）はデフォルトのまま
+                    if mode != 0:
+                        os.fchmod(f.fileno(), mode)
+                    shutil.copyfileobj(src, f, 1024 * 1024)
+        finally:
+            if zf is not z:
+                zf.close()
+
+    if max_workers is None:
+        max_workers = min(8, os.cpu_count() or 1)
+    total = sum(info.file_size for info, _, _ in files)
+    if z.filename is None or max_workers <= 1 or len(files) <= 1 or total < 1024 * 1024:
+        extract_files(None, files)
+    else:
+        # アーカイブ内の順番を保ったまま、展開後のサイズがだいたい同じになるように分ける
+        files.sort(key=lambda f: f[0].header_offset)
+        chunks = [[] for _ in range(max_workers)]
+        size = 0
+        for f in files:
+            chunks[min(max_workers - 1, size * max_workers // max(1, total))].append(f)
+            size += f[0].file_size
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(extract_files, z.filename, chunk) for chunk in chunks if chunk
+            ]
+            for future in futures:
+                future.result()
+
+    # シンボリックリンクを指すシンボリックリンクもあるので、作れるものが無くなるまで繰り返す
+    links = [(dst, z.read(info).decode("utf-8")) for info, dst in symlinks]
+    while len(links) != 0:
+        rest = []
+        for dst, target in links:
+            if os.path.exists(os.path.join(os.path.dirname(dst), target)):
+                os.symlink(target, dst)
+            else:
+                rest.append((dst, target))
+        if len(rest) == len(links):
+            for dst, target in rest:
+                logging.debug(f"Skip symlink {dst} -> {target}: target does not exist")
+            break
+        links = rest
+
+
+# 同じファイルから同じアーカイブを作るためのファイルの属性
+def _normalize_archive_mode(mode: int) -> int:
+    if stat.S_ISLNK(mode):
+        return 0o777
+    if stat.S_ISDIR(mode) or (mode & stat.S_IXUSR) != 0:
+        return 0o755
+    return 0o644
+
+
+# アーカイブにするファイルの一覧を作る。
+#
+# ファイルごとにサイズ、最終更新時刻、属性、SHA-256 を記録する。
+# シンボリックリンクの場合は SHA-256 の代わりにリンク先を記録する。
+# previous（前回の一覧）とサイズと最終更新時刻が同じファイルは、SHA-256 を計算し直さずに再利用する。
+def _compute_archive_manifest(
+    base_dir: str, files: Sequence[str], previous: Dict[str, dict]
+) -> Dict[str, dict]:
+    manifest: Dict[str, dict] = {}
+    to_hash: List[str] = []
+    for file in files:
+        st = os.lstat(os.path.join(base_dir, file))
+        entry = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "mode": _normalize_archive_mode(st.st_mode),
+        }
+        if stat.S_ISLNK(st.st_mode):
+            entry["link"] = os.readlink(os.path.join(base_dir, file))
+        else:
+            prev = previous.get(file, {})
+            if prev.get("size") == st.st_size and prev.get("mtime_ns") == st.st_mtime_ns:
+                entry["sha256"] = prev.get("sha256")
+            if entry.get("sha256") is None:
+                to_hash.append(file)
+        manifest[file] = entry
+
+    if len(to_hash) != 0:
+        logging.debug(f"Compute SHA-256 of {len(to_hash)} files in {base_dir}")
+        with concurrent.futures.ThreadPoolExecutor(min(8, os.cpu_count() or 1)) as executor:
+            digests = executor.map(lambda f: _sha256_file(os.path.join(base_dir, f)), to_hash)
+            for file, digest in zip(to_hash, digests):
+                manifest[file]["sha256"] = digest
+    return manifest
+
+
+# アーカイブの内容を比較するためのキー。サイズと最終更新時刻は内容に影響しないので含めない。
+def _archive_manifest_key(manifest: dict) -> dict:
+    return {
+        "archive": manifest["archive"],
+        "compression": manifest["compression"],
+        "mtime": manifest["mtime"],
+        "files": {
+            file: {k: v for k, v in entry.items() if k not in ("size", "mtime_ns")}
+            for file, entry in manifest["files"].items()
+        },
+    }
+
+
+# base_dir 以下の files（base_dir からの相対パス）をまとめたアーカイブを archive_path に作り、
+# その SHA-256 を返す。
+#
+# compression が "zip" なら zip を、それ以外ならその圧縮形式で圧縮した tar を作る。
+#
+# 同じファイルからは同じアーカイブができるように、エントリはパスでソートし、
+# 最終更新時刻は mtime に、所有者は 0 (root) に揃え、権限は実行可能かどうかだけを残す。
+# 圧縮した結果は圧縮に使ったツール（pigz や zlib など）によって変わるので、
+# 同じバイト列になるのは同じツールで圧縮した場合だけになる。
+#
+# manifest_path を指定した場合、各ファイルのパス、サイズ、最終更新時刻、SHA-256 を記録しておき、
+# 次に呼ばれた時にファイルの内容と引数が前回と同じで、前回のアーカイブが残っていれば、
+# アーカイブを作り直さずに前回の SHA-256 を返す。
+def create_reproducible_archive(
+    archive_path: str,
+    base_dir: str,
+    files: Sequence[str],
+    compression: str,
+    mtime: int,
+    manifest_path: Optional[str] = None,
+) -> str:
+    files = sorted(f.replace(os.sep, "/") for f in files)
+
+    def save_manifest(data: dict):
+        tmp = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp, manifest_path)
+
+    manifest = None
+    if manifest_path is not None:
+        previous = {}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path) as f:
+                    previous = json.load(f)
+            except ValueError:
+                logging.warning(f"Failed to read {manifest_path}, ignore it")
+        manifest = {
+            "archive": os.path.basename(archive_path),
+            "compression": compression,
+            "mtime": mtime,
+            "files": _compute_archive_manifest(base_dir, files, previous.get("files", {})),
+        }
+        if (
+            previous.get("archive_sha256") is not None
+            and os.path.isfile(archive_path)
+            and os.path.getsize(archive_path) == previous.get("archive_size")
+            and _archive_manifest_key(previous) == _archive_manifest_key(manifest)
+        ):
+            logging.info(f"{archive_path} is up to date")
+            if previous["files"] != manifest["files"]:
+                # 最終更新時刻だけが変わったファイルがあるので、
+                # 次に SHA-256 を再利用できるように更新する
+                save_manifest({**previous, "files": manifest["files"]})
+            return previous["archive_sha256"]
+        rm_rf(manifest_path)
+
+    tmp = f"{archive_path}.{os.getpid()}.tmp"
+    try:
+        if compression == "zip":
+            # zip は 1980 年より前の時刻を表現できない
+            date_time = time.gmtime(max(mtime, 315532800))[:6]
+            with zipfile.ZipFile(tmp, "w") as z:
+                for file in files:
+                    path = os.path.join(base_dir, file)
+                    info = zipfile.ZipInfo(file, date_time=date_time)
+                    info.create_system = 3
+                    info.external_attr = (
+                        stat.S_IFREG | _normalize_archive_mode(os.stat(path).st_mode)
+                    ) << 16
+                    info.file_size = os.path.getsize(path)
+                    with open(path, "rb") as src, z.open(info, "w") as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+        else:
+            with create_tar(tmp, compression) as t:
+                for file in files:
+                    path = os.path.join(base_dir, file)
+                    info = t.gettarinfo(path, arcname=file)
+                    info.mtime = mtime
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = ""
+                    info.mode = _normalize_archive_mode(os.lstat(path).st_mode)
+                    if info.isreg():
+                        with open(path, "rb") as f:
+                            t.addfile(info, f)
+                    else:
+                        t.addfile(info)
+        os.replace(tmp, archive_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    digest = _sha256_file(archive_path)
+    if manifest_path is not None:
+        manifest["archive_size"] = os.path.getsize(archive_path)
+        manifest["archive_sha256"] = digest
+        save_manifest(manifest)
+    return digest
+
+
+# ストリームとして開いた tar を一度だけ読みながら path に展開する。
+#
+# アーカイブが単一のディレクトリに格納されていると仮定して、読んだメンバーの最上位のディレクトリを
+# 剥がしながら展開していき、途中で別の最上位のエントリが見つかった場合は、
+# それまでに展開した内容を path/<最上位のディレクトリ> に移動してから続きを展開する。
+# そのため、getmembers() でアーカイブ全体を先に読む必要が無く、展開結果は
+# is_single_dir_tar() で判定してから展開した場合と同じになる。
+#
+# filter が指定された場合、メンバー名（剥がす前の名前）を渡して
+# True を返したメンバーだけを展開する。
+#
+# 剥がしたディレクトリ名を返す。剥がさなかった場合は None を返す。
+def _extracttar(
+    t: tarfile.TarFile, path: str, filter: Optional[Callable[[str], bool]] = None
+) -> Optional[str]:
+    os.makedirs(path, exist_ok=True)
+    stripping = True
+    dirname = None
+    directories = []
+
+    def unstrip(name):
+        return dirname if name == "." else f"{dirname}/{name}"
+
+    for info in t:
+        name = info.name.rstrip("/")
+        # 剥がすかどうかの判定は、展開しないメンバーも含めて行う
+        skip = filter is not None and not filter(info.name)
+        n = name.find("/")
+        if n == -1:
+            # ルートディレクトリにファイルが存在している場合は剥がせない
+            top = name if info.isdir() else None
+            rest = "."
+        else:
+            top = name[0:n]
+            rest = name[n + 1 :]
+
+        if stripping and dirname is None and top is not None:
+            dirname = top
+        if stripping and (top is None or top != dirname):
+            if dirname is not None:
+                # ここまで剥がして展開した内容を path/<dirname> に移動する
+                logging.debug(f"Directory {dirname} is not stripped")
+                tmp = f"{path}.strip-{os.getpid()}"
+                os.replace(path, tmp)
+                os.makedirs(path)
+                os.replace(tmp, os.path.join(path, dirname))
+                for d in directories:
+                    d.name = unstrip(d.name)
+            stripping = False
+
+        if skip:
+            continue
+
+        if stripping:
+            info.name = rest
+            if info.islnk() and info.linkname.startswith(f"{dirname}/"):
+                info.linkname = info.linkname[len(dirname) + 1 :]
+
+        # ディレクトリの属性は、中身を展開した後に設定する（extractall と同じ）
+        t.extract(info, path, set_attrs=not info.isdir())
+        if info.isdir():
+            directories.append(copy.copy(info))
+
+    directories.sort(key=lambda a: a.name, reverse=True)
+    for info in directories:
+        dirpath = os.path.join(path, info.name)
+        try:
+            t.chown(info, dirpath, False)
+            t.utime(info, dirpath)
+            t.chmod(info, dirpath)
+        except tarfile.ExtractError as e:
+            logging.debug(f"tarfile: {e}")
+
+    return dirname if stripping else None
+
+
+# zip または tar（無圧縮か gzip, zstd, xz, bz2 で圧縮したもの）ファイルを展開する。
+# 形式はファイルの先頭のマジックナンバーから判定するが、filetype で指定することもできる。
 #
 # 展開先のディレクトリは {output_dir}/{output_dirname} となり、
 # 展開先のディレクトリが既に存在していた場合は削除される。
@@ -340,43 +2632,149 @@ def _extractzip(z: zipfile.ZipFile, path: str):
 # - out/libsora/libsora-1.23/file2
 # - out/libsora/LICENSE
 # が出力される。
-def extract(file: str, output_dir: str, output_dirname: str, filetype: Optional[str] = None):
+#
+# filter を指定した場合、アーカイブ内のメンバー名を渡して True を返したメンバーだけを展開する。
+# 最上位のディレクトリを剥がすかどうかは、展開しなかったメンバーも含めて判定する。
+@traced("extract")
+def extract(
+    file: str,
+    output_dir: str,
+    output_dirname: str,
+    filetype: Optional[str] = None,
+    filter: Optional[Callable[[str], bool]] = None,
+):
     path = os.path.join(output_dir, output_dirname)
     logging.info(f"Extract {file} to {path}")
-    if filetype == "gzip" or file.endswith(".tar.gz"):
-        rm_rf(path)
-        with tarfile.open(file) as t:
-            dir = is_single_dir_tar(t)
-            if dir is None:
-                os.makedirs(path, exist_ok=True)
-                t.extractall(path)
-            else:
+    if filetype is None:
+        filetype = detect_archive_format(file)
+    if filetype in ("gzip", "zstd", "xz", "bz2", "none"):
+        rm_rf(path, background=True)
+        # 巨大なアーカイブを二回展開しないように、ストリームとして一回だけ読む
+        with open_tar(file, filetype) as t:
+            dir = _extracttar(t, path, filter)
+            if dir is not None:
                 logging.info(f"Directory {dir} is stripped")
-                path2 = os.path.join(output_dir, dir)
-                rm_rf(path2)
-                t.extractall(output_dir)
-                if path != path2:
-                    logging.debug(f"mv {path2} {path}")
-                    os.replace(path2, path)
-    elif filetype == "zip" or file.endswith(".zip"):
-        rm_rf(path)
+    elif filetype == "zip":
+        rm_rf(path, background=True)
         with zipfile.ZipFile(file) as z:
             dir = is_single_dir_zip(z)
             if dir is None:
                 os.makedirs(path, exist_ok=True)
                 # z.extractall(path)
-                _extractzip(z, path)
+                _extractzip(z, path, filter)
             else:
                 logging.info(f"Directory {dir} is stripped")
                 path2 = os.path.join(output_dir, dir)
-                rm_rf(path2)
+                rm_rf(path2, background=True)
                 # z.extractall(output_dir)
-                _extractzip(z, output_dir)
+                _extractzip(z, output_dir, filter)
                 if path != path2:
                     logging.debug(f"mv {path2} {path}")
                     os.replace(path2, path)
     else:
-        raise Exception("file should end with .tar.gz or .zip")
+        raise Exception(f"Unknown archive format: {file}")
+
+
+# 読み込んだデータを別のファイルに書き出しつつ SHA-256 を計算するファイルオブジェクト
+class _TeeReader(object):
+    def __init__(self, src, dst):
+        self._src = src
+        self._dst = dst
+        self._hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._src.read(size)
+        self._dst.write(data)
+        self._hash.update(data)
+        return data
+
+    # 残りのデータを全て読み込む（tar の末尾のパディングなど）
+    def drain(self):
+        while len(self.read(1024 * 1024)) != 0:
+            pass
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+# url からダウンロードしながら {output_dir}/{output_dirname} に展開する。
+#
+# HTTP のレスポンスをそのまま tar の展開処理に流し込むので、
+# 展開にかかる時間がダウンロードの時間に隠れる。
+# 同時にアーカイブを {source_dir}/{filename} に保存し、
+# SHA-256 を計算してダウンロードストアに登録する。
+# 展開結果は download() してから extract() した場合と同じになる。
+#
+# 以下の場合は download() と extract() を順に呼ぶのと同じ動作になる。
+# - tar 以外のアーカイブ
+# - 既にアーカイブがダウンロード済み、事前取得済み、またはダウンロードストアにある
+# - ストリーミングでの取得に失敗した
+@traced("download")
+def download_and_extract(
+    url: str,
+    source_dir: str,
+    output_dir: str,
+    output_dirname: str,
+    filename: Optional[str] = None,
+) -> str:
+    if filename is None:
+        filename = urllib.parse.urlparse(url).path.split("/")[-1]
+    archive = os.path.join(source_dir, filename)
+    path = os.path.join(output_dir, output_dirname)
+    store = get_download_store()
+
+    compression = get_tar_compression(filename)
+    streamable = (
+        compression is not None
+        and not os.path.exists(archive)
+        and url not in _prefetched_downloads
+        and (store is None or store.lookup(url) is None)
+    )
+    if streamable:
+        logging.info(f"Download and extract {url} to {path}")
+        rm_rf(path)
+        tmp = f"{archive}.part"
+        try:
+            with urllib.request.urlopen(url, timeout=URLOPEN_TIMEOUT) as res, open(tmp, "wb") as f:
+                tee = _TeeReader(res, f)
+                with open_tar(tee, compression) as t:
+                    dir = _extracttar(t, path)
+                tee.drain()
+            os.replace(tmp, archive)
+            digest = tee.hexdigest()
+            if dir is not None:
+                logging.info(f"Directory {dir} is stripped")
+            logging.info(f"Downloaded {archive} (sha256: {digest})")
+            if store is not None:
+                store.add(url, archive, digest)
+            return archive
+        except Exception as e:
+            # ゴミを残さないようにして、通常のダウンロードと展開を試みる
+            logging.warning(f"Failed to download and extract {url} in streaming mode: {e}")
+            rm_rf(tmp)
+            rm_rf(path)
+
+    archive = download(url, output_dir=source_dir, filename=filename)
+    extract(archive, output_dir=output_dir, output_dirname=output_dirname)
+    return archive
+
+
+# download_and_extract() でダウンロードしながら展開できる URL かどうか。
+#
+# prefetch() で事前に取得したものはストリーミングで展開せずに通常の展開をするので、
+# ストリーミングで展開したい URL は、事前に取得するものから除くこと。
+# ただし複数のターゲットで共有して事前に取得したもの（SORA_BUILD_SHARED_PREFETCH_DIR）は、
+# ネットワークにアクセスせずに使える方が速いので False を返す。
+def is_streamable_download(url: str) -> bool:
+    filename = urllib.parse.urlparse(url).path.split("/")[-1]
+    if get_tar_compression(filename) is None:
+        return False
+    shared_dir = os.environ.get("SORA_BUILD_SHARED_PREFETCH_DIR")
+    if shared_dir is not None and os.path.exists(
+        os.path.join(shared_dir, _prefetch_key(url), filename)
+    ):
+        return False
+    return True
 
 
 def clone_and_checkout(url, version, dir, fetch, fetch_force):
@@ -397,12 +2795,231 @@ def clone_and_checkout(url, version, dir, fetch, fetch_force):
 
 def git_clone_shallow(url, hash, dir):
     rm_rf(dir)
+
+    prefetched = _prefetched_repositories.pop((url, hash), None)
+    if prefetched is not None and os.path.exists(prefetched):
+        logging.debug(f"mv {prefetched} {dir} (prefetched)")
+        mkdir_p(os.path.dirname(os.path.abspath(dir)))
+        os.replace(prefetched, dir)
+        return
+
     mkdir_p(dir)
-    with cd(dir):
-        cmd(["git", "init"])
-        cmd(["git", "remote", "add", "origin", url])
-        cmd(["git", "fetch", "--depth=1", "origin", hash])
-        cmd(["git", "reset", "--hard", "FETCH_HEAD"])
+    # prefetch() から別スレッドで呼ばれることがあるので、cd() は使わずに cwd を指定する
+    cmd(["git", "init"], cwd=dir)
+    cmd(["git", "remote", "add", "origin", url], cwd=dir)
+    cmd(["git", "fetch", "--depth=1", "origin", hash], cwd=dir)
+    cmd(["git", "reset", "--hard", "FETCH_HEAD"], cwd=dir)
+
+
+# prefetch() で取得したものを置く、prefetch_dir 以下のディレクトリ名
+def _prefetch_key(s: str) -> str:
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()[:16]
+
+
+# アーカイブのダウンロードと git リポジトリの取得を並列に行っておく。
+#
+# 取得したものは prefetch_dir 以下に置かれ、後で download() や git_clone_shallow() が
+# 同じ URL（git の場合は URL とコミット）を要求した時に、ダウンロードの代わりに移動して利用される。
+# prefetch_dir は移動先と同じファイルシステム上にある必要がある。
+#
+# 取得に失敗したものはここではエラーにせず、後で download() や git_clone_shallow() を呼んだ時に
+# 改めて取得を試みる。
+#
+# shared=True の場合は、取得したものを移動せずに prefetch_dir に残して、
+# SORA_BUILD_SHARED_PREFETCH_DIR 環境変数で子プロセスに知らせる。
+# 子プロセスの prefetch() は、そこにあるものをネットワークにアクセスせずにリンクやコピーで利用する。
+# 複数のターゲットを並列にビルドする時に、共通のものを 1 回だけ取得するために使う。
+def prefetch(
+    urls: List[str],
+    repositories: List[Tuple[str, str]],
+    prefetch_dir: str,
+    jobs: int = 4,
+    shared: bool = False,
+):
+    if len(urls) == 0 and len(repositories) == 0:
+        return
+
+    shared_dir = None if shared else os.environ.get("SORA_BUILD_SHARED_PREFETCH_DIR")
+
+    def fetch_url(url):
+        output_dir = os.path.join(prefetch_dir, _prefetch_key(url))
+        rm_rf(output_dir)
+        mkdir_p(output_dir)
+        if shared_dir is not None:
+            filename = urllib.parse.urlparse(url).path.split("/")[-1]
+            path = os.path.join(shared_dir, _prefetch_key(url), filename)
+            if os.path.exists(path):
+                output_path = os.path.join(output_dir, os.path.basename(path))
+                logging.debug(f"ln {path} {output_path} (shared prefetch)")
+                _link_or_copy(path, output_path)
+                return output_path
+        return download(url, output_dir)
+
+    def fetch_repository(url, hash):
+        dir = os.path.join(prefetch_dir, _prefetch_key(f"{url}#{hash}"))
+        if shared_dir is not None:
+            path = os.path.join(shared_dir, _prefetch_key(f"{url}#{hash}"))
+            if os.path.exists(path):
+                logging.debug(f"cp -r {path} {dir} (shared prefetch)")
+                rm_rf(dir)
+                copytree(path, dir, include_hidden=True, symlinks=True)
+                return dir
+        git_clone_shallow(url, hash, dir)
+        return dir
+
+    logging.info(f"Prefetch {len(urls)} archives and {len(repositories)} repositories")
+    mkdir_p(prefetch_dir)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {}
+        for url in urls:
+            futures[executor.submit(fetch_url, url)] = ("url", url)
+        for url, hash in repositories:
+            futures[executor.submit(fetch_repository, url, hash)] = ("git", (url, hash))
+        for future in concurrent.futures.as_completed(futures):
+            kind, key_ = futures[future]
+            try:
+                path = future.result()
+            except Exception as e:
+                logging.warning(f"Failed to prefetch {key_}: {e}")
+                continue
+            if shared:
+                continue
+            if kind == "url":
+                _prefetched_downloads[key_] = path
+            else:
+                _prefetched_repositories[key_] = path
+    if shared:
+        os.environ["SORA_BUILD_SHARED_PREFETCH_DIR"] = os.path.abspath(prefetch_dir)
+
+
+# run_build_steps() で実行するビルドステップ
+#
+# - name: ステップ名
+# - func: ステップの処理。子プロセスで実行される可能性がある
+# - deps: このステップより先に完了している必要があるステップ名のリスト
+# - build: コンパイルなど CPU を使うステップかどうか。
+#          True の場合は CPU の並列数の予算を割り当てて、get_build_jobs() がその値を返すようにする
+# - on_complete: ステップが完了した後に、親プロセスで実行する処理。
+#                PATH など、後続のステップに引き継ぐ必要がある環境変数の設定に使う
+class BuildStep(NamedTuple):
+    name: str
+    func: Callable[[], None]
+    deps: Sequence[str] = ()
+    build: bool = False
+    on_complete: Optional[Callable[[], None]] = None
+
+
+def _run_build_step_process(step: BuildStep, jobs: int, acquire_token: bool):
+    os.environ["SORA_BUILD_JOBS"] = str(jobs)
+    try:
+        # 他のビルドステップが親プロセスの暗黙のトークンを使っているので、
+        # このステップ用のトークンを jobserver から取得してから実行する
+        token = _jobserver.acquire() if acquire_token and _jobserver is not None else None
+        try:
+            with trace_span(step.name, "step"):
+                step.func()
+            # 子プロセスは os._exit() で終わるので、ステップの中で始めた削除は別のプロセスに任せる
+            detach_background_deletions()
+        finally:
+            if token is not None:
+                _jobserver.release(token)
+    except BaseException:
+        logging.exception(f"Build step {step.name} failed")
+        os._exit(1)
+    os._exit(0)
+
+
+# 依存関係を満たしたステップから順に、並列にビルドステップを実行する。
+#
+# 各ステップは fork した子プロセスで実行するので、os.chdir() などを使っていても互いに影響しない。
+# build=True のステップには、合計が jobs（デフォルトは CPU の数）を超えないように
+# 並列数を割り当てるので、複数のステップで同時に cmake --build や b2 を実行しても
+# CPU を使いすぎることは無い。
+# jobserver を使っている場合は、並列数を割り当てる代わりに、
+# 全てのビルドが jobserver のトークンを取り合う。
+#
+# fork が使えない環境（Windows など）や parallel=False の場合は、依存関係の順に一つずつ実行する。
+def run_build_steps(steps: List[BuildStep], jobs: Optional[int] = None, parallel: bool = True):
+    steps_by_name = {step.name: step for step in steps}
+    for step in steps:
+        for dep in step.deps:
+            if dep not in steps_by_name:
+                raise Exception(f"Build step {step.name} depends on unknown step {dep}")
+
+    budget = jobs if jobs is not None else get_build_jobs()
+    if "fork" not in multiprocessing.get_all_start_methods():
+        parallel = False
+
+    done = set()
+    pending = list(steps)
+    running = {}
+    free = budget
+    failed = []
+
+    def is_ready(step):
+        return all(dep in done for dep in step.deps)
+
+    def complete(step):
+        if step.on_complete is not None:
+            step.on_complete()
+        done.add(step.name)
+
+    if not parallel:
+        while len(pending) != 0:
+            ready = [step for step in pending if is_ready(step)]
+            if len(ready) == 0:
+                raise Exception(f"Circular dependency in build steps: {[s.name for s in pending]}")
+            step = ready[0]
+            pending.remove(step)
+            logging.info(f"Build step {step.name}")
+            with trace_span(step.name, "step"):
+                step.func()
+            complete(step)
+        return
+
+    ctx = multiprocessing.get_context("fork")
+    while len(pending) != 0 or len(running) != 0:
+        if len(failed) == 0:
+            ready = [step for step in pending if is_ready(step)]
+            ready_builds = [step for step in ready if step.build]
+            for step in ready:
+                if step.build and _jobserver is not None:
+                    n = budget
+                elif step.build:
+                    if free == 0:
+                        continue
+                    n = max(1, free // len(ready_builds))
+                    ready_builds.remove(step)
+                else:
+                    n = 1
+                pending.remove(step)
+                logging.info(f"Build step {step.name} started (jobs={n})")
+                # jobserver を使っている場合、最初のビルドステップは親プロセスの暗黙のトークンを使う
+                acquire_token = step.build and any(s.build for _, s, _ in running.values())
+                p = ctx.Process(target=_run_build_step_process, args=(step, n, acquire_token))
+                p.start()
+                reserved = n if step.build and _jobserver is None else 0
+                running[p.sentinel] = (p, step, reserved)
+                free -= reserved
+
+        if len(running) == 0:
+            if len(failed) != 0:
+                break
+            raise Exception(f"Circular dependency in build steps: {[s.name for s in pending]}")
+
+        for sentinel in multiprocessing.connection.wait(list(running.keys())):
+            p, step, n = running.pop(sentinel)
+            p.join()
+            free += n
+            if p.exitcode != 0:
+                logging.error(f"Build step {step.name} failed (exitcode={p.exitcode})")
+                failed.append(step.name)
+                continue
+            logging.info(f"Build step {step.name} finished")
+            complete(step)
+
+    if len(failed) != 0:
+        raise Exception(f"Build steps failed: {failed}")
 
 
 def apply_patch(patch, dir, depth):
@@ -425,24 +3042,119 @@ def apply_patch(patch, dir, depth):
                 cmd(["patch", f"-p{depth}"], stdin=stdin)
 
 
+# dst が src と同じサイズと最終更新時刻を持っていれば、同じ内容だとみなす。
+def _is_same_size_and_mtime(src_stat: os.stat_result, dst: str) -> bool:
+    try:
+        dst_stat = os.stat(dst)
+    except OSError:
+        return False
+    return (
+        stat.S_ISREG(dst_stat.st_mode)
+        and dst_stat.st_size == src_stat.st_size
+        and dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+    )
+
+
+# src の内容を dst にコピーする。
+# reflink できればそれを使い、Linux では os.copy_file_range でカーネル内でコピーする。
+# どちらも使えない場合は shutil.copyfile でコピーする。
+#
+# dst がダウンロードキャッシュへのハードリンクだった場合に中身を書き換えないよう、
+# 既存の dst は先に削除しておく。
+def _copy_file_data(src: str, dst: str):
+    if os.path.lexists(dst) and not os.path.isdir(dst):
+        os.remove(dst)
+    if _try_reflink(src, dst):
+        return
+    if not hasattr(os, "copy_file_range"):
+        shutil.copyfile(src, dst)
+        return
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1024 * 1024 * 1024) != 0:
+                pass
+            return
+        except OSError:
+            # 古いカーネルや、ファイルシステムをまたぐ場合などは使えないので普通にコピーする
+            pass
+        fsrc.seek(0)
+        fdst.seek(0)
+        fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+
+# src と dst の内容が異なる場合だけ src を dst にコピーする。
+# サイズが違えば比較せずにコピーし、サイズが同じなら内容を比較する。
+#
+# dst の最終更新時刻は、内容が変わった時だけ更新されてほしいので、src の時刻は引き継がない。
+# そのため copytree() のように最終更新時刻で比較を省略することはできない。
 def copyfile_if_different(src, dst):
-    if os.path.exists(dst) and filecmp.cmp(src, dst, shallow=False):
+    if (
+        os.path.isfile(dst)
+        and os.path.getsize(dst) == os.path.getsize(src)
+        and filecmp.cmp(src, dst, shallow=False)
+    ):
         return
-    shutil.copyfile(src, dst)
+    _copy_file_data(src, dst)
 
 
+# src_dir 以下を dst_dir 以下にコピーする。dst_dir が既に存在していても構わない。
+#
+# os.scandir でディレクトリを辿ってディレクトリを作り、ファイルのコピーは並列に行う。
+# ファイルの権限と最終更新時刻は shutil.copy2 と同様に引き継ぐので、
+# サイズと最終更新時刻が同じファイルは、前回コピーしたものとみなしてスキップする。
+#
+# 以前の glob("**") を使った実装と同じく、. で始まるファイルとディレクトリはコピーしない。
+# include_hidden=True の場合はそれらもコピーする。
+# symlinks=True の場合は、シンボリックリンクをリンク先の内容ではなくリンクとしてコピーする。
+#
 # NOTE(enm10k): shutil.copytree に Python 3.8 で追加された dirs_exist_ok=True を指定して使いたかったが、
 # GitHub Actions の Windows のランナー (widnwos-2019) にインストールされている Python のバージョンが古くて利用できなかった
 # actions/setup-python で Python 3.8 を設定してビルドしたところ、 Lyra のビルドがエラーになったためこの関数を自作した
 # Windows のランナーを更新した場合は、この関数は不要になる可能性が高い
-def copytree(src_dir, dst_dir):
-    for file_path in glob.glob(src_dir + "/**", recursive=True):
-        dest_path = os.path.join(dst_dir, os.path.relpath(file_path, src_dir))
+def copytree(
+    src_dir,
+    dst_dir,
+    max_workers: Optional[int] = None,
+    include_hidden: bool = False,
+    symlinks: bool = False,
+):
+    files: List[Tuple[str, str]] = []
+    skipped = 0
+    dirs = [(src_dir, dst_dir)]
+    while len(dirs) != 0:
+        src, dst = dirs.pop()
+        os.makedirs(dst, exist_ok=True)
+        with os.scandir(src) as it:
+            for entry in it:
+                if not include_hidden and entry.name.startswith("."):
+                    continue
+                dst_path = os.path.join(dst, entry.name)
+                if symlinks and entry.is_symlink():
+                    if os.path.lexists(dst_path):
+                        rm_rf(dst_path)
+                    os.symlink(os.readlink(entry.path), dst_path, entry.is_dir())
+                elif entry.is_dir():
+                    dirs.append((entry.path, dst_path))
+                elif _is_same_size_and_mtime(entry.stat(), dst_path):
+                    skipped += 1
+                else:
+                    files.append((entry.path, dst_path))
 
-        if os.path.isdir(file_path):
-            os.makedirs(dest_path, exist_ok=True)
-        else:
-            shutil.copy2(file_path, dest_path)
+    def copy(src: str, dst: str):
+        _copy_file_data(src, dst)
+        shutil.copystat(src, dst)
+
+    if max_workers is None:
+        max_workers = min(16, (os.cpu_count() or 1) * 2)
+    if len(files) <= 1 or max_workers <= 1:
+        for src, dst in files:
+            copy(src, dst)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for future in [executor.submit(copy, src, dst) for src, dst in files]:
+                future.result()
+    logging.debug(f"copytree: {src_dir} -> {dst_dir}: copied {len(files)}, skipped {skipped}")
 
 
 def git_get_url_and_revision(dir):
@@ -461,18 +3173,20 @@ def replace_vcproj_static_runtime(project_file: str):
     open(project_file, "w", encoding="utf-8").write(s)
 
 
-@versioned
-def install_webrtc(version, source_dir, install_dir, platform: str):
+def get_webrtc_url(version, platform: str) -> str:
     win = platform.startswith("windows_")
     filename = f'webrtc.{platform}.{"zip" if win else "tar.gz"}'
+    return f"https://github.com/enm10k/webrtc-build/releases/download/{version}/{filename}"
+
+
+@versioned
+def install_webrtc(version, source_dir, install_dir, platform: str):
+    url = get_webrtc_url(version, platform)
+    filename = url.split("/")[-1]
     rm_rf(os.path.join(source_dir, filename))
-    archive = download(
-        f"https://github.com/enm10k/webrtc-build/releases/download/{version}/{filename}",
-        output_dir=source_dir,
-    )
     # archive = gh_run_download("enm10k/webrtc-build", filename, source_dir, branch="master")
-    rm_rf(os.path.join(install_dir, "webrtc"))
-    extract(archive, output_dir=install_dir, output_dirname="webrtc")
+    rm_rf(os.path.join(install_dir, "webrtc"), background=True)
+    download_and_extract(url, source_dir, output_dir=install_dir, output_dirname="webrtc")
 
 
 def build_webrtc(platform, webrtc_build_dir, webrtc_build_args, debug):
@@ -569,15 +3283,134 @@ def install_boost(version, source_dir, install_dir, sora_version, platform: str)
         f'boost-{version}_sora-cpp-sdk-{sora_version}_{platform}.{"zip" if win else "tar.gz"}'
     )
     rm_rf(os.path.join(source_dir, filename))
-    archive = download(
+    rm_rf(os.path.join(install_dir, "boost"), background=True)
+    download_and_extract(
         f"https://github.com/shiguredo/sora-cpp-sdk/releases/download/{sora_version}/{filename}",
-        output_dir=source_dir,
+        source_dir,
+        output_dir=install_dir,
+        output_dirname="boost",
     )
-    rm_rf(os.path.join(install_dir, "boost"))
-    extract(archive, output_dir=install_dir, output_dirname="boost")
+
+
+def get_boost_source_url(version: str) -> str:
+    version_underscore = version.replace(".", "_")
+    return f"https://boostorg.jfrog.io/artifactory/main/release/{version}/source/boost_{version_underscore}.tar.gz"
+
+
+# ビルドする Boost のライブラリ（b2 の --with-<library> に指定するもの）
+BOOST_BUILD_LIBRARIES = ["json", "filesystem"]
+
+
+# Boost のソースのうち、libraries のビルドに必要なファイルだけを展開するための情報。
+#
+# Boost のアーカイブには全てのライブラリのソースやドキュメント、テストが含まれていて、
+# 全て展開すると数万ファイルになるが、実際にビルドに必要なのは
+# - ルートにあるファイル（Jamroot, bootstrap.sh など）
+# - tools/build と tools/boost_install（b2 本体とインストール処理）
+# - boost/ （全てのライブラリのヘッダ）
+# - libs/ のうち、ビルドするライブラリと、その Jamfile から参照されているライブラリ
+# だけなので、アーカイブの Jamfile を読んでこれらのディレクトリの一覧を計算する。
+#
+# 計算にはアーカイブを一度読む必要があるので、結果は Boost のバージョンごとに
+# キャッシュディレクトリ（無ければアーカイブと同じディレクトリ）に保存しておく。
+class BoostClosure(object):
+    # Jamfile 内で他のライブラリを参照している箇所
+    # - /boost/atomic//boost_atomic
+    # - ../../config/checks/config
+    # - libs/config/checks/architecture
+    REFERENCE_PATTERNS = (
+        re.compile(r"/boost/(\w+)//"),
+        re.compile(r"\.\./\.\./(\w+)/"),
+        re.compile(r"\blibs/(\w+)/"),
+    )
+    ALWAYS_REQUIRED_LIBRARIES = ("config", "headers")
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path) as f:
+            data = json.load(f)
+        self.usable: bool = data["usable"]
+        self.prefixes: List[str] = data["prefixes"]
+
+    @staticmethod
+    def compute(archive: str, libraries: List[str]) -> List[str]:
+        # libs/<library>/build/Jamfile などの中身を集める
+        jamfiles: Dict[str, List[str]] = {}
+        root_jamfiles: List[str] = []
+        with open_tar(archive) as t:
+            for info in t:
+                if not info.isfile():
+                    continue
+                names = info.name.split("/")[1:]
+                basename = names[-1] if len(names) != 0 else ""
+                if not (basename.startswith("Jam") or basename.endswith(".jam")):
+                    continue
+                if len(names) == 1:
+                    root_jamfiles.append(t.extractfile(info).read().decode("utf-8", "replace"))
+                elif len(names) == 4 and names[0] == "libs" and names[2] in ("build", "config"):
+                    content = t.extractfile(info).read().decode("utf-8", "replace")
+                    jamfiles.setdefault(names[1], []).append(content)
+
+        def references(contents):
+            for content in contents:
+                for pattern in BoostClosure.REFERENCE_PATTERNS:
+                    yield from pattern.findall(content)
+
+        required = set()
+        queue = [*libraries, *BoostClosure.ALWAYS_REQUIRED_LIBRARIES, *references(root_jamfiles)]
+        while len(queue) != 0:
+            library = queue.pop()
+            if library in required:
+                continue
+            required.add(library)
+            queue.extend(references(jamfiles.get(library, [])))
+
+        return [
+            "tools/build/",
+            "tools/boost_install/",
+            "boost/",
+            *[f"libs/{library}/" for library in sorted(required)],
+        ]
+
+    @staticmethod
+    def get(archive: str, version: str, libraries: List[str]) -> "BoostClosure":
+        cache_dir = get_cache_dir()
+        dir = os.path.dirname(archive) if cache_dir is None else os.path.join(cache_dir, "boost")
+        os.makedirs(dir, exist_ok=True)
+        path = os.path.join(dir, f"closure-{version}-{'-'.join(sorted(libraries))}.json")
+        if not os.path.exists(path):
+            logging.info(f"Compute files required to build Boost {version} {libraries}")
+            prefixes = BoostClosure.compute(archive, libraries)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"usable": True, "prefixes": prefixes}, f, indent=2)
+            os.replace(tmp, path)
+        return BoostClosure(path)
+
+    # このファイル一覧ではビルドできなかったので、次からは使わないようにする
+    def mark_unusable(self):
+        self.usable = False
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"usable": False, "prefixes": self.prefixes}, f, indent=2)
+        os.replace(tmp, self.path)
+
+    # extract() の filter に指定する関数
+    def __call__(self, name: str) -> bool:
+        names = name.rstrip("/").split("/", 1)
+        if len(names) == 1:
+            return True
+        rest = names[1]
+        if "/" not in rest:
+            # ルートにあるファイル
+            return True
+        return any(
+            rest.startswith(prefix) or prefix.startswith(f"{rest}/") for prefix in self.prefixes
+        )
 
 
 @versioned
+@artifact_cached("boost")
 def build_and_install_boost(
     version: str,
     source_dir,
@@ -594,14 +3427,125 @@ def build_and_install_boost(
     architecture,
     android_ndk,
     native_api_level,
+    jobs: Optional[int] = None,
 ):
-    version_underscore = version.replace(".", "_")
-    archive = download(
-        f"https://boostorg.jfrog.io/artifactory/main/release/{version}/source/boost_{version_underscore}.tar.gz",
-        source_dir,
-    )
+    archive = download(get_boost_source_url(version), source_dir)
+    build_args = {
+        "build_dir": build_dir,
+        "install_dir": install_dir,
+        "debug": debug,
+        "cxx": cxx,
+        "cflags": cflags,
+        "cxxflags": cxxflags,
+        "linkflags": linkflags,
+        "toolset": toolset,
+        "visibility": visibility,
+        "target_os": target_os,
+        "architecture": architecture,
+        "android_ndk": android_ndk,
+        "native_api_level": native_api_level,
+        "jobs": jobs,
+    }
+
+    # 必要なファイルだけを展開してビルドしてみて、ファイルが足りずに失敗した場合だけ
+    # 全て展開してビルドし直す。コンパイルエラーなど、それ以外の失敗はそのままエラーにする。
+    closure = BoostClosure.get(archive, version, BOOST_BUILD_LIBRARIES)
+    if closure.usable:
+        extract(archive, output_dir=build_dir, output_dirname="boost", filter=closure)
+        try:
+            _build_and_install_boost(**build_args)
+            return
+        except BoostMissingSourcesError as e:
+            logging.warning(
+                f"Failed to build Boost with partially extracted sources ({e}), "
+                "retrying with all sources"
+            )
+
+        extract(archive, output_dir=build_dir, output_dirname="boost")
+        _build_and_install_boost(**build_args)
+        # 全て展開すればビルドできたので、次からはこのファイル一覧を使わない
+        closure.mark_unusable()
+        return
+
     extract(archive, output_dir=build_dir, output_dirname="boost")
-    with cd(os.path.join(build_dir, "boost")):
+    _build_and_install_boost(**build_args)
+
+
+# b2 の出力のうち、ソースの一部しか展開していないせいで失敗したことを示すもの
+BOOST_MISSING_SOURCE_PATTERNS = (
+    re.compile(r"Unable to load Jamfile"),
+    re.compile(r"Unable to find file or target named"),
+    re.compile(r"don't know how to make"),
+)
+
+
+# "No such file or directory" は、システムのヘッダーやツールが無い場合にも出力されるので、
+# 展開していないかもしれない libs/ と tools/ 以下のファイルが無い場合だけ対象にする。
+def _get_boost_missing_file_pattern(boost_dir: str):
+    prefix = re.escape(os.path.abspath(boost_dir))
+    return re.compile(
+        rf"(?:^|[\s'\"])(?:{prefix}[/\\])?(?:libs|tools)[/\\][^\s'\":]*['\"]?: "
+        r"No such file or directory"
+    )
+
+
+class BoostMissingSourcesError(Exception):
+    pass
+
+
+# カレントディレクトリの Boost のソースで b2 を実行する。
+#
+# 出力はそのまま 1 行ずつ標準出力に書き出す。
+# 失敗した場合、出力に BOOST_MISSING_SOURCE_PATTERNS などが含まれていれば
+# BoostMissingSourcesError を、そうでなければ subprocess.CalledProcessError を投げる。
+def _run_b2(args: List[str]):
+    patterns = [*BOOST_MISSING_SOURCE_PATTERNS, _get_boost_missing_file_pattern(os.getcwd())]
+    missing_source = None
+    # CalledProcessError に含める出力の末尾
+    tail: collections.deque = collections.deque(maxlen=100)
+    kwargs = {}
+    if _jobserver is not None and len(_jobserver.fds) != 0:
+        kwargs["pass_fds"] = _jobserver.fds
+    logging.debug(f"+{args}")
+    with trace_span(" ".join(args[:3]), "cmd", {"args": " ".join(args)}):
+        with subprocess.Popen(
+            [shutil.which(args[0]) or args[0], *args[1:]],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            **kwargs,
+        ) as p:
+            for raw in p.stdout:
+                sys.stdout.buffer.write(raw)
+                sys.stdout.flush()
+                line = raw.decode("utf-8", "replace")
+                tail.append(line)
+                if missing_source is None and any(pt.search(line) for pt in patterns):
+                    missing_source = line.strip()
+            returncode = p.wait()
+    if returncode == 0:
+        return
+    if missing_source is not None:
+        raise BoostMissingSourcesError(missing_source)
+    raise subprocess.CalledProcessError(returncode, args, "".join(tail))
+
+
+def _build_and_install_boost(
+    build_dir,
+    install_dir,
+    debug: bool,
+    cxx: str,
+    cflags: List[str],
+    cxxflags: List[str],
+    linkflags: List[str],
+    toolset,
+    visibility,
+    target_os,
+    architecture,
+    android_ndk,
+    native_api_level,
+    jobs: Optional[int],
+):
+    with cd(os.path.join(build_dir, "boost")), build_jobs(jobs) as b2_jobs:
         bootstrap = ".\\bootstrap.bat" if target_os == "windows" else "./bootstrap.sh"
         b2 = "b2" if target_os == "windows" else "./b2"
         runtime_link = "static" if target_os == "windows" else "shared"
@@ -618,7 +3562,7 @@ def build_and_install_boost(
                     f.write(
                         f"using clang \
                         : iphone \
-                        : {clangpp} -arch {arch} -isysroot {sysroot} \
+                        : {with_compiler_launcher(clangpp)} -arch {arch} -isysroot {sysroot} \
                           -fembed-bitcode \
                           -mios-version-min=10.0 \
                           -fvisibility=hidden \
@@ -626,15 +3570,15 @@ def build_and_install_boost(
                         ; \
                         "
                     )
-                cmd(
+                _run_b2(
                     [
                         b2,
                         "install",
+                        f"-j{b2_jobs}",
                         "-d+0",
                         f'--build-dir={os.path.join(build_dir, "boost", f"build-{arch}-{sdk}")}',
                         f'--prefix={os.path.join(build_dir, "boost", f"install-{arch}-{sdk}")}',
-                        "--with-json",
-                        "--with-filesystem",
+                        *[f"--with-{library}" for library in BOOST_BUILD_LIBRARIES],
                         "--layout=system",
                         "--ignore-site-config",
                         f'variant={"debug" if debug else "release"}',
@@ -689,7 +3633,7 @@ def build_and_install_boost(
                 f.write(
                     f"using clang \
                     : android \
-                    : {os.path.join(bin, 'clang++')} \
+                    : {with_compiler_launcher(os.path.join(bin, 'clang++'))} \
                       --target=aarch64-none-linux-android{native_api_level} \
                       --sysroot={sysroot} \
                     : <archiver>{os.path.join(bin, 'llvm-ar')} \
@@ -697,14 +3641,14 @@ def build_and_install_boost(
                     ; \
                     "
                 )
-            cmd(
+            _run_b2(
                 [
                     b2,
                     "install",
+                    f"-j{b2_jobs}",
                     "-d+0",
                     f'--prefix={os.path.join(install_dir, "boost")}',
-                    "--with-json",
-                    "--with-filesystem",
+                    *[f"--with-{library}" for library in BOOST_BUILD_LIBRARIES],
                     "--layout=system",
                     "--ignore-site-config",
                     f'variant={"debug" if debug else "release"}',
@@ -725,15 +3669,15 @@ def build_and_install_boost(
         else:
             if len(cxx) != 0:
                 with open("project-config.jam", "w") as f:
-                    f.write(f"using {toolset} : : {cxx} : ;")
-            cmd(
+                    f.write(f"using {toolset} : : {with_compiler_launcher(cxx)} : ;")
+            _run_b2(
                 [
                     b2,
                     "install",
+                    f"-j{b2_jobs}",
                     "-d+0",
                     f'--prefix={os.path.join(install_dir, "boost")}',
-                    "--with-json",
-                    "--with-filesystem",
+                    *[f"--with-{library}" for library in BOOST_BUILD_LIBRARIES],
                     "--layout=system",
                     "--ignore-site-config",
                     f'variant={"debug" if debug else "release"}',
@@ -757,12 +3701,13 @@ def install_sora(version, source_dir, install_dir, platform: str):
     win = platform.startswith("windows_")
     filename = f'sora-cpp-sdk-{version}_{platform}.{"zip" if win else "tar.gz"}'
     rm_rf(os.path.join(source_dir, filename))
-    archive = download(
+    rm_rf(os.path.join(install_dir, "sora"))
+    download_and_extract(
         f"https://github.com/shiguredo/sora-cpp-sdk/releases/download/{version}/{filename}",
-        output_dir=source_dir,
+        source_dir,
+        output_dir=install_dir,
+        output_dirname="sora",
     )
-    rm_rf(os.path.join(install_dir, "sora"))
-    extract(archive, output_dir=install_dir, output_dirname="sora")
 
 
 def install_sora_and_deps(platform: str, source_dir: str, install_dir: str):
@@ -823,7 +3768,7 @@ def get_sora_info(
 @versioned
 def install_rootfs(version, install_dir, conf):
     rootfs_dir = os.path.join(install_dir, "rootfs")
-    rm_rf(rootfs_dir)
+    rm_rf(rootfs_dir, background=True)
     cmd(["multistrap", "--no-auth", "-a", "arm64", "-d", rootfs_dir, "-f", conf])
     # 絶対パスのシンボリックリンクを相対パスに置き換えていく
     for dir, _, filenames in os.walk(rootfs_dir):
@@ -857,21 +3802,24 @@ def install_rootfs(version, install_dir, conf):
         os.symlink(os.path.basename(file), link)
 
 
+def get_android_ndk_url(version) -> str:
+    return f"https://dl.google.com/android/repository/android-ndk-{version}-linux.zip"
+
+
 @versioned
 def install_android_ndk(version, install_dir, source_dir):
-    archive = download(
-        f"https://dl.google.com/android/repository/android-ndk-{version}-linux.zip", source_dir
-    )
-    rm_rf(os.path.join(install_dir, "android-ndk"))
+    archive = download(get_android_ndk_url(version), source_dir)
+    rm_rf(os.path.join(install_dir, "android-ndk"), background=True)
     extract(archive, output_dir=install_dir, output_dirname="android-ndk")
 
 
+def get_android_sdk_cmdline_tools_url(version) -> str:
+    return f"https://dl.google.com/android/repository/commandlinetools-linux-{version}_latest.zip"
+
+
 @versioned
 def install_android_sdk_cmdline_tools(version, install_dir, source_dir):
-    archive = download(
-        f"https://dl.google.com/android/repository/commandlinetools-linux-{version}_latest.zip",
-        source_dir,
-    )
+    archive = download(get_android_sdk_cmdline_tools_url(version), source_dir)
     tools_dir = os.path.join(install_dir, "android-sdk-cmdline-tools")
     rm_rf(tools_dir)
     extract(archive, output_dir=tools_dir, output_dirname="cmdline-tools")
@@ -892,7 +3840,7 @@ def install_llvm(
     buildtools_commit,
 ):
     llvm_dir = os.path.join(install_dir, "llvm")
-    rm_rf(llvm_dir)
+    rm_rf(llvm_dir, background=True)
     mkdir_p(llvm_dir)
     with cd(llvm_dir):
         # tools の update.py を叩いて特定バージョンの clang バイナリを拾う
@@ -934,10 +3882,13 @@ def cmake_path(path: str) -> str:
     return path.replace("\\", "/")
 
 
+def get_cmake_url(version, platform: str, ext) -> str:
+    return f"https://github.com/Kitware/CMake/releases/download/v{version}/cmake-{version}-{platform}.{ext}"
+
+
 @versioned
 def install_cmake(version, source_dir, install_dir, platform: str, ext):
-    url = f"https://github.com/Kitware/CMake/releases/download/v{version}/cmake-{version}-{platform}.{ext}"
-    path = download(url, source_dir)
+    path = download(get_cmake_url(version, platform, ext), source_dir)
     extract(path, install_dir, "cmake")
     # Android で自前の CMake を利用する場合、ninja へのパスが見つけられない問題があるので、同じディレクトリに symlink を貼る
     # https://issuetracker.google.com/issues/206099937
@@ -1047,10 +3998,10 @@ def install_sdl2(
                 "-DSDL_METAL=OFF",
                 "-DSDL_KMSDRM=OFF",
             ]
-        cmd(["cmake"] + cmake_args)
+        cmd(["cmake"] + cmake_args + get_compiler_launcher_args())
 
         cmd(
-            ["cmake", "--build", ".", "--config", configuration, f"-j{multiprocessing.cpu_count()}"]
+            ["cmake", "--build", ".", "--config", configuration, *get_build_jobs_args()]
         )
         cmd(["cmake", "--install", ".", "--config", configuration])
 
@@ -1097,7 +4048,11 @@ def install_cuda_windows(version, source_dir, build_dir, install_dir):
     )
 
 
+VPL_REPOSITORY_URL = "https://github.com/intel/libvpl.git"
+
+
 @versioned
+@artifact_cached("vpl")
 def install_vpl(version, configuration, source_dir, build_dir, install_dir, cmake_args):
     vpl_source_dir = os.path.join(source_dir, "vpl")
     vpl_build_dir = os.path.join(build_dir, "vpl")
@@ -1105,7 +4060,7 @@ def install_vpl(version, configuration, source_dir, build_dir, install_dir, cmak
     rm_rf(vpl_source_dir)
     rm_rf(vpl_build_dir)
     rm_rf(vpl_install_dir)
-    git_clone_shallow("https://github.com/intel/libvpl.git", version, vpl_source_dir)
+    git_clone_shallow(VPL_REPOSITORY_URL, version, vpl_source_dir)
 
     mkdir_p(vpl_build_dir)
     with cd(vpl_build_dir):
@@ -1123,6 +4078,7 @@ def install_vpl(version, configuration, source_dir, build_dir, install_dir, cmak
                 "-DUSE_MSVC_STATIC_RUNTIME=ON",
                 vpl_source_dir,
                 *cmake_args,
+                *get_compiler_launcher_args(),
             ]
         )
         # 生成されたプロジェクトに対して静的ランタイムを使うように変更する
@@ -1131,12 +4087,17 @@ def install_vpl(version, configuration, source_dir, build_dir, install_dir, cmak
             replace_vcproj_static_runtime(vpl_path)
 
         cmd(
-            ["cmake", "--build", ".", f"-j{multiprocessing.cpu_count()}", "--config", configuration]
+            ["cmake", "--build", ".", *get_build_jobs_args(), "--config", configuration]
         )
         cmd(["cmake", "--install", ".", "--config", configuration])
 
 
+BLEND2D_REPOSITORY_URL = "https://github.com/blend2d/blend2d"
+ASMJIT_REPOSITORY_URL = "https://github.com/asmjit/asmjit"
+
+
 @versioned
+@artifact_cached("blend2d")
 def install_blend2d(
     version,
     configuration,
@@ -1152,12 +4113,10 @@ def install_blend2d(
     rm_rf(os.path.join(build_dir, "blend2d"))
     rm_rf(os.path.join(install_dir, "blend2d"))
 
-    git_clone_shallow(
-        "https://github.com/blend2d/blend2d", blend2d_version, os.path.join(source_dir, "blend2d")
-    )
+    git_clone_shallow(BLEND2D_REPOSITORY_URL, blend2d_version, os.path.join(source_dir, "blend2d"))
     mkdir_p(os.path.join(source_dir, "blend2d", "3rdparty"))
     git_clone_shallow(
-        "https://github.com/asmjit/asmjit",
+        ASMJIT_REPOSITORY_URL,
         asmjit_version,
         os.path.join(source_dir, "blend2d", "3rdparty", "asmjit"),
     )
@@ -1172,6 +4131,7 @@ def install_blend2d(
                 f"-DCMAKE_INSTALL_PREFIX={cmake_path(os.path.join(install_dir, 'blend2d'))}",
                 "-DBLEND2D_STATIC=ON",
                 *cmake_args,
+                *get_compiler_launcher_args(),
             ]
         )
         # 生成されたプロジェクトに対して静的ランタイムを使うように変更する
@@ -1185,7 +4145,7 @@ def install_blend2d(
                     "cmake",
                     "--build",
                     ".",
-                    f"-j{multiprocessing.cpu_count()}",
+                    f"-j{get_build_jobs()}",
                     "--config",
                     configuration,
                     "--target",
@@ -1204,7 +4164,7 @@ def install_blend2d(
                     "cmake",
                     "--build",
                     ".",
-                    f"-j{multiprocessing.cpu_count()}",
+                    *get_build_jobs_args(),
                     "--config",
                     configuration,
                 ]
@@ -1212,13 +4172,14 @@ def install_blend2d(
             cmd(["cmake", "--build", ".", "--target", "install", "--config", configuration])
 
 
+OPENH264_REPOSITORY_URL = "https://github.com/cisco/openh264.git"
+
+
 @versioned
 def install_openh264(version, source_dir, install_dir, is_windows):
     rm_rf(os.path.join(source_dir, "openh264"))
     rm_rf(os.path.join(install_dir, "openh264"))
-    git_clone_shallow(
-        "https://github.com/cisco/openh264.git", version, os.path.join(source_dir, "openh264")
-    )
+    git_clone_shallow(OPENH264_REPOSITORY_URL, version, os.path.join(source_dir, "openh264"))
     with cd(os.path.join(source_dir, "openh264")):
         if is_windows:
             # Windows は make が無いので手動でコピーする
@@ -1255,20 +4216,23 @@ def install_yaml(version, source_dir, build_dir, install_dir, cmake_args):
                 "-DYAML_CPP_BUILD_TESTS=OFF",
                 "-DYAML_CPP_BUILD_TOOLS=OFF",
                 *cmake_args,
+                *get_compiler_launcher_args(),
             ]
         )
-        cmd(["cmake", "--build", ".", f"-j{multiprocessing.cpu_count()}"])
+        cmd(["cmake", "--build", ".", *get_build_jobs_args()])
         cmd(["cmake", "--build", ".", "--target", "install"])
 
 
+CATCH2_REPOSITORY_URL = "https://github.com/catchorg/Catch2.git"
+
+
 @versioned
+@artifact_cached("catch2")
 def install_catch2(version, source_dir, build_dir, install_dir, configuration, cmake_args):
     rm_rf(os.path.join(source_dir, "catch2"))
     rm_rf(os.path.join(install_dir, "catch2"))
     rm_rf(os.path.join(build_dir, "catch2"))
-    git_clone_shallow(
-        "https://github.com/catchorg/Catch2.git", version, os.path.join(source_dir, "catch2")
-    )
+    git_clone_shallow(CATCH2_REPOSITORY_URL, version, os.path.join(source_dir, "catch2"))
 
     mkdir_p(os.path.join(build_dir, "catch2"))
     with cd(os.path.join(build_dir, "catch2")):
@@ -1280,6 +4244,7 @@ def install_catch2(version, source_dir, build_dir, install_dir, configuration, c
                 f"-DCMAKE_INSTALL_PREFIX={install_dir}/catch2",
                 "-DCATCH_BUILD_TESTING=OFF",
                 *cmake_args,
+                *get_compiler_launcher_args(),
             ]
         )
         # 生成されたプロジェクトに対して静的ランタイムを使うように変更する
@@ -1290,7 +4255,7 @@ def install_catch2(version, source_dir, build_dir, install_dir, configuration, c
         if os.path.exists(project_path):
             replace_vcproj_static_runtime(project_path)
         cmd(
-            ["cmake", "--build", ".", "--config", configuration, f"-j{multiprocessing.cpu_count()}"]
+            ["cmake", "--build", ".", "--config", configuration, *get_build_jobs_args()]
         )
         cmd(["cmake", "--build", ".", "--config", configuration, "--target", "install"])
 
@@ -1332,9 +4297,10 @@ def install_protoc_gen_jsonif(version, source_dir, install_dir, platform: str):
     rm_rf(jsonif_install_dir)
     extract(path, install_dir, "protoc-gen-jsonif")
     # 自分の環境のバイナリを <install-path>/bin に配置する
-    shutil.copytree(
+    copytree(
         os.path.join(jsonif_install_dir, *platform.split("-")),
         os.path.join(jsonif_install_dir, "bin"),
+        include_hidden=True,
     )
     # なぜか実行属性が消えてるので入れてやる
     for file in os.scandir(os.path.join(jsonif_install_dir, "bin")):
@@ -1568,3 +4534,38 @@ def add_webrtc_build_arguments(parser):
         default=[],
         help="Options for building local webrtc-build when `--webrtc-build-dir` is specified.",
     )
+
+
+# "10G" や "500M" のようなサイズ指定をバイト数に変換する
+def parse_size(size: str) -> int:
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    size = size.strip().upper().rstrip("B")
+    if size[-1:] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    sp = parser.add_subparsers(dest="command", required=True)
+    gc = sp.add_parser(
+        "download-store-gc",
+        help="Evict least recently used files from the download store "
+        "until it fits in the given size.",
+    )
+    gc.add_argument("--max-size", type=parse_size, required=True, help="e.g. 10G, 500M")
+    args = parser.parse_args()
+
+    if args.command == "download-store-gc":
+        store = get_download_store()
+        if store is None:
+            logging.info("Download store is disabled")
+            return
+        store.evict(args.max_size)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,5 +1,4 @@
 import argparse
-import multiprocessing
 import os
 import sys
 from typing import List, Optional
@@ -11,15 +10,18 @@ sys.path.insert(0, BUILDBASE_DIR)
 
 
 from buildbase import (  # noqa: E402
+    COMPILER_CACHES,
     add_path,
     add_sora_arguments,
     add_webrtc_build_arguments,
     build_sora,
     build_webrtc,
     cd,
+    cmake_configure,
     cmake_path,
     cmd,
     cmdcap,
+    get_build_jobs_args,
     get_sora_info,
     get_webrtc_info,
     install_cli11,
@@ -28,6 +30,10 @@ from buildbase import (  # noqa: E402
     install_webrtc,
     mkdir_p,
     read_version_file,
+    start_compiler_cache,
+    start_jobserver,
+    start_trace,
+    trace_span,
 )
 
 
@@ -93,6 +99,8 @@ def install_deps(
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--trace", action="store_true")
+    parser.add_argument("--compiler-cache", choices=COMPILER_CACHES, default="none")
     add_webrtc_build_arguments(parser)
     add_sora_arguments(parser)
 
@@ -107,6 +115,12 @@ def main():
     mkdir_p(build_dir)
     mkdir_p(install_dir)
 
+    if args.trace:
+        start_trace(os.path.join(BASE_DIR, "_build", platform, "trace.json"))
+
+    start_jobserver()
+    start_compiler_cache(args.compiler_cache, platform)
+
     install_deps(
         source_dir,
         build_dir,
@@ -147,10 +161,14 @@ def main():
             f"-DCMAKE_SYSROOT={sysroot}",
         ]
 
-        cmd(["cmake", os.path.join(PROJECT_DIR)] + cmake_args)
-        cmd(
-            ["cmake", "--build", ".", f"-j{multiprocessing.cpu_count()}", "--config", configuration]
-        )
+        with trace_span("messaging_recvonly_sample configure", "cmake"):
+            cmake_configure(
+                PROJECT_DIR,
+                cmake_args,
+                [os.path.join(sora_info.sora_install_dir, "share", "cmake")],
+            )
+        with trace_span("messaging_recvonly_sample build", "cmake"):
+            cmd(["cmake", "--build", ".", *get_build_jobs_args(), "--config", configuration])
 
 
 if __name__ == "__main__":
@@ -1,14 +1,24 @@
 import argparse
+import concurrent.futures
+import glob
 import hashlib
+import json
 import logging
-import multiprocessing
 import os
 import shutil
-import tarfile
-import zipfile
-from typing import Dict, List, Optional
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
 
 from buildbase import (
+    ASMJIT_REPOSITORY_URL,
+    BLEND2D_REPOSITORY_URL,
+    CATCH2_REPOSITORY_URL,
+    COMPILER_CACHES,
+    OPENH264_REPOSITORY_URL,
+    VPL_REPOSITORY_URL,
+    BuildStep,
     Platform,
     WebrtcInfo,
     add_path,
@@ -16,14 +26,30 @@ from buildbase import (
     build_and_install_boost,
     build_webrtc,
     cd,
+    cmake_configure,
     cmake_path,
     cmd,
     cmdcap,
+    create_reproducible_archive,
     enum_all_files,
+    find_unity_build_conflicts,
+    get_android_ndk_url,
+    get_android_sdk_cmdline_tools_url,
+    get_boost_source_url,
+    get_build_jobs,
+    get_build_jobs_args,
+    get_build_resources,
+    get_cmake_generator,
+    get_cmake_job_pool_args,
+    get_cmake_url,
+    get_git_head,
     get_macos_osver,
+    get_source_date_epoch,
     get_webrtc_info,
     get_webrtc_platform,
+    get_webrtc_url,
     get_windows_osver,
+    hash_file_stats,
     install_android_ndk,
     install_android_sdk_cmdline_tools,
     install_blend2d,
@@ -35,9 +61,21 @@ from buildbase import (
     install_rootfs,
     install_vpl,
     install_webrtc,
+    is_streamable_download,
+    is_version_installed,
     mkdir_p,
+    prefetch,
     read_version_file,
+    remove_stale_trash,
+    report_ninja_build,
+    report_time_trace,
     rm_rf,
+    run_build_steps,
+    start_compiler_cache,
+    start_jobserver,
+    start_trace,
+    trace_span,
+    wait_background_deletions,
 )
 
 logging.basicConfig(level=logging.DEBUG)
@@ -140,6 +178,117 @@ def get_common_cmake_args(
     return args
 
 
+# ビルドプラットフォーム向けの CMake のバイナリの (platform, ext) を返す
+def get_cmake_platform(platform: Platform):
+    if platform.build.os == "windows" and platform.build.arch == "x86_64":
+        return "windows-x86_64", "zip"
+    elif platform.build.os == "macos":
+        return "macos-universal", "tar.gz"
+    elif platform.build.os == "ubuntu" and platform.build.arch == "x86_64":
+        return "linux-x86_64", "tar.gz"
+    elif platform.build.os == "ubuntu" and platform.build.arch == "arm64":
+        return "linux-aarch64", "tar.gz"
+    else:
+        raise Exception("Failed to install CMake")
+
+
+# install_deps で必要になるアーカイブの URL と git リポジトリ（URL とコミット）のリスト。
+#
+# インストール済みのもの（version_file のバージョンが一致しているもの）は含めない。
+# LLVM は WebRTC のアーカイブに含まれる VERSIONS を見ないと取得するコミットが分からないので対象外。
+#
+# streamable=False の場合、WebRTC のアーカイブが
+# download_and_extract() でダウンロードしながら展開できるものなら含めない。
+def get_prefetch_deps(
+    platform: Platform,
+    version: Dict[str, str],
+    install_dir: str,
+    webrtc_build_dir: Optional[str],
+    streamable: bool = True,
+) -> Tuple[List[str], List[Tuple[str, str]]]:
+    urls = []
+    repositories = []
+
+    if platform.target.os == "android":
+        if not is_version_installed(
+            version["ANDROID_NDK_VERSION"], os.path.join(install_dir, "android-ndk.version")
+        ):
+            urls.append(get_android_ndk_url(version["ANDROID_NDK_VERSION"]))
+        if "ANDROID_SDK_ROOT" not in os.environ or not os.path.exists(
+            os.environ["ANDROID_SDK_ROOT"]
+        ):
+            if not is_version_installed(
+                version["ANDROID_SDK_CMDLINE_TOOLS_VERSION"],
+                os.path.join(install_dir, "android-sdk-cmdline-tools.version"),
+            ):
+                urls.append(
+                    get_android_sdk_cmdline_tools_url(version["ANDROID_SDK_CMDLINE_TOOLS_VERSION"])
+                )
+
+    if webrtc_build_dir is None:
+        if not is_version_installed(
+            version["WEBRTC_BUILD_VERSION"], os.path.join(install_dir, "webrtc.version")
+        ):
+            url = get_webrtc_url(version["WEBRTC_BUILD_VERSION"], get_webrtc_platform(platform))
+            if streamable or not is_streamable_download(url):
+                urls.append(url)
+
+    if not is_version_installed(
+        version["BOOST_VERSION"], os.path.join(install_dir, "boost.version")
+    ):
+        urls.append(get_boost_source_url(version["BOOST_VERSION"]))
+
+    if not is_version_installed(
+        version["CMAKE_VERSION"], os.path.join(install_dir, "cmake.version")
+    ):
+        cmake_platform, cmake_ext = get_cmake_platform(platform)
+        urls.append(get_cmake_url(version["CMAKE_VERSION"], cmake_platform, cmake_ext))
+
+    if platform.target.os in ("windows", "ubuntu") and platform.target.arch == "x86_64":
+        if not is_version_installed(
+            version["VPL_VERSION"], os.path.join(install_dir, "vpl.version")
+        ):
+            repositories.append((VPL_REPOSITORY_URL, version["VPL_VERSION"]))
+
+    if not is_version_installed(
+        version["OPENH264_VERSION"], os.path.join(install_dir, "openh264.version")
+    ):
+        repositories.append((OPENH264_REPOSITORY_URL, version["OPENH264_VERSION"]))
+
+    if not is_version_installed(
+        version["BLEND2D_VERSION"] + "-" + version["ASMJIT_VERSION"],
+        os.path.join(install_dir, "blend2d.version"),
+    ):
+        repositories.append((BLEND2D_REPOSITORY_URL, version["BLEND2D_VERSION"]))
+        repositories.append((ASMJIT_REPOSITORY_URL, version["ASMJIT_VERSION"]))
+
+    if platform.build.os == platform.target.os and platform.build.arch == platform.target.arch:
+        if not is_version_installed(
+            version["CATCH2_VERSION"], os.path.join(install_dir, "catch2.version")
+        ):
+            repositories.append((CATCH2_REPOSITORY_URL, version["CATCH2_VERSION"]))
+
+    return urls, repositories
+
+
+# install_deps で必要になるアーカイブと git リポジトリを、ビルドを始める前にまとめて並列に取得しておく。
+#
+# 事前に取得するとダウンロードしながら展開できなくなるので、
+# download_and_extract() で取得する WebRTC のアーカイブは除く。
+def prefetch_deps(
+    platform: Platform,
+    version: Dict[str, str],
+    source_dir: str,
+    install_dir: str,
+    webrtc_build_dir: Optional[str],
+    jobs: int,
+):
+    urls, repositories = get_prefetch_deps(
+        platform, version, install_dir, webrtc_build_dir, streamable=False
+    )
+    prefetch(urls, repositories, os.path.join(source_dir, "_prefetch"), jobs)
+
+
 def install_deps(
     platform: Platform,
     source_dir: str,
@@ -148,32 +297,54 @@ def install_deps(
     debug: bool,
     webrtc_build_dir: Optional[str],
     webrtc_build_args: List[str],
+    prefetch_jobs: int,
+    parallel: bool,
 ):
     with cd(BASE_DIR):
         version = read_version_file("VERSION")
 
+        if prefetch_jobs > 0:
+            prefetch_deps(
+                platform, version, source_dir, install_dir, webrtc_build_dir, prefetch_jobs
+            )
+
+        webrtc_platform = get_webrtc_platform(platform)
+        webrtc_info = get_webrtc_info(webrtc_platform, webrtc_build_dir, install_dir, debug)
+
+        # 各依存ライブラリのインストールを、依存関係を宣言したビルドステップとして登録して、
+        # 依存関係を満たしたものから並列に実行する
+        steps: List[BuildStep] = []
+
         # multistrap を使った sysroot の構築
         if platform.target.os == "jetson":
-            conf = os.path.join(BASE_DIR, "multistrap", f"{platform.target.package_name}.conf")
-            # conf ファイルのハッシュ値をバージョンとする
-            version_md5 = hashlib.md5(open(conf, "rb").read()).hexdigest()
-            install_rootfs_args = {
-                "version": version_md5,
-                "version_file": os.path.join(install_dir, "rootfs.version"),
-                "install_dir": install_dir,
-                "conf": conf,
-            }
-            install_rootfs(**install_rootfs_args)
+
+            def rootfs():
+                conf = os.path.join(BASE_DIR, "multistrap", f"{platform.target.package_name}.conf")
+                # conf ファイルのハッシュ値をバージョンとする
+                version_md5 = hashlib.md5(open(conf, "rb").read()).hexdigest()
+                install_rootfs_args = {
+                    "version": version_md5,
+                    "version_file": os.path.join(install_dir, "rootfs.version"),
+                    "install_dir": install_dir,
+                    "conf": conf,
+                }
+                install_rootfs(**install_rootfs_args)
+
+            steps.append(BuildStep("rootfs", rootfs))
 
         # Android NDK
         if platform.target.os == "android":
-            install_android_ndk_args = {
-                "version": version["ANDROID_NDK_VERSION"],
-                "version_file": os.path.join(install_dir, "android-ndk.version"),
-                "source_dir": source_dir,
-                "install_dir": install_dir,
-            }
-            install_android_ndk(**install_android_ndk_args)
+
+            def android_ndk():
+                install_android_ndk_args = {
+                    "version": version["ANDROID_NDK_VERSION"],
+                    "version_file": os.path.join(install_dir, "android-ndk.version"),
+                    "source_dir": source_dir,
+                    "install_dir": install_dir,
+                }
+                install_android_ndk(**install_android_ndk_args)
+
+            steps.append(BuildStep("android-ndk", android_ndk))
 
         # Android SDK Commandline Tools
         if platform.target.os == "android":
@@ -181,347 +352,521 @@ def install_deps(
                 # 既に Android SDK が設定されている場合はインストールしない
                 pass
             else:
-                install_android_sdk_cmdline_tools_args = {
-                    "version": version["ANDROID_SDK_CMDLINE_TOOLS_VERSION"],
-                    "version_file": os.path.join(install_dir, "android-sdk-cmdline-tools.version"),
-                    "source_dir": source_dir,
-                    "install_dir": install_dir,
-                }
-                install_android_sdk_cmdline_tools(**install_android_sdk_cmdline_tools_args)
-                add_path(
-                    os.path.join(install_dir, "android-sdk-cmdline-tools", "cmdline-tools", "bin")
-                )
-                os.environ["ANDROID_SDK_ROOT"] = os.path.join(
-                    install_dir, "android-sdk-cmdline-tools"
+
+                def android_sdk_cmdline_tools():
+                    install_android_sdk_cmdline_tools_args = {
+                        "version": version["ANDROID_SDK_CMDLINE_TOOLS_VERSION"],
+                        "version_file": os.path.join(
+                            install_dir, "android-sdk-cmdline-tools.version"
+                        ),
+                        "source_dir": source_dir,
+                        "install_dir": install_dir,
+                    }
+                    install_android_sdk_cmdline_tools(**install_android_sdk_cmdline_tools_args)
+
+                def setup_android_sdk_cmdline_tools():
+                    add_path(
+                        os.path.join(
+                            install_dir, "android-sdk-cmdline-tools", "cmdline-tools", "bin"
+                        )
+                    )
+                    os.environ["ANDROID_SDK_ROOT"] = os.path.join(
+                        install_dir, "android-sdk-cmdline-tools"
+                    )
+
+                steps.append(
+                    BuildStep(
+                        "android-sdk-cmdline-tools",
+                        android_sdk_cmdline_tools,
+                        on_complete=setup_android_sdk_cmdline_tools,
+                    )
                 )
 
         # WebRTC
-        webrtc_platform = get_webrtc_platform(platform)
-
-        if webrtc_build_dir is None:
-            install_webrtc_args = {
-                "version": version["WEBRTC_BUILD_VERSION"],
-                "version_file": os.path.join(install_dir, "webrtc.version"),
-                "source_dir": source_dir,
-                "install_dir": install_dir,
-                "platform": webrtc_platform,
-            }
+        def webrtc():
+            if webrtc_build_dir is None:
+                install_webrtc_args = {
+                    "version": version["WEBRTC_BUILD_VERSION"],
+                    "version_file": os.path.join(install_dir, "webrtc.version"),
+                    "source_dir": source_dir,
+                    "install_dir": install_dir,
+                    "platform": webrtc_platform,
+                }
 
-            install_webrtc(**install_webrtc_args)
-        else:
-            build_webrtc_args = {
-                "platform": webrtc_platform,
-                "webrtc_build_dir": webrtc_build_dir,
-                "webrtc_build_args": webrtc_build_args,
-                "debug": debug,
-            }
+                install_webrtc(**install_webrtc_args)
+            else:
+                build_webrtc_args = {
+                    "platform": webrtc_platform,
+                    "webrtc_build_dir": webrtc_build_dir,
+                    "webrtc_build_args": webrtc_build_args,
+                    "debug": debug,
+                }
 
-            build_webrtc(**build_webrtc_args)
+                build_webrtc(**build_webrtc_args)
 
-        webrtc_info = get_webrtc_info(webrtc_platform, webrtc_build_dir, install_dir, debug)
-        webrtc_version = read_version_file(webrtc_info.version_file)
-        webrtc_deps = read_version_file(webrtc_info.deps_file)
+        steps.append(BuildStep("webrtc", webrtc, build=webrtc_build_dir is not None))
 
         # Windows は MSVC を使うので不要
         # macOS と iOS は Apple Clang を使うので不要
         if platform.target.os not in ("windows", "macos", "ios") and webrtc_build_dir is None:
-            # LLVM
-            tools_url = webrtc_version["WEBRTC_SRC_TOOLS_URL"]
-            tools_commit = webrtc_version["WEBRTC_SRC_TOOLS_COMMIT"]
-            libcxx_url = webrtc_version["WEBRTC_SRC_THIRD_PARTY_LIBCXX_SRC_URL"]
-            libcxx_commit = webrtc_version["WEBRTC_SRC_THIRD_PARTY_LIBCXX_SRC_COMMIT"]
-            buildtools_url = webrtc_version["WEBRTC_SRC_BUILDTOOLS_URL"]
-            buildtools_commit = webrtc_version["WEBRTC_SRC_BUILDTOOLS_COMMIT"]
-            install_llvm_args = {
-                "version": f"{tools_url}.{tools_commit}."
-                f"{libcxx_url}.{libcxx_commit}."
-                f"{buildtools_url}.{buildtools_commit}",
-                "version_file": os.path.join(install_dir, "llvm.version"),
-                "install_dir": install_dir,
-                "tools_url": tools_url,
-                "tools_commit": tools_commit,
-                "libcxx_url": libcxx_url,
-                "libcxx_commit": libcxx_commit,
-                "buildtools_url": buildtools_url,
-                "buildtools_commit": buildtools_commit,
-            }
-            install_llvm(**install_llvm_args)
-
-        # Boost
-        install_boost_args = {
-            "version": version["BOOST_VERSION"],
-            "version_file": os.path.join(install_dir, "boost.version"),
-            "source_dir": source_dir,
-            "build_dir": build_dir,
-            "install_dir": install_dir,
-            "cxx": "",
-            "cflags": [],
-            "cxxflags": [],
-            "linkflags": [],
-            "toolset": "",
-            "visibility": "global",
-            "target_os": "",
-            "debug": debug,
-            "android_ndk": "",
-            "native_api_level": "",
-            "architecture": "x86",
-        }
-        if platform.target.os == "windows":
-            install_boost_args["cxxflags"] = ["-D_ITERATOR_DEBUG_LEVEL=0"]
-            install_boost_args["toolset"] = "msvc"
-            install_boost_args["target_os"] = "windows"
-        elif platform.target.os == "macos":
-            sysroot = cmdcap(["xcrun", "--sdk", "macosx", "--show-sdk-path"])
-            install_boost_args["target_os"] = "darwin"
-            install_boost_args["toolset"] = "clang"
-            install_boost_args["cxx"] = "clang++"
-            install_boost_args["cflags"] = [
-                f"--sysroot={sysroot}",
-                f"-mmacosx-version-min={webrtc_deps['MACOS_DEPLOYMENT_TARGET']}",
-            ]
-            install_boost_args["cxxflags"] = [
-                "-fPIC",
-                f"--sysroot={sysroot}",
-                "-std=gnu++17",
-                f"-mmacosx-version-min={webrtc_deps['MACOS_DEPLOYMENT_TARGET']}",
-            ]
-            install_boost_args["visibility"] = "hidden"
-            if platform.target.arch == "x86_64":
-                install_boost_args["cflags"].extend(["-target", "x86_64-apple-darwin"])
-                install_boost_args["cxxflags"].extend(["-target", "x86_64-apple-darwin"])
-                install_boost_args["architecture"] = "x86"
-            if platform.target.arch == "arm64":
-                install_boost_args["cflags"].extend(["-target", "aarch64-apple-darwin"])
-                install_boost_args["cxxflags"].extend(["-target", "aarch64-apple-darwin"])
-                install_boost_args["architecture"] = "arm"
-        elif platform.target.os == "ios":
-            install_boost_args["target_os"] = "iphone"
-            install_boost_args["toolset"] = "clang"
-            install_boost_args["cflags"] = [
-                f"-miphoneos-version-min={webrtc_deps['IOS_DEPLOYMENT_TARGET']}",
-            ]
-            install_boost_args["cxxflags"] = [
-                "-std=gnu++17",
-                f"-miphoneos-version-min={webrtc_deps['IOS_DEPLOYMENT_TARGET']}",
-            ]
-            install_boost_args["visibility"] = "hidden"
-        elif platform.target.os == "android":
-            install_boost_args["target_os"] = "android"
-            install_boost_args["cflags"] = [
-                "-fPIC",
-            ]
-            install_boost_args["cxxflags"] = [
-                "-fPIC",
-                "-D_LIBCPP_ABI_NAMESPACE=Cr",
-                "-D_LIBCPP_ABI_VERSION=2",
-                "-D_LIBCPP_DISABLE_AVAILABILITY",
-                "-D_LIBCPP_HARDENING_MODE=_LIBCPP_HARDENING_MODE_EXTENSIVE",
-                "-nostdinc++",
-                "-std=gnu++17",
-                f"-isystem{os.path.join(webrtc_info.libcxx_dir, 'include')}",
-                "-fexperimental-relative-c++-abi-vtables",
-            ]
-            install_boost_args["toolset"] = "clang"
-            install_boost_args["android_ndk"] = os.path.join(install_dir, "android-ndk")
-            install_boost_args["native_api_level"] = version["ANDROID_NATIVE_API_LEVEL"]
-        elif platform.target.os == "jetson":
-            sysroot = os.path.join(install_dir, "rootfs")
-            install_boost_args["target_os"] = "linux"
-            install_boost_args["cxx"] = os.path.join(webrtc_info.clang_dir, "bin", "clang++")
-            install_boost_args["cflags"] = [
-                "-fPIC",
-                f"--sysroot={sysroot}",
-                "--target=aarch64-linux-gnu",
-                f"-I{os.path.join(sysroot, 'usr', 'include', 'aarch64-linux-gnu')}",
-            ]
-            install_boost_args["cxxflags"] = [
-                "-fPIC",
-                "--target=aarch64-linux-gnu",
-                f"--sysroot={sysroot}",
-                f"-I{os.path.join(sysroot, 'usr', 'include', 'aarch64-linux-gnu')}",
-                "-D_LIBCPP_ABI_NAMESPACE=Cr",
-                "-D_LIBCPP_ABI_VERSION=2",
-                "-D_LIBCPP_DISABLE_AVAILABILITY",
-                "-D_LIBCPP_HARDENING_MODE=_LIBCPP_HARDENING_MODE_EXTENSIVE",
-                "-nostdinc++",
-                "-std=gnu++17",
-                f"-isystem{os.path.join(webrtc_info.libcxx_dir, 'include')}",
-            ]
-            install_boost_args["linkflags"] = [
-                f"-L{os.path.join(sysroot, 'usr', 'lib', 'aarch64-linux-gnu')}",
-                f"-B{os.path.join(sysroot, 'usr', 'lib', 'aarch64-linux-gnu')}",
-            ]
-            install_boost_args["toolset"] = "clang"
-            install_boost_args["architecture"] = "arm"
-        else:
-            install_boost_args["target_os"] = "linux"
-            install_boost_args["cxx"] = os.path.join(webrtc_info.clang_dir, "bin", "clang++")
-            install_boost_args["cxxflags"] = [
-                "-D_LIBCPP_ABI_NAMESPACE=Cr",
-                "-D_LIBCPP_ABI_VERSION=2",
-                "-D_LIBCPP_DISABLE_AVAILABILITY",
-                "-D_LIBCPP_HARDENING_MODE=_LIBCPP_HARDENING_MODE_EXTENSIVE",
-                "-nostdinc++",
-                f"-isystem{os.path.join(webrtc_info.libcxx_dir, 'include')}",
-                "-fPIC",
-            ]
-            install_boost_args["toolset"] = "clang"
-
-        build_and_install_boost(**install_boost_args)
 
-        # CMake
-        install_cmake_args = {
-            "version": version["CMAKE_VERSION"],
-            "version_file": os.path.join(install_dir, "cmake.version"),
-            "source_dir": source_dir,
-            "install_dir": install_dir,
-            "platform": "",
-            "ext": "tar.gz",
-        }
-        if platform.build.os == "windows" and platform.build.arch == "x86_64":
-            install_cmake_args["platform"] = "windows-x86_64"
-            install_cmake_args["ext"] = "zip"
-        elif platform.build.os == "macos":
-            install_cmake_args["platform"] = "macos-universal"
-        elif platform.build.os == "ubuntu" and platform.build.arch == "x86_64":
-            install_cmake_args["platform"] = "linux-x86_64"
-        elif platform.build.os == "ubuntu" and platform.build.arch == "arm64":
-            install_cmake_args["platform"] = "linux-aarch64"
-        else:
-            raise Exception("Failed to install CMake")
-        install_cmake(**install_cmake_args)
+            def llvm():
+                webrtc_version = read_version_file(webrtc_info.version_file)
+                tools_url = webrtc_version["WEBRTC_SRC_TOOLS_URL"]
+                tools_commit = webrtc_version["WEBRTC_SRC_TOOLS_COMMIT"]
+                libcxx_url = webrtc_version["WEBRTC_SRC_THIRD_PARTY_LIBCXX_SRC_URL"]
+                libcxx_commit = webrtc_version["WEBRTC_SRC_THIRD_PARTY_LIBCXX_SRC_COMMIT"]
+                buildtools_url = webrtc_version["WEBRTC_SRC_BUILDTOOLS_URL"]
+                buildtools_commit = webrtc_version["WEBRTC_SRC_BUILDTOOLS_COMMIT"]
+                install_llvm_args = {
+                    "version": f"{tools_url}.{tools_commit}."
+                    f"{libcxx_url}.{libcxx_commit}."
+                    f"{buildtools_url}.{buildtools_commit}",
+                    "version_file": os.path.join(install_dir, "llvm.version"),
+                    "install_dir": install_dir,
+                    "tools_url": tools_url,
+                    "tools_commit": tools_commit,
+                    "libcxx_url": libcxx_url,
+                    "libcxx_commit": libcxx_commit,
+                    "buildtools_url": buildtools_url,
+                    "buildtools_commit": buildtools_commit,
+                }
+                install_llvm(**install_llvm_args)
 
-        if platform.build.os == "macos":
-            add_path(os.path.join(install_dir, "cmake", "CMake.app", "Contents", "bin"))
-        else:
-            add_path(os.path.join(install_dir, "cmake", "bin"))
+            steps.append(BuildStep("llvm", llvm, deps=["webrtc"]))
 
-        # CUDA
-        if platform.target.os == "windows":
-            install_cuda_args = {
-                "version": version["CUDA_VERSION"],
-                "version_file": os.path.join(install_dir, "cuda.version"),
-                "source_dir": source_dir,
-                "build_dir": build_dir,
-                "install_dir": install_dir,
-            }
-            install_cuda_windows(**install_cuda_args)
+        # ここまでのステップはコンパイラや sysroot なので、以降のビルドはこれらに依存する
+        toolchain = [step.name for step in steps if step.name != "android-sdk-cmdline-tools"]
 
-        # Intel VPL
-        if platform.target.os in ("windows", "ubuntu") and platform.target.arch == "x86_64":
-            install_vpl_args = {
-                "version": version["VPL_VERSION"],
-                "version_file": os.path.join(install_dir, "vpl.version"),
-                "configuration": "Debug" if debug else "Release",
+        # Boost
+        def boost():
+            webrtc_deps = read_version_file(webrtc_info.deps_file)
+            install_boost_args = {
+                "version": version["BOOST_VERSION"],
+                "version_file": os.path.join(install_dir, "boost.version"),
                 "source_dir": source_dir,
                 "build_dir": build_dir,
                 "install_dir": install_dir,
-                "cmake_args": [],
+                "cxx": "",
+                "cflags": [],
+                "cxxflags": [],
+                "linkflags": [],
+                "toolset": "",
+                "visibility": "global",
+                "target_os": "",
+                "debug": debug,
+                "android_ndk": "",
+                "native_api_level": "",
+                "architecture": "x86",
             }
             if platform.target.os == "windows":
-                cxxflags = [
-                    "/DWIN32",
-                    "/D_WINDOWS",
-                    "/W3",
-                    "/GR",
-                    "/EHsc",
-                    "/D_ITERATOR_DEBUG_LEVEL=0",
+                install_boost_args["cxxflags"] = ["-D_ITERATOR_DEBUG_LEVEL=0"]
+                install_boost_args["toolset"] = "msvc"
+                install_boost_args["target_os"] = "windows"
+            elif platform.target.os == "macos":
+                sysroot = cmdcap(["xcrun", "--sdk", "macosx", "--show-sdk-path"])
+                install_boost_args["target_os"] = "darwin"
+                install_boost_args["toolset"] = "clang"
+                install_boost_args["cxx"] = "clang++"
+                install_boost_args["cflags"] = [
+                    f"--sysroot={sysroot}",
+                    f"-mmacosx-version-min={webrtc_deps['MACOS_DEPLOYMENT_TARGET']}",
                 ]
-                install_vpl_args["cmake_args"].append(f"-DCMAKE_CXX_FLAGS={' '.join(cxxflags)}")
-            if platform.target.os == "ubuntu":
-                cmake_args = []
-                cmake_args.append("-DCMAKE_C_COMPILER=clang-18")
-                cmake_args.append("-DCMAKE_CXX_COMPILER=clang++-18")
-                path = cmake_path(os.path.join(webrtc_info.libcxx_dir, "include"))
-                cmake_args.append(f"-DCMAKE_CXX_STANDARD_INCLUDE_DIRECTORIES={path}")
-                flags = [
+                install_boost_args["cxxflags"] = [
+                    "-fPIC",
+                    f"--sysroot={sysroot}",
+                    "-std=gnu++17",
+                    f"-mmacosx-version-min={webrtc_deps['MACOS_DEPLOYMENT_TARGET']}",
+                ]
+                install_boost_args["visibility"] = "hidden"
+                if platform.target.arch == "x86_64":
+                    install_boost_args["cflags"].extend(["-target", "x86_64-apple-darwin"])
+                    install_boost_args["cxxflags"].extend(["-target", "x86_64-apple-darwin"])
+                    install_boost_args["architecture"] = "x86"
+                if platform.target.arch == "arm64":
+                    install_boost_args["cflags"].extend(["-target", "aarch64-apple-darwin"])
+                    install_boost_args["cxxflags"].extend(["-target", "aarch64-apple-darwin"])
+                    install_boost_args["architecture"] = "arm"
+            elif platform.target.os == "ios":
+                install_boost_args["target_os"] = "iphone"
+                install_boost_args["toolset"] = "clang"
+                install_boost_args["cflags"] = [
+                    f"-miphoneos-version-min={webrtc_deps['IOS_DEPLOYMENT_TARGET']}",
+                ]
+                install_boost_args["cxxflags"] = [
+                    "-std=gnu++17",
+                    f"-miphoneos-version-min={webrtc_deps['IOS_DEPLOYMENT_TARGET']}",
+                ]
+                install_boost_args["visibility"] = "hidden"
+            elif platform.target.os == "android":
+                install_boost_args["target_os"] = "android"
+                install_boost_args["cflags"] = [
+                    "-fPIC",
+                ]
+                install_boost_args["cxxflags"] = [
+                    "-fPIC",
+                    "-D_LIBCPP_ABI_NAMESPACE=Cr",
+                    "-D_LIBCPP_ABI_VERSION=2",
+                    "-D_LIBCPP_DISABLE_AVAILABILITY",
+                    "-D_LIBCPP_HARDENING_MODE=_LIBCPP_HARDENING_MODE_EXTENSIVE",
                     "-nostdinc++",
+                    "-std=gnu++17",
+                    f"-isystem{os.path.join(webrtc_info.libcxx_dir, 'include')}",
+                    "-fexperimental-relative-c++-abi-vtables",
+                ]
+                install_boost_args["toolset"] = "clang"
+                install_boost_args["android_ndk"] = os.path.join(install_dir, "android-ndk")
+                install_boost_args["native_api_level"] = version["ANDROID_NATIVE_API_LEVEL"]
+            elif platform.target.os == "jetson":
+                sysroot = os.path.join(install_dir, "rootfs")
+                install_boost_args["target_os"] = "linux"
+                install_boost_args["cxx"] = os.path.join(webrtc_info.clang_dir, "bin", "clang++")
+                install_boost_args["cflags"] = [
+                    "-fPIC",
+                    f"--sysroot={sysroot}",
+                    "--target=aarch64-linux-gnu",
+                    f"-I{os.path.join(sysroot, 'usr', 'include', 'aarch64-linux-gnu')}",
+                ]
+                install_boost_args["cxxflags"] = [
+                    "-fPIC",
+                    "--target=aarch64-linux-gnu",
+                    f"--sysroot={sysroot}",
+                    f"-I{os.path.join(sysroot, 'usr', 'include', 'aarch64-linux-gnu')}",
                     "-D_LIBCPP_ABI_NAMESPACE=Cr",
                     "-D_LIBCPP_ABI_VERSION=2",
                     "-D_LIBCPP_DISABLE_AVAILABILITY",
-                    "-D_LIBCPP_DISABLE_VISIBILITY_ANNOTATIONS",
-                    "-D_LIBCXXABI_DISABLE_VISIBILITY_ANNOTATIONS",
-                    "-D_LIBCPP_ENABLE_NODISCARD",
                     "-D_LIBCPP_HARDENING_MODE=_LIBCPP_HARDENING_MODE_EXTENSIVE",
+                    "-nostdinc++",
+                    "-std=gnu++17",
+                    f"-isystem{os.path.join(webrtc_info.libcxx_dir, 'include')}",
                 ]
-                cmake_args.append(f"-DCMAKE_CXX_FLAGS={' '.join(flags)}")
-                install_vpl_args["cmake_args"] += cmake_args
-            install_vpl(**install_vpl_args)
+                install_boost_args["linkflags"] = [
+                    f"-L{os.path.join(sysroot, 'usr', 'lib', 'aarch64-linux-gnu')}",
+                    f"-B{os.path.join(sysroot, 'usr', 'lib', 'aarch64-linux-gnu')}",
+                ]
+                install_boost_args["toolset"] = "clang"
+                install_boost_args["architecture"] = "arm"
+            else:
+                install_boost_args["target_os"] = "linux"
+                install_boost_args["cxx"] = os.path.join(webrtc_info.clang_dir, "bin", "clang++")
+                install_boost_args["cxxflags"] = [
+                    "-D_LIBCPP_ABI_NAMESPACE=Cr",
+                    "-D_LIBCPP_ABI_VERSION=2",
+                    "-D_LIBCPP_DISABLE_AVAILABILITY",
+                    "-D_LIBCPP_HARDENING_MODE=_LIBCPP_HARDENING_MODE_EXTENSIVE",
+                    "-nostdinc++",
+                    f"-isystem{os.path.join(webrtc_info.libcxx_dir, 'include')}",
+                    "-fPIC",
+                ]
+                install_boost_args["toolset"] = "clang"
+
+            build_and_install_boost(**install_boost_args)
+
+        steps.append(BuildStep("boost", boost, deps=toolchain, build=True))
+
+        # CMake
+        cmake_platform, cmake_ext = get_cmake_platform(platform)
+
+        def cmake():
+            install_cmake_args = {
+                "version": version["CMAKE_VERSION"],
+                "version_file": os.path.join(install_dir, "cmake.version"),
+                "source_dir": source_dir,
+                "install_dir": install_dir,
+                "platform": cmake_platform,
+                "ext": cmake_ext,
+            }
+            install_cmake(**install_cmake_args)
+
+        def setup_cmake():
+            if platform.build.os == "macos":
+                add_path(os.path.join(install_dir, "cmake", "CMake.app", "Contents", "bin"))
+            else:
+                add_path(os.path.join(install_dir, "cmake", "bin"))
+
+        steps.append(BuildStep("cmake", cmake, on_complete=setup_cmake))
+
+        # CUDA
+        if platform.target.os == "windows":
+
+            def cuda():
+                install_cuda_args = {
+                    "version": version["CUDA_VERSION"],
+                    "version_file": os.path.join(install_dir, "cuda.version"),
+                    "source_dir": source_dir,
+                    "build_dir": build_dir,
+                    "install_dir": install_dir,
+                }
+                install_cuda_windows(**install_cuda_args)
+
+            steps.append(BuildStep("cuda", cuda))
+
+        # Intel VPL
+        if platform.target.os in ("windows", "ubuntu") and platform.target.arch == "x86_64":
+
+            def vpl():
+                install_vpl_args = {
+                    "version": version["VPL_VERSION"],
+                    "version_file": os.path.join(install_dir, "vpl.version"),
+                    "configuration": "Debug" if debug else "Release",
+                    "source_dir": source_dir,
+                    "build_dir": build_dir,
+                    "install_dir": install_dir,
+                    "cmake_args": [],
+                }
+                if platform.target.os == "windows":
+                    cxxflags = [
+                        "/DWIN32",
+                        "/D_WINDOWS",
+                        "/W3",
+                        "/GR",
+                        "/EHsc",
+                        "/D_ITERATOR_DEBUG_LEVEL=0",
+                    ]
+                    install_vpl_args["cmake_args"].append(f"-DCMAKE_CXX_FLAGS={' '.join(cxxflags)}")
+                if platform.target.os == "ubuntu":
+                    cmake_args = []
+                    cmake_args.append("-DCMAKE_C_COMPILER=clang-18")
+                    cmake_args.append("-DCMAKE_CXX_COMPILER=clang++-18")
+                    path = cmake_path(os.path.join(webrtc_info.libcxx_dir, "include"))
+                    cmake_args.append(f"-DCMAKE_CXX_STANDARD_INCLUDE_DIRECTORIES={path}")
+                    flags = [
+                        "-nostdinc++",
+                        "-D_LIBCPP_ABI_NAMESPACE=Cr",
+                        "-D_LIBCPP_ABI_VERSION=2",
+                        "-D_LIBCPP_DISABLE_AVAILABILITY",
+                        "-D_LIBCPP_DISABLE_VISIBILITY_ANNOTATIONS",
+                        "-D_LIBCXXABI_DISABLE_VISIBILITY_ANNOTATIONS",
+                        "-D_LIBCPP_ENABLE_NODISCARD",
+                        "-D_LIBCPP_HARDENING_MODE=_LIBCPP_HARDENING_MODE_EXTENSIVE",
+                    ]
+                    cmake_args.append(f"-DCMAKE_CXX_FLAGS={' '.join(flags)}")
+                    install_vpl_args["cmake_args"] += cmake_args
+                install_vpl(**install_vpl_args)
+
+            steps.append(BuildStep("vpl", vpl, deps=toolchain + ["cmake"], build=True))
 
         # OpenH264
-        install_openh264_args = {
-            "version": version["OPENH264_VERSION"],
-            "version_file": os.path.join(install_dir, "openh264.version"),
-            "source_dir": source_dir,
-            "install_dir": install_dir,
-            "is_windows": platform.target.os == "windows",
-        }
-        install_openh264(**install_openh264_args)
+        def openh264():
+            install_openh264_args = {
+                "version": version["OPENH264_VERSION"],
+                "version_file": os.path.join(install_dir, "openh264.version"),
+                "source_dir": source_dir,
+                "install_dir": install_dir,
+                "is_windows": platform.target.os == "windows",
+            }
+            install_openh264(**install_openh264_args)
+
+        steps.append(BuildStep("openh264", openh264))
 
         if platform.target.os == "android":
-            # Android 側からのコールバックする関数は消してはいけないので、
-            # libwebrtc.a の中から消してはいけない関数の一覧を作っておく
-            #
-            # readelf を使って libwebrtc.a の関数一覧を列挙して、その中から Java_org_webrtc_ を含む関数を取り出し、
-            # -Wl,--undefined=<関数名> に加工する。
-            # （-Wl,--undefined はアプリケーションから参照されていなくても関数を削除しないためのフラグ）
-            readelf = os.path.join(
-                install_dir,
-                "android-ndk",
-                "toolchains",
-                "llvm",
-                "prebuilt",
-                "linux-x86_64",
-                "bin",
-                "llvm-readelf",
+
+            def webrtc_ldflags():
+                # Android 側からのコールバックする関数は消してはいけないので、
+                # libwebrtc.a の中から消してはいけない関数の一覧を作っておく
+                #
+                # readelf を使って libwebrtc.a の関数一覧を列挙して、その中から Java_org_webrtc_ を含む関数を取り出し、
+                # -Wl,--undefined=<関数名> に加工する。
+                # （-Wl,--undefined はアプリケーションから参照されていなくても関数を削除しないためのフラグ）
+                readelf = os.path.join(
+                    install_dir,
+                    "android-ndk",
+                    "toolchains",
+                    "llvm",
+                    "prebuilt",
+                    "linux-x86_64",
+                    "bin",
+                    "llvm-readelf",
+                )
+                libwebrtc = os.path.join(webrtc_info.webrtc_library_dir, "arm64-v8a", "libwebrtc.a")
+                m = cmdcap([readelf, "-Ws", libwebrtc])
+                ldflags = []
+                for line in m.splitlines():
+                    if line.find("Java_org_webrtc_") == -1:
+                        continue
+                    # この時点で line は以下のような文字列になっている
+                    #    174: 0000000000000000    44 FUNC    GLOBAL DEFAULT    15 Java_org_webrtc_DataChannel_nativeClose
+                    func = line.split()[7]
+                    ldflags.append(f"-Wl,--undefined={func}")
+                with open(os.path.join(install_dir, "webrtc.ldflags"), "w") as f:
+                    f.write("\n".join(ldflags))
+
+            steps.append(
+                BuildStep("webrtc-ldflags", webrtc_ldflags, deps=["webrtc", "android-ndk"])
             )
-            libwebrtc = os.path.join(webrtc_info.webrtc_library_dir, "arm64-v8a", "libwebrtc.a")
-            m = cmdcap([readelf, "-Ws", libwebrtc])
-            ldflags = []
-            for line in m.splitlines():
-                if line.find("Java_org_webrtc_") == -1:
-                    continue
-                # この時点で line は以下のような文字列になっている
-                #    174: 0000000000000000    44 FUNC    GLOBAL DEFAULT    15 Java_org_webrtc_DataChannel_nativeClose
-                func = line.split()[7]
-                ldflags.append(f"-Wl,--undefined={func}")
-            with open(os.path.join(install_dir, "webrtc.ldflags"), "w") as f:
-                f.write("\n".join(ldflags))
 
         # Blend2D
-        install_blend2d_args = {
-            "version": version["BLEND2D_VERSION"] + "-" + version["ASMJIT_VERSION"],
-            "version_file": os.path.join(install_dir, "blend2d.version"),
-            "configuration": "Debug" if debug else "Release",
-            "source_dir": source_dir,
-            "build_dir": build_dir,
-            "install_dir": install_dir,
-            "blend2d_version": version["BLEND2D_VERSION"],
-            "asmjit_version": version["ASMJIT_VERSION"],
-            "ios": platform.target.package_name == "ios",
-            "cmake_args": [],
-        }
-        install_blend2d_args["cmake_args"] = get_common_cmake_args(
-            platform, version, webrtc_info, install_dir, debug
-        )
-        install_blend2d(**install_blend2d_args)
-
-        # テストできる環境だけ入れる
-        if platform.build.os == platform.target.os and platform.build.arch == platform.target.arch:
-            # Catch2
-            install_catch2_args = {
-                "version": version["CATCH2_VERSION"],
-                "version_file": os.path.join(install_dir, "catch2.version"),
+        def blend2d():
+            install_blend2d_args = {
+                "version": version["BLEND2D_VERSION"] + "-" + version["ASMJIT_VERSION"],
+                "version_file": os.path.join(install_dir, "blend2d.version"),
+                "configuration": "Debug" if debug else "Release",
                 "source_dir": source_dir,
                 "build_dir": build_dir,
                 "install_dir": install_dir,
-                "configuration": "Debug" if debug else "Release",
+                "blend2d_version": version["BLEND2D_VERSION"],
+                "asmjit_version": version["ASMJIT_VERSION"],
+                "ios": platform.target.package_name == "ios",
                 "cmake_args": [],
             }
-            install_catch2_args["cmake_args"] = get_common_cmake_args(
+            install_blend2d_args["cmake_args"] = get_common_cmake_args(
                 platform, version, webrtc_info, install_dir, debug
             )
-            install_catch2(**install_catch2_args)
+            install_blend2d(**install_blend2d_args)
+
+        steps.append(BuildStep("blend2d", blend2d, deps=toolchain + ["cmake"], build=True))
+
+        # テストできる環境だけ入れる
+        if platform.build.os == platform.target.os and platform.build.arch == platform.target.arch:
+
+            def catch2():
+                install_catch2_args = {
+                    "version": version["CATCH2_VERSION"],
+                    "version_file": os.path.join(install_dir, "catch2.version"),
+                    "source_dir": source_dir,
+                    "build_dir": build_dir,
+                    "install_dir": install_dir,
+                    "configuration": "Debug" if debug else "Release",
+                    "cmake_args": [],
+                }
+                install_catch2_args["cmake_args"] = get_common_cmake_args(
+                    platform, version, webrtc_info, install_dir, debug
+                )
+                install_catch2(**install_catch2_args)
+
+            steps.append(BuildStep("catch2", catch2, deps=toolchain + ["cmake"], build=True))
+
+        try:
+            run_build_steps(steps, parallel=parallel)
+        finally:
+            # 使われなかったものや取得に失敗したもの、移動した後の空のディレクトリが
+            # 溜まっていかないように、事前に取得したものを置いたディレクトリを削除する
+            rm_rf(os.path.join(source_dir, "_prefetch"), background=True)
+
+
+# 前回成功したビルドから入力が変わっていないかを判定するためのフィンガープリントのうち、入力の部分。
+#
+# コマンドライン引数、VERSION やビルドスクリプト、
+# ソースツリーのファイルのサイズと更新日時をハッシュする。
+# ビルド中にソースが編集された場合に、編集後のものをビルドしたとみなさないように、
+# ビルドを始める前に計算しておくこと。
+# ファイルの内容は読まないので、何も変わっていない場合はすぐに終わる。
+def get_build_input_fingerprint(args, platform: Platform) -> str:
+    h = hashlib.sha256()
+    h.update(json.dumps(sys.argv[1:]).encode("utf-8"))
+    h.update(get_git_head(BASE_DIR).encode("utf-8"))
+    for file in ["VERSION", "run.py", "buildbase.py", "CMakeLists.txt"]:
+        with open(os.path.join(BASE_DIR, file), "rb") as f:
+            h.update(f.read())
+    sources = ["cmake", "include", "src", "third_party"]
+    if args.test:
+        sources.append("test")
+    if platform.target.os == "android":
+        sources.append("android")
+    if platform.target.os == "jetson":
+        sources.append("multistrap")
+    for dir in sources:
+        h.update(f"[{dir}]\n".encode("utf-8"))
+        hash_file_stats(h, os.path.join(BASE_DIR, dir))
+    return h.hexdigest()
+
+
+# 前回成功したビルドから何も変わっていないかを判定するためのフィンガープリント。
+#
+# get_build_input_fingerprint() で計算した入力の部分に、依存ライブラリのバージョンファイル、
+# Sora のインストール結果などの出力の部分を加えてハッシュする。
+def get_build_fingerprint(
+    input_fingerprint: str, args, build_dir: str, install_dir: str, package_dir: str
+) -> str:
+    h = hashlib.sha256()
+    h.update(input_fingerprint.encode("utf-8"))
+
+    # インストール済みのもの
+    for file in sorted(glob.glob(os.path.join(install_dir, "*.version"))):
+        with open(file, "rb") as f:
+            h.update(f"[{os.path.basename(file)}]\n".encode("utf-8") + f.read())
+    h.update(b"[sora]\n")
+    hash_file_stats(h, os.path.join(install_dir, "sora"))
+    if args.test:
+        h.update(b"[test]\n")
+        hash_file_stats(h, os.path.join(build_dir, "test", "e2e"))
+    if args.package:
+        h.update(b"[package]\n")
+        hash_file_stats(h, package_dir)
+    return h.hexdigest()
+
+
+# パッケージの圧縮形式、拡張子、Content-Type
+def get_package_format(platform: Platform, compression: str) -> Tuple[str, str, str]:
+    if platform.target.os == "windows":
+        return "zip", "zip", "application/zip"
+    if compression == "zstd":
+        return "zstd", "tar.zst", "application/zstd"
+    return "gzip", "tar.gz", "application/gzip"
+
+
+# インストールした Sora と Boost のパッケージを作る。
+#
+# 2 つのアーカイブは並列に作り、同じ内容からは同じアーカイブができるように
+# SOURCE_DATE_EPOCH（無ければ HEAD のコミット時刻）を最終更新時刻にして作る。
+# 各アーカイブの SHA-256 は SHA256SUMS と sora.env に書き出す。
+#
+# アーカイブにしたファイルの一覧は build_dir に保存しておき、
+# インストールしたファイルの内容が前回から変わっていなければ、前回作ったアーカイブをそのまま使う。
+def package(
+    platform: Platform, build_dir: str, install_dir: str, package_dir: str, compression: str
+):
+    mkdir_p(package_dir)
+    rm_rf(os.path.join(package_dir, "sora"))
+
+    version = read_version_file(os.path.join(BASE_DIR, "VERSION"))
+    sora_cpp_sdk_version = version["SORA_CPP_SDK_VERSION"]
+    boost_version = version["BOOST_VERSION"]
+    compression, ext, content_type = get_package_format(platform, compression)
+    mtime = get_source_date_epoch(BASE_DIR)
+
+    package_name = platform.target.package_name
+    archives = {
+        "sora": f"sora-cpp-sdk-{sora_cpp_sdk_version}_{package_name}.{ext}",
+        "boost": f"boost-{boost_version}_sora-cpp-sdk-{sora_cpp_sdk_version}_{package_name}.{ext}",
+    }
+
+    def archive(name: str, archive_name: str) -> str:
+        with trace_span(f"package {archive_name}", "package"):
+            return create_reproducible_archive(
+                os.path.join(package_dir, archive_name),
+                install_dir,
+                list(enum_all_files(os.path.join(install_dir, name), install_dir)),
+                compression,
+                mtime,
+                manifest_path=os.path.join(build_dir, f"package-manifest-{name}.json"),
+            )
+
+    with concurrent.futures.ThreadPoolExecutor(len(archives)) as executor:
+        futures = {name: executor.submit(archive, name, n) for name, n in archives.items()}
+        digests = {name: future.result() for name, future in futures.items()}
+
+    sha256sums = "".join(
+        f"{digests[name]}  {archive_name}\n" for name, archive_name in archives.items()
+    )
+    sora_env = (
+        f"CONTENT_TYPE={content_type}\n"
+        f"PACKAGE_NAME={archives['sora']}\n"
+        f"PACKAGE_SHA256={digests['sora']}\n"
+        f"BOOST_PACKAGE_NAME={archives['boost']}\n"
+        f"BOOST_PACKAGE_SHA256={digests['boost']}\n"
+    )
+    # 内容が変わっていない場合は、最終更新時刻も変えないように書き込まない
+    for filename, content in [("SHA256SUMS", sha256sums), ("sora.env", sora_env)]:
+        path = os.path.join(package_dir, filename)
+        if os.path.exists(path):
+            with open(path) as f:
+                if f.read() == content:
+                    continue
+        with open(path, "w") as f:
+            f.write(content)
+    for name, archive_name in archives.items():
+        logging.info(f"Packaged {archive_name} (sha256: {digests[name]})")
 
 
 AVAILABLE_TARGETS = [
@@ -537,35 +882,222 @@ AVAILABLE_TARGETS = [
 WINDOWS_SDK_VERSION = "10.0.20348.0"
 
 
+def get_platform(target: str) -> Platform:
+    if target == "windows_x86_64":
+        return Platform("windows", get_windows_osver(), "x86_64")
+    elif target == "macos_x86_64":
+        return Platform("macos", get_macos_osver(), "x86_64")
+    elif target == "macos_arm64":
+        return Platform("macos", get_macos_osver(), "arm64")
+    elif target == "ubuntu-20.04_x86_64":
+        return Platform("ubuntu", "20.04", "x86_64")
+    elif target == "ubuntu-22.04_x86_64":
+        return Platform("ubuntu", "22.04", "x86_64")
+    elif target == "ubuntu-20.04_armv8_jetson":
+        return Platform("jetson", None, "armv8")
+    elif target == "ios":
+        return Platform("ios", None, None)
+    elif target == "android":
+        return Platform("android", None, None)
+    else:
+        raise Exception(f"Unknown target {target}")
+
+
+# 複数のターゲットを並列にビルドする。
+#
+# ターゲットごとに run.py を子プロセスで実行し、全体で jobserver の並列数を共有する。
+# 複数のターゲットで使うアーカイブや git リポジトリは、先に 1 回だけ取得しておいて、
+# 子プロセスの prefetch() がそれを利用する。
+# 子プロセスの出力は _build/<target>/run.log に書き出し、
+# 最後にターゲットごとの結果と時間を表示する。
+def build_targets(targets: List[str], args):
+    argv = [arg for arg in sys.argv[1:] if arg not in [*AVAILABLE_TARGETS, "all-linux-hostable"]]
+    configuration = "debug" if args.debug else "release"
+    platforms = {target: get_platform(target) for target in targets}
+
+    if args.trace:
+        start_trace(os.path.join(BASE_DIR, "_build", "trace.json"))
+    start_jobserver()
+
+    shared_prefetch_dir = os.path.join(BASE_DIR, "_source", "_shared_prefetch")
+    remove_stale_trash([os.path.join(BASE_DIR, "_source")])
+    if args.prefetch_jobs > 0:
+        with cd(BASE_DIR):
+            version = read_version_file("VERSION")
+        url_count: Dict[str, int] = {}
+        repository_count: Dict[Tuple[str, str], int] = {}
+        for target, platform in platforms.items():
+            install_dir = os.path.join(
+                BASE_DIR, "_install", platform.target.package_name, configuration
+            )
+            urls, repositories = get_prefetch_deps(
+                platform, version, install_dir, args.webrtc_build_dir
+            )
+            for url in urls:
+                url_count[url] = url_count.get(url, 0) + 1
+            for repository in repositories:
+                repository_count[repository] = repository_count.get(repository, 0) + 1
+        with trace_span("shared prefetch", "deps"):
+            prefetch(
+                [url for url, count in url_count.items() if count > 1],
+                [repository for repository, count in repository_count.items() if count > 1],
+                shared_prefetch_dir,
+                args.prefetch_jobs,
+                shared=True,
+            )
+
+    # 各ターゲットの run.py がマシン全体の CPU とメモリを前提に並列数を決めると、
+    # jobserver を使えない ninja などが同時に動いた時に足りなくなるので、
+    # ターゲットの数で割った分を SORA_BUILD_JOBS と SORA_BUILD_MEMORY で割り当てる。
+    resources = get_build_resources()
+    env = dict(os.environ)
+    env["SORA_BUILD_JOBS"] = str(max(1, get_build_jobs() // len(targets)))
+    if resources.memory is not None:
+        env["SORA_BUILD_MEMORY"] = str(resources.memory // len(targets))
+    logging.info(
+        f"Build budget per target: SORA_BUILD_JOBS={env['SORA_BUILD_JOBS']}, "
+        f"SORA_BUILD_MEMORY={env.get('SORA_BUILD_MEMORY', 'unknown')}"
+    )
+
+    def build(target: str):
+        log_dir = os.path.join(BASE_DIR, "_build", platforms[target].target.package_name)
+        mkdir_p(log_dir)
+        log_path = os.path.join(log_dir, "run.log")
+        logging.info(f"Start building {target}: {log_path}")
+        start = time.time()
+        with trace_span(f"run.py {target}", "target"), open(log_path, "w") as f:
+            r = cmd(
+                [sys.executable, os.path.join(BASE_DIR, "run.py"), target, *argv],
+                stdout=f,
+                stderr=subprocess.STDOUT,
+                env=env,
+                check=False,
+            )
+        elapsed = time.time() - start
+        logging.info(f"Finished building {target} in {elapsed:.1f}s (exit code {r.returncode})")
+        return r.returncode, elapsed, log_path
+
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(len(targets)) as executor:
+        results = dict(zip(targets, executor.map(build, targets)))
+    elapsed = time.time() - start
+    rm_rf(shared_prefetch_dir, background=True)
+    wait_background_deletions()
+
+    lines = [f"{'Target':<30} {'Result':<8} {'Time':>10}  Log"]
+    for target, (returncode, target_elapsed, log_path) in results.items():
+        result = "ok" if returncode == 0 else "failed"
+        lines.append(f"{target:<30} {result:<8} {target_elapsed:>9.1f}s  {log_path}")
+    lines.append(f"{'Total':<30} {'':<8} {elapsed:>9.1f}s")
+    logging.info("Build summary:\n" + "\n".join(lines))
+
+    failed = [target for target, (returncode, _, _) in results.items() if returncode != 0]
+    if len(failed) != 0:
+        raise Exception(f"Failed to build {', '.join(failed)}")
+
+
+# all-linux-hostable で指定される、Linux 上でビルドできるターゲット
+LINUX_HOSTABLE_TARGETS = [
+    "ubuntu-20.04_x86_64",
+    "ubuntu-22.04_x86_64",
+    "ubuntu-20.04_armv8_jetson",
+    "android",
+]
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("target", choices=AVAILABLE_TARGETS)
+    parser.add_argument(
+        "targets",
+        nargs="+",
+        choices=[*AVAILABLE_TARGETS, "all-linux-hostable"],
+        metavar="target",
+        help=f"Targets to build ({', '.join(AVAILABLE_TARGETS)}) or all-linux-hostable. "
+        "Multiple targets are built concurrently.",
+    )
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--relwithdebinfo", action="store_true")
     add_webrtc_build_arguments(parser)
     parser.add_argument("--test", action="store_true")
     parser.add_argument("--run-e2e-test", action="store_true")
     parser.add_argument("--package", action="store_true")
+    parser.add_argument(
+        "--package-compression",
+        choices=["gzip", "zstd"],
+        default="gzip",
+        help="Compression of the package archives (ignored on Windows, which uses zip). "
+        "zstd packages are named *.tar.zst",
+    )
+    parser.add_argument(
+        "--prefetch-jobs",
+        type=int,
+        default=4,
+        help="Number of concurrent downloads used to prefetch dependencies. "
+        "0 disables prefetching.",
+    )
+    parser.add_argument(
+        "--no-parallel-deps",
+        action="store_true",
+        help="Install dependencies one at a time instead of running independent ones in parallel.",
+    )
+    parser.add_argument(
+        "--artifact-cache",
+        help="Local directory or http(s) URL of the cache of built dependencies. "
+        "Overrides SORA_BUILD_ARTIFACT_CACHE.",
+    )
+    parser.add_argument(
+        "--compiler-cache",
+        choices=COMPILER_CACHES,
+        default="none",
+        help="Compiler cache used for Sora, the tests and the dependencies built from source.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run the whole build even if nothing has changed since the last successful build.",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Record the time spent in each build step to _build/<target>/trace.json "
+        "(Chrome trace format) and print the slowest steps.",
+    )
+    parser.add_argument(
+        "--time-trace",
+        action="store_true",
+        help="Compile Sora with clang's -ftime-trace and write the most expensive headers, "
+        "template instantiations and phases to _build/<target>/time-trace-report.md.",
+    )
+    parser.add_argument(
+        "--pch",
+        action="store_true",
+        help="Use precompiled headers for Sora and the tests.",
+    )
+    parser.add_argument(
+        "--unity-build",
+        nargs="?",
+        type=int,
+        const=8,
+        default=0,
+        metavar="N",
+        help="Build Sora as a unity build, merging N sources (8 if omitted) into one "
+        "translation unit. Sources that conflict with each other are built separately.",
+    )
 
     args = parser.parse_args()
-    if args.target == "windows_x86_64":
-        platform = Platform("windows", get_windows_osver(), "x86_64")
-    elif args.target == "macos_x86_64":
-        platform = Platform("macos", get_macos_osver(), "x86_64")
-    elif args.target == "macos_arm64":
-        platform = Platform("macos", get_macos_osver(), "arm64")
-    elif args.target == "ubuntu-20.04_x86_64":
-        platform = Platform("ubuntu", "20.04", "x86_64")
-    elif args.target == "ubuntu-22.04_x86_64":
-        platform = Platform("ubuntu", "22.04", "x86_64")
-    elif args.target == "ubuntu-20.04_armv8_jetson":
-        platform = Platform("jetson", None, "armv8")
-    elif args.target == "ios":
-        platform = Platform("ios", None, None)
-    elif args.target == "android":
-        platform = Platform("android", None, None)
-    else:
-        raise Exception(f"Unknown target {args.target}")
+    if args.artifact_cache is not None:
+        os.environ["SORA_BUILD_ARTIFACT_CACHE"] = args.artifact_cache
+
+    targets = []
+    for target in args.targets:
+        for t in LINUX_HOSTABLE_TARGETS if target == "all-linux-hostable" else [target]:
+            if t not in targets:
+                targets.append(t)
+    if len(targets) > 1:
+        build_targets(targets, args)
+        return
+    args.target = targets[0]
+    platform = get_platform(args.target)
 
     logging.info(f"Build platform: {platform.build.package_name}")
     logging.info(f"Target platform: {platform.target.package_name}")
@@ -579,16 +1111,44 @@ def main():
     mkdir_p(source_dir)
     mkdir_p(build_dir)
     mkdir_p(install_dir)
+    remove_stale_trash([source_dir, install_dir])
 
-    install_deps(
-        platform,
-        source_dir,
-        build_dir,
-        install_dir,
-        args.debug,
-        webrtc_build_dir=args.webrtc_build_dir,
-        webrtc_build_args=args.webrtc_build_args,
-    )
+    # 前回成功したビルドから何も変わっていなければ何もしない。
+    # E2E テストは毎回実行する必要があり、ローカルの webrtc-build の変更は検出できないので、
+    # これらの場合は常にビルドする。
+    fingerprint_path = os.path.join(build_dir, "run.fingerprint")
+    use_fingerprint = not args.force and not args.run_e2e_test and args.webrtc_build_dir is None
+    if use_fingerprint:
+        input_fingerprint = get_build_input_fingerprint(args, platform)
+    if use_fingerprint and os.path.exists(fingerprint_path):
+        with open(fingerprint_path) as f:
+            last_fingerprint = f.read().strip()
+        if last_fingerprint == get_build_fingerprint(
+            input_fingerprint, args, build_dir, install_dir, package_dir
+        ):
+            logging.info("Nothing has changed since the last successful build")
+            return
+    rm_rf(fingerprint_path)
+
+    if args.trace:
+        start_trace(os.path.join(BASE_DIR, "_build", dir, "trace.json"))
+
+    # 並列に実行する依存ライブラリのビルドや Sora のビルドで、同じ並列数を共有する
+    start_jobserver()
+    start_compiler_cache(args.compiler_cache, dir)
+
+    with trace_span("install_deps", "deps"):
+        install_deps(
+            platform,
+            source_dir,
+            build_dir,
+            install_dir,
+            args.debug,
+            webrtc_build_dir=args.webrtc_build_dir,
+            webrtc_build_args=args.webrtc_build_args,
+            prefetch_jobs=args.prefetch_jobs,
+            parallel=not args.no_parallel_deps,
+        )
 
     configuration = "Release"
     if args.debug:
@@ -596,11 +1156,33 @@ def main():
     if args.relwithdebinfo:
         configuration = "RelWithDebInfo"
 
+    generator = get_cmake_generator(platform.target.os)
+
     sora_build_dir = os.path.join(build_dir, "sora")
     mkdir_p(sora_build_dir)
     with cd(sora_build_dir):
         cmake_args = []
+        if generator is not None:
+            cmake_args += ["-G", generator]
+        if generator == "Ninja":
+            cmake_args += get_cmake_job_pool_args()
         cmake_args.append(f"-DCMAKE_BUILD_TYPE={configuration}")
+        cmake_args.append(f"-DSORA_TIME_TRACE={'ON' if args.time_trace else 'OFF'}")
+        cmake_args.append(f"-DSORA_PCH={'ON' if args.pch else 'OFF'}")
+        cmake_args.append(f"-DSORA_UNITY_BUILD_BATCH_SIZE={args.unity_build}")
+        unity_build_exclude = []
+        if args.unity_build > 0:
+            with cd(BASE_DIR):
+                sources = sorted(
+                    glob.glob(os.path.join("src", "**", "*.cpp"), recursive=True)
+                    + glob.glob(os.path.join("src", "**", "*.mm"), recursive=True)
+                    + glob.glob(os.path.join("third_party", "**", "*.cpp"), recursive=True)
+                )
+                unity_build_exclude = find_unity_build_conflicts(sources)
+            logging.info(f"Sources excluded from the unity build: {unity_build_exclude}")
+        cmake_args.append(
+            f"-DSORA_UNITY_BUILD_EXCLUDE={';'.join(cmake_path(p) for p in unity_build_exclude)}"
+        )
         cmake_args.append(f"-DCMAKE_INSTALL_PREFIX={cmake_path(os.path.join(install_dir, 'sora'))}")
         cmake_args.append(f"-DBOOST_ROOT={cmake_path(os.path.join(install_dir, 'boost'))}")
         webrtc_platform = get_webrtc_platform(platform)
@@ -612,7 +1194,7 @@ def main():
         with cd(BASE_DIR):
             version = read_version_file("VERSION")
             sora_cpp_sdk_version = version["SORA_CPP_SDK_VERSION"]
-            sora_cpp_sdk_commit = cmdcap(["git", "rev-parse", "HEAD"])
+            sora_cpp_sdk_commit = get_git_head(BASE_DIR)
             android_native_api_level = version["ANDROID_NATIVE_API_LEVEL"]
         cmake_args.append(f"-DWEBRTC_INCLUDE_DIR={cmake_path(webrtc_info.webrtc_include_dir)}")
         cmake_args.append(f"-DWEBRTC_LIBRARY_DIR={cmake_path(webrtc_info.webrtc_library_dir)}")
@@ -717,43 +1299,59 @@ def main():
             cmake_args.append("-DUSE_VPL_ENCODER=ON")
             cmake_args.append(f"-DVPL_ROOT_DIR={cmake_path(os.path.join(install_dir, 'vpl'))}")
 
-        # バンドルされたライブラリを消しておく
-        # （CMake でうまく依存関係を解消できなくて更新されないため）
-        rm_rf(os.path.join(sora_build_dir, "bundled"))
-        rm_rf(os.path.join(sora_build_dir, "libsora.a"))
-
-        cmd(["cmake", BASE_DIR] + cmake_args)
+        with trace_span("sora configure", "cmake"):
+            cmake_configure(BASE_DIR, cmake_args, [os.path.join(BASE_DIR, "cmake")])
         if platform.target.os == "ios":
-            cmd(
-                [
-                    "cmake",
-                    "--build",
-                    ".",
-                    f"-j{multiprocessing.cpu_count()}",
-                    "--config",
-                    configuration,
-                    "--target",
-                    "sora",
-                    "--",
-                    "-arch",
-                    "arm64",
-                    "-sdk",
-                    "iphoneos",
-                ]
-            )
-            cmd(["cmake", "--install", "."])
+            with trace_span("sora build", "cmake"):
+                cmd(
+                    [
+                        "cmake",
+                        "--build",
+                        ".",
+                        f"-j{get_build_jobs()}",
+                        "--config",
+                        configuration,
+                        "--target",
+                        "sora",
+                        "--",
+                        "-arch",
+                        "arm64",
+                        "-sdk",
+                        "iphoneos",
+                    ]
+                )
+            with trace_span("sora install", "cmake"):
+                cmd(["cmake", "--install", "."])
         else:
-            cmd(
-                [
-                    "cmake",
-                    "--build",
-                    ".",
-                    f"-j{multiprocessing.cpu_count()}",
-                    "--config",
-                    configuration,
-                ]
+            with trace_span("sora build", "cmake"):
+                cmd(
+                    [
+                        "cmake",
+                        "--build",
+                        ".",
+                        *get_build_jobs_args(generator),
+                        "--config",
+                        configuration,
+                    ]
+                )
+            if generator == "Ninja":
+                report_ninja_build(
+                    sora_build_dir,
+                    build_dir,
+                    "sora",
+                    options={"pch": args.pch, "unity_build": args.unity_build},
+                )
+            with trace_span("sora install", "cmake"):
+                cmd(["cmake", "--install", ".", "--config", configuration])
+
+        if args.time_trace:
+            if args.compiler_cache != "none":
+                logging.warning(
+                    "Files restored from the compiler cache have no -ftime-trace output"
+                )
+            report_time_trace(
+                sora_build_dir, os.path.join(BASE_DIR, "_build", dir, "time-trace-report.md")
             )
-            cmd(["cmake", "--install", ".", "--config", configuration])
 
         # バンドルされたライブラリをインストールする
         if platform.target.os == "windows":
@@ -813,7 +1411,12 @@ def main():
             mkdir_p(test_build_dir)
             with cd(test_build_dir):
                 cmake_args = []
+                if generator is not None:
+                    cmake_args += ["-G", generator]
+                if generator == "Ninja":
+                    cmake_args += get_cmake_job_pool_args()
                 cmake_args.append(f"-DCMAKE_BUILD_TYPE={configuration}")
+                cmake_args.append(f"-DSORA_PCH={'ON' if args.pch else 'OFF'}")
                 cmake_args.append(f"-DBOOST_ROOT={cmake_path(os.path.join(install_dir, 'boost'))}")
                 cmake_args.append(
                     f"-DCATCH2_ROOT={cmake_path(os.path.join(install_dir, 'catch2'))}"
@@ -896,17 +1499,25 @@ def main():
                 ):
                     cmake_args.append("-DTEST_E2E=ON")
 
-                cmd(["cmake", os.path.join(BASE_DIR, "test")] + cmake_args)
-                cmd(
-                    [
-                        "cmake",
-                        "--build",
-                        ".",
-                        f"-j{multiprocessing.cpu_count()}",
-                        "--config",
-                        configuration,
-                    ]
-                )
+                with trace_span("test configure", "cmake"):
+                    cmake_configure(
+                        os.path.join(BASE_DIR, "test"),
+                        cmake_args,
+                        [os.path.join(install_dir, "sora", "share", "cmake")],
+                    )
+                with trace_span("test build", "cmake"):
+                    cmd(
+                        [
+                            "cmake",
+                            "--build",
+                            ".",
+                            *get_build_jobs_args(generator),
+                            "--config",
+                            configuration,
+                        ]
+                    )
+                if generator == "Ninja":
+                    report_ninja_build(test_build_dir, build_dir, "test", options={"pch": args.pch})
 
                 if args.run_e2e_test:
                     if (
@@ -919,44 +1530,18 @@ def main():
                             cmd([os.path.join(test_build_dir, "e2e")])
 
     if args.package:
-        mkdir_p(package_dir)
-        rm_rf(os.path.join(package_dir, "sora"))
-        rm_rf(os.path.join(package_dir, "sora.env"))
+        package(platform, build_dir, install_dir, package_dir, args.package_compression)
 
-        with cd(BASE_DIR):
-            version = read_version_file("VERSION")
-            sora_cpp_sdk_version = version["SORA_CPP_SDK_VERSION"]
-            boost_version = version["BOOST_VERSION"]
-
-        def archive(archive_path, files, is_windows):
-            if is_windows:
-                with zipfile.ZipFile(archive_path, "w") as f:
-                    for file in files:
-                        f.write(filename=file, arcname=file)
-            else:
-                with tarfile.open(archive_path, "w:gz") as f:
-                    for file in files:
-                        f.add(name=file, arcname=file)
-
-        ext = "zip" if platform.target.os == "windows" else "tar.gz"
-        is_windows = platform.target.os == "windows"
-        content_type = "application/zip" if platform.target.os == "windows" else "application/gzip"
+    # rm_rf(background=True) で削除しているディレクトリの削除が終わるのを待つ
+    with trace_span("wait background deletions", "rm_rf"):
+        wait_background_deletions()
 
-        with cd(install_dir):
-            archive_name = (
-                f"sora-cpp-sdk-{sora_cpp_sdk_version}_{platform.target.package_name}.{ext}"
-            )
-            archive_path = os.path.join(package_dir, archive_name)
-            archive(archive_path, enum_all_files("sora", "."), is_windows)
-
-            boost_archive_name = f"boost-{boost_version}_sora-cpp-sdk-{sora_cpp_sdk_version}_{platform.target.package_name}.{ext}"
-            boost_archive_path = os.path.join(package_dir, boost_archive_name)
-            archive(boost_archive_path, enum_all_files("boost", "."), is_windows)
-
-            with open(os.path.join(package_dir, "sora.env"), "w") as f:
-                f.write(f"CONTENT_TYPE={content_type}\n")
-                f.write(f"PACKAGE_NAME={archive_name}\n")
-                f.write(f"BOOST_PACKAGE_NAME={boost_archive_name}\n")
+    if use_fingerprint:
+        fingerprint = get_build_fingerprint(
+            input_fingerprint, args, build_dir, install_dir, package_dir
+        )
+        with open(fingerprint_path, "w") as f:
+            f.write(fingerprint)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,23 @@
+#ifndef SORA_PCH_H_
+#define SORA_PCH_H_
+
+// SORA_PCH=ON の場合にプリコンパイルするヘッダー
+//
+// ほぼ全てのソースでインクルードしている重いヘッダーだけを入れること
+
+#include <functional>
+#include <memory>
+#include <string>
+#include <vector>
+
+// Boost
+#include <boost/asio/io_context.hpp>
+#include <boost/beast/websocket/stream.hpp>
+#include <boost/json.hpp>
+
+// WebRTC
+#include <api/peer_connection_interface.h>
+#include <api/scoped_refptr.h>
+#include <rtc_base/logging.h>
+
+#endif
@@ -0,0 +1,116 @@
+# buildbase.download_and_extract() のストリーミングでの展開が、
+# download() してから extract() した場合と同じ結果になることを確認する。
+#
+# http.server でローカルに tar.gz を配信して、両方の方法で展開したディレクトリと
+# 保存したアーカイブをバイト単位で比較する。
+#
+# python3 test/buildbase_download_and_extract_test.py
+import filecmp
+import functools
+import http.server
+import io
+import os
+import sys
+import tarfile
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import buildbase  # noqa: E402
+
+
+def make_tarball(path: str):
+    with tarfile.open(path, "w:gz") as t:
+        files = {
+            "pkg/README": b"hello\n",
+            "pkg/include/a.h": b"#pragma once\n" * 1000,
+            "pkg/lib/libfoo.a": os.urandom(3 * 1024 * 1024),
+            "pkg/empty": b"",
+        }
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            t.addfile(info, io.BytesIO(data))
+        info = tarfile.TarInfo("pkg/bin/tool")
+        info.size = 4
+        info.mode = 0o755
+        t.addfile(info, io.BytesIO(b"#!/\n"))
+        info = tarfile.TarInfo("pkg/lib/libfoo.so")
+        info.type = tarfile.SYMTYPE
+        info.linkname = "libfoo.a"
+        t.addfile(info)
+
+
+def list_tree(root: str):
+    result = []
+    for dir, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(dirs + files):
+            path = os.path.join(dir, name)
+            st = os.lstat(path)
+            link = os.readlink(path) if os.path.islink(path) else None
+            result.append((os.path.relpath(path, root), st.st_mode, link))
+    return result
+
+
+class DownloadAndExtractTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        # ダウンロードストアを使わないようにする
+        self._cache_dir = os.environ.get("SORA_BUILD_CACHE_DIR")
+        os.environ["SORA_BUILD_CACHE_DIR"] = ""
+
+        serve_dir = os.path.join(self.tmp, "serve")
+        os.makedirs(serve_dir)
+        make_tarball(os.path.join(serve_dir, "pkg.tar.gz"))
+        handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=serve_dir)
+        handler.log_message = lambda *args: None
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/pkg.tar.gz"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._cache_dir is None:
+            del os.environ["SORA_BUILD_CACHE_DIR"]
+        else:
+            os.environ["SORA_BUILD_CACHE_DIR"] = self._cache_dir
+        self._tmp.cleanup()
+
+    def test_same_as_download_then_extract(self):
+        stream_source = os.path.join(self.tmp, "stream", "source")
+        stream_install = os.path.join(self.tmp, "stream", "install")
+        os.makedirs(stream_source)
+        with self.assertLogs(level="INFO") as logs:
+            stream_archive = buildbase.download_and_extract(
+                self.url, stream_source, output_dir=stream_install, output_dirname="pkg"
+            )
+        self.assertTrue(
+            any("Download and extract" in line for line in logs.output),
+            "download_and_extract() did not use the streaming path",
+        )
+
+        plain_source = os.path.join(self.tmp, "plain", "source")
+        plain_install = os.path.join(self.tmp, "plain", "install")
+        os.makedirs(plain_source)
+        plain_archive = buildbase.download(self.url, plain_source)
+        buildbase.extract(plain_archive, output_dir=plain_install, output_dirname="pkg")
+
+        self.assertTrue(filecmp.cmp(stream_archive, plain_archive, shallow=False))
+        stream_dir = os.path.join(stream_install, "pkg")
+        plain_dir = os.path.join(plain_install, "pkg")
+        self.assertEqual(list_tree(stream_dir), list_tree(plain_dir))
+        for relpath, _, link in list_tree(plain_dir):
+            a = os.path.join(stream_dir, relpath)
+            b = os.path.join(plain_dir, relpath)
+            if link is None and os.path.isfile(b):
+                self.assertTrue(filecmp.cmp(a, b, shallow=False), relpath)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,17 @@
+#ifndef SORA_TEST_PCH_H_
+#define SORA_TEST_PCH_H_
+
+// SORA_PCH=ON の場合にプリコンパイルするヘッダー
+
+#include <fstream>
+#include <iostream>
+#include <memory>
+#include <string>
+
+// WebRTC
+#include <rtc_base/logging.h>
+
+// Sora
+#include <sora/sora_client_context.h>
+
+#endif